@@ -13,7 +13,13 @@ import warnings
 import gc
 import os
 import psutil
-from utils.loaders import load_data, load_m30_data
+from utils.loaders import load_all
+from utils.queries import QuerySpec
+from utils.db import pool_metrics
+from utils.sketches import DistinctSketchStore, QuantileSketchStore, ERROR_HLL, K_KLL, precision_for_error
+from utils.sketch_cache import daily_sketches
+from utils.bitmaps import BitmapIndex
+from utils.histograms import speed_histogram_cube, speed_distribution, TODAS_LAS_HORAS
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 # Configuración de página
@@ -65,13 +71,26 @@ def load_kepler_config_trayectorias():
         st.error("No se pudo cargar la configuración del mapa")
         return {}
 
+# Columnas y ventana que necesita esta página (se filtran en la base de datos)
+CAM_SEMANA = QuerySpec(
+    "cam_ref_message",
+    columnas=("id", "station_id", "name_osmid", "latitude", "longitude", "altitude", "heading",
+              "speed_kmh", "fclass", "hour"),
+    dias=7
+)
+DENM_SEMANA = QuerySpec(
+    "denm_ref_message",
+    columnas=("station_id", "latitude", "longitude", "cause_desc", "subcause_desc"),
+    dias=7
+)
+
 # Optimización: Cache para datos procesados
 @st.cache_data(ttl=300)  # Cache por 5 minutos
 def process_data():
     """Procesa y filtra los datos principales"""
     try:
-        df, df_denm = load_data()
-        m30 = load_m30_data()
+        # CAM, DENM y geometría M30 se cargan en paralelo
+        df, df_denm, m30, tiempos_carga = load_all(CAM_SEMANA, DENM_SEMANA)
         
         # Procesamiento básico
         df['received_at'] = pd.to_datetime(df['received_at'])
@@ -92,22 +111,48 @@ def process_data():
         df_ultima_semana["velocidad_rango"] = df_ultima_semana["speed_kmh"].apply(clasificar_velocidad)
         df_ultima_semana["date"] = df_ultima_semana["received_at"].dt.date
         
-        return df_ultima_semana, df_cam_filtrado, m30, df_denm
+        return df_ultima_semana, df_cam_filtrado, m30, df_denm, tiempos_carga
         
     except Exception as e:
         st.error(f"Error al cargar los datos: {str(e)}")
         st.stop()
 
+@st.cache_resource(ttl=300)
+def build_distinct_index(df_ultima_semana):
+    """Índice de vehículos distintos por (fecha, hora, tramo) de la semana.
+
+    Con `distinct_counts = "exact"` en secrets se usa el índice de bitmaps
+    (conteos exactos, reconstruido desde las filas); por defecto, sketches
+    HyperLogLog persistidos por día, de los que solo se recalculan hoy y ayer.
+    """
+    if st.secrets.get("distinct_counts", "hll") == "exact":
+        return BitmapIndex.from_frame(df_ultima_semana)
+    return daily_sketches(
+        "hll_fecha_hora_tramo", df_ultima_semana, DistinctSketchStore.from_frame,
+        version=f"p{precision_for_error(ERROR_HLL)}"
+    )
+
+@st.cache_resource(ttl=300)
+def build_speed_sketches(df_ultima_semana):
+    """Sketches KLL de velocidad por hora, persistidos por día; V85 se obtiene fusionándolos."""
+    return daily_sketches(
+        "kll_velocidad_hora", df_ultima_semana,
+        lambda filas: QuantileSketchStore.from_frame(filas, ["hour_label"]),
+        version=f"k{K_KLL}"
+    )
+
 @st.cache_data(ttl=300)
 def calculate_kpis(df_ultima_semana):
     """Calcula todos los KPIs necesarios"""
+    distintos = build_distinct_index(df_ultima_semana)
     last_update = df_ultima_semana["date"].max()
-    last_update2 = df_ultima_semana["day"].max()
-    total_ultimo_dia = df_ultima_semana[df_ultima_semana["day"] == last_update2]["station_id"].nunique()
-    total_semana = df_ultima_semana["station_id"].nunique()
+    total_ultimo_dia = distintos.count(fechas=[last_update])
+    total_semana = distintos.count()
 
-    # Hora pico
-    df_por_hora_dia = df_ultima_semana.groupby(["date", "hour_label"])["station_id"].nunique().reset_index(name="vehículos")
+    # Hora pico (vehículos distintos por fecha y hora)
+    df_por_hora_dia = distintos.count_by(["date", "hour"])
+    df_por_hora_dia["date"] = df_por_hora_dia["date"].dt.date
+    df_por_hora_dia = df_por_hora_dia[["date", "hour_label", "vehículos"]]
     fila_pico = df_por_hora_dia.loc[df_por_hora_dia["vehículos"].idxmax()]
     hora_pico = fila_pico["hour_label"]
     fecha_pico = fila_pico["date"]
@@ -143,64 +188,16 @@ def prepare_traffic_chart_data(df_por_hora_dia):
     df_chart = df_por_hora_dia.copy()
     df_chart["date"] = pd.to_datetime(df_chart["date"])
     df_chart["datetime"] = pd.to_datetime(
-        df_chart["date"].astype(str) + " " + df_chart["hour_label"]
+        df_chart["date"].astype(str) + " " + df_chart["hour_label"].astype(str)
     )
     return df_chart
 
-def crear_bins_velocidad(velocidad):
-    """Crea bins de velocidad de 5 en 5 km/h"""
-    if pd.isna(velocidad):
-        return "Sin datos"
-    
-    bin_start = int(velocidad // 5) * 5
-    bin_end = bin_start + 5
-    
-    if bin_start >= 100:
-        return "100+ km/h"
-    
-    return f"{bin_start}-{bin_end} km/h"
-
 @st.cache_data(ttl=300)
-def calculate_speed_distribution(df_ultima_semana, hora_seleccionada):
-    """Calcula distribución de velocidades para una hora específica"""
-    if hora_seleccionada == "Todas las horas":
-        df_filtrado = df_ultima_semana.copy()
-    else:
-        df_filtrado = df_ultima_semana[df_ultima_semana["hour_label"] == hora_seleccionada].copy()
-    
-    if df_filtrado.empty:
-        return None, None, None
-    
-    # Agregar bins de velocidad
-    df_filtrado["velocidad_bins"] = df_filtrado["speed_kmh"].apply(crear_bins_velocidad)
-    
-    # Calcular estadísticas
-    velocidad_counts = df_filtrado["velocidad_bins"].value_counts()
-    total_vehiculos = len(df_filtrado)
-    velocidad_percentages = (velocidad_counts / total_vehiculos * 100).round(1)
-    
-    # Ordenar bins
-    orden_bins = []
-    for i in range(0, 105, 5):
-        bin_name = "100+ km/h" if i >= 100 else f"{i}-{i+5} km/h"
-        if bin_name in velocidad_percentages.index:
-            orden_bins.append(bin_name)
-    
-    velocidad_percentages = velocidad_percentages.reindex(orden_bins).fillna(0)
-    
-    # Estadísticas adicionales
-    stats = {
-        'velocidad_media': df_filtrado["speed_kmh"].mean(),
-        'velocidad_v85': df_filtrado["speed_kmh"].quantile(0.85),
-        'bin_mas_comun': velocidad_percentages.idxmax(),
-        'porcentaje_bin_comun': velocidad_percentages.max()
-    }
-    
-    # Liberar memoria
-    del df_filtrado
-    gc.collect()
-    
-    return velocidad_percentages, stats, df_filtrado
+def calculate_speed_histograms(df_ultima_semana):
+    """Cubo hora × bin de 5 km/h con todas las distribuciones de velocidad"""
+    return speed_histogram_cube(
+        df_ultima_semana["hour_label"].cat.codes, df_ultima_semana["speed_kmh"]
+    )
 
 @st.cache_data(ttl=600)  # Cache por 10 minutos para el mapa
 def prepare_map_data(df_ultima_semana):
@@ -233,7 +230,13 @@ with st.sidebar:
     st.metric("Memoria en uso", show_memory_usage())
 
 # Cargar y procesar datos
-df_ultima_semana, df_cam_filtrado, m30, df_denm = process_data()
+df_ultima_semana, df_cam_filtrado, m30, df_denm, tiempos_carga = process_data()
+
+# Estado del pool de conexiones (tras la carga)
+with st.sidebar:
+    metricas_pool = pool_metrics()
+    st.metric("Conexiones BD en uso", f"{metricas_pool['en_uso']}/{metricas_pool['tamaño']}")
+    st.caption(" · ".join(f"{nombre.upper()}: {seg:.1f} s" for nombre, seg in tiempos_carga.items()))
 
 # Configuraciones
 orden_dias = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
@@ -379,9 +382,12 @@ st.markdown('<h3 class="section-title">  Distribución de Velocidades</h3>', uns
 # Crear selector de hora
 col_hora, col_info = st.columns([3, 1])
 
+# Todas las distribuciones salen del mismo cubo hora × bin
+cubo_velocidades, totales_hora, medias_hora = calculate_speed_histograms(df_ultima_semana)
+
 with col_hora:
-    horas_disponibles = sorted(df_ultima_semana["hour_label"].unique())
-    horas_opciones = ["Todas las horas"] + horas_disponibles
+    horas_disponibles = [h for h in totales_hora.index[:-1] if totales_hora[h] > 0]
+    horas_opciones = [TODAS_LAS_HORAS] + horas_disponibles
     
     hora_seleccionada = st.selectbox(
         "Selecciona la hora:",
@@ -391,32 +397,12 @@ with col_hora:
     )
 
 # Calcular distribución de velocidades
-titulo_hora = "todas las horas" if hora_seleccionada == "Todas las horas" else f"las {hora_seleccionada}"
+titulo_hora = "todas las horas" if hora_seleccionada == TODAS_LAS_HORAS else f"las {hora_seleccionada}"
 
-# Usar función cacheada para la distribución
-if hora_seleccionada == "Todas las horas":
-    df_temp = df_ultima_semana.copy()
-else:
-    df_temp = df_ultima_semana[df_ultima_semana["hour_label"] == hora_seleccionada].copy()
-
-if df_temp.empty:
+if totales_hora[hora_seleccionada] == 0:
     st.warning(f"No hay datos disponibles para {titulo_hora}")
 else:
-    # Calcular bins y estadísticas
-    df_temp["velocidad_bins"] = df_temp["speed_kmh"].apply(crear_bins_velocidad)
-    
-    velocidad_counts = df_temp["velocidad_bins"].value_counts()
-    total_vehiculos = len(df_temp)
-    velocidad_percentages = (velocidad_counts / total_vehiculos * 100).round(1)
-    
-    # Ordenar bins
-    orden_bins = []
-    for i in range(0, 105, 5):
-        bin_name = "100+ km/h" if i >= 100 else f"{i}-{i+5} km/h"
-        if bin_name in velocidad_percentages.index:
-            orden_bins.append(bin_name)
-    
-    velocidad_percentages = velocidad_percentages.reindex(orden_bins).fillna(0)
+    velocidad_percentages = speed_distribution(cubo_velocidades, totales_hora, hora_seleccionada)
     
     # Crear dos columnas para mostrar estadísticas y gráfico
     col_grafico, col_stats = st.columns([3, 1])
@@ -468,8 +454,9 @@ else:
     
     with col_stats:
         # Calcular estadísticas
-        velocidad_media = df_temp["speed_kmh"].mean()
-        velocidad_v85 = df_temp["speed_kmh"].quantile(0.85)
+        velocidad_media = medias_hora[hora_seleccionada]
+        filtro_hora = {} if hora_seleccionada == TODAS_LAS_HORAS else {"hour_label": [hora_seleccionada]}
+        velocidad_v85 = build_speed_sketches(df_ultima_semana).quantile(0.85, **filtro_hora)
         
         st.markdown(f"""
         <div style="padding: 15px; border-radius: 10px; margin-bottom: 10px;">
@@ -482,10 +469,6 @@ else:
             <span style="font-size: 1.5em; ">{velocidad_v85:.1f} km/h</span>
         </div>
         """, unsafe_allow_html=True)
-    
-    # Liberar memoria temporal
-    del df_temp
-    gc.collect()
 
 # Mostrar tabla resumen expandible
 with st.expander("Ver tabla detallada de distribución", expanded=False):
@@ -3,14 +3,26 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import streamlit.components.v1 as components
-import geopandas as gpd
 import json
 from keplergl import KeplerGl
 import warnings
 import psutil
 import os
 import gc
-from utils.loaders import load_data, load_m30_data
+from utils.loaders import load_all
+from utils.queries import QuerySpec
+from utils.rollups import (
+    refresh_rollups, read_conteo_dias, read_vehiculos_dia_hora,
+    read_vehiculos_dia, read_informe_dia, read_tramos, read_percentiles_velocidad
+)
+from utils.db import get_engine
+from utils.normalize import ORDEN_DIAS, HOUR_CATEGORIES, add_hora_label
+from utils.schema import memory_report
+from utils.indexes import TramoIndex
+from utils.aggregations import AggSpec, REGISTRO
+from utils.denm_spatial import add_osm_id
+from utils.geometry_store import get_geometry_store
+from utils.segment_tables import COLUMNAS_KEPLER_VELOCIDADES, load_segment_table
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
@@ -45,110 +57,78 @@ def clasificar_velocidad(v):
     else:
         return "🔵 70-90+ km/h"
 
-def optimize_dataframe_memory(df):
-    """Optimiza el uso de memoria de un DataFrame."""
-    original_memory = df.memory_usage(deep=True).sum() / 1024**2
-    
-    for col in df.columns:
-        if df[col].dtype == 'object':
-            try:
-                df[col] = pd.to_numeric(df[col], downcast='integer')
-            except:
-                try:
-                    df[col] = pd.to_numeric(df[col], downcast='float')
-                except:
-                    # Convertir strings a category si hay muchos valores repetidos
-                    if df[col].nunique() / len(df) < 0.5:
-                        df[col] = df[col].astype('category')
-        elif df[col].dtype == 'int64':
-            df[col] = pd.to_numeric(df[col], downcast='integer')
-        elif df[col].dtype == 'float64':
-            df[col] = pd.to_numeric(df[col], downcast='float')
-    
-    new_memory = df.memory_usage(deep=True).sum() / 1024**2
-    print(f"Memoria optimizada: {original_memory:.1f}MB -> {new_memory:.1f}MB")
-    return df
-
 # ---------------------------
 # Carga de datos con caching y optimización
 # ---------------------------
+# Columnas que usa esta página; la ventana es todo el histórico. El tráfico
+# CAM (conteos, medias, percentiles y día tipo por tramo) sale de las tablas
+# resumen, así que solo se cargan los eventos DENM
+DENM_HISTORICO = QuerySpec(
+    "denm_ref_message",
+    columnas=("id", "station_id", "latitude", "longitude", "weekday_es",
+              "cause_desc", "subcause_desc")
+)
+
 @st.cache_data(max_entries=1, ttl=3600)  # Limitar entradas en caché
 def cached_load_data():
     """Carga los datos principales y aplica transformaciones iniciales."""
-    df, df_denm = load_data()
+    # DENM y geometría M30 se cargan en paralelo, ya con tipos compactos (sin CAM)
+    _, df_denm, m30, _ = load_all(None, DENM_HISTORICO)
 
-    # Optimizar memoria inmediatamente después de cargar
-    df = optimize_dataframe_memory(df)
-    df_denm = optimize_dataframe_memory(df_denm)
+    # Categorías globales para `weekday_es` y `hour_label` (ya aplicadas al normalizar)
+    orden_dias = ORDEN_DIAS
+    hour_categories = HOUR_CATEGORIES
 
-    # Definir categorías globales para `weekday_es` y `hour_label`
-    orden_dias = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
-    hour_categories = [f"{h:02d}:00" for h in range(24)]
-
-    # Aplicar transformaciones necesarias una sola vez
-    df["day"] = pd.to_datetime(df["day"])
-    df["weekday_es"] = pd.Categorical(df["weekday_es"], categories=orden_dias, ordered=True)
-    
-    if 'hour' in df.columns:
-        df["hour_label"] = df["hour"].apply(lambda h: f"{h:02d}:00")
-        df["hour_label"] = pd.Categorical(df["hour_label"], categories=hour_categories, ordered=True)
+    # Transformaciones propias de esta página
+    df_denm = add_hora_label(df_denm)
 
-    if 'received_at' in df_denm.columns:
-        df_denm["tramo_horario"] = df_denm["received_at"].dt.floor("1H")
-        df_denm["hora_label"] = df_denm["tramo_horario"].dt.strftime("%H:%M")
-        df_denm["hora_label"] = pd.Categorical(df_denm["hora_label"], categories=hour_categories, ordered=True)
-        if 'weekday_es' in df_denm.columns:
-            df_denm["weekday_es"] = pd.Categorical(df_denm["weekday_es"], categories=orden_dias, ordered=True)
+    # Tramo de cada evento DENM (unión espacial persistida), con la misma clave
+    # que CAM: el nombre del tramo en el almacén de geometrías
+    df_denm = pd.DataFrame(add_osm_id(df_denm, m30)).drop(columns="geometry")
+    df_denm["name_osmid"] = get_geometry_store().names(df_denm["osm_id"])
 
     # Forzar garbage collection
     gc.collect()
     
-    return df, df_denm, orden_dias, hour_categories
+    return df_denm, m30, orden_dias, hour_categories
 
 @st.cache_data(max_entries=1, ttl=3600)
-def cached_load_m30_data():
-    """Carga los datos de la M-30."""
-    return load_m30_data()
-
-@st.cache_data(max_entries=1)
-def get_conteo_dias(df):
-    """Pre-calcula conteo_dias para evitar recalcular."""
-    return (
-        df.drop_duplicates(subset=["day"])
-        .groupby("weekday_es")["day"]
-        .count()
-        .reset_index(name="n_días")
-    )
+def cached_load_rollups():
+    """Refresca las tablas resumen y lee los agregados del histórico (pocas filas)."""
+    engine = get_engine()
+    refresh_rollups(engine)
+    return {
+        "conteo_dias": read_conteo_dias(engine),
+        "dia_hora": read_vehiculos_dia_hora(engine),
+        "dia": read_vehiculos_dia(engine),
+        "informe_dia": read_informe_dia(engine),
+        "percentiles": read_percentiles_velocidad(engine),
+        "tramos": read_tramos(engine),
+        # Versión de los datos: invalida las lecturas cacheadas por tramo
+        "version": pd.Timestamp.now(),
+    }
+
+def promedio_por_dia(agregado, conteo_dias):
+    """Divide los vehículos de cada día de la semana por el número de días observados."""
+    agregado = agregado.merge(conteo_dias, on="weekday_es")
+    agregado["vehículos"] = agregado["vehículos"] / agregado["n_días"]
+    return agregado
 
 @st.cache_data(max_entries=3)
-def get_heatmap_data(df, conteo_dias):
-    """Genera datos del heatmap con caching."""
-    df_heatmap = (
-        df.groupby(["weekday_es", "hour_label"])["station_id"]
-        .nunique()
-        .reset_index(name="vehículos")
-    )
-    df_heatmap = df_heatmap.merge(conteo_dias, on="weekday_es")
-    df_heatmap["vehículos"] = df_heatmap["vehículos"] / df_heatmap["n_días"]
-    return df_heatmap
+def get_heatmap_data(rollups):
+    """Genera datos del heatmap a partir de las tablas resumen."""
+    # La tabla resumen ya es única por (día de la semana, hora): no hace falta reagrupar
+    return promedio_por_dia(rollups["dia_hora"], rollups["conteo_dias"])
 
 @st.cache_data(max_entries=3)
-def get_radar_data(df, conteo_dias):
-    """Genera datos del gráfico radar con caching."""
-    df_por_dia = df.drop_duplicates(["station_id", "weekday_es"]) \
-        .groupby("weekday_es")["station_id"].count() \
-        .reset_index(name="vehículos")
-    df_por_dia = df_por_dia.merge(conteo_dias, on="weekday_es")
-    df_por_dia["vehículos"] = df_por_dia["vehículos"] / df_por_dia["n_días"]
-    return df_por_dia
+def get_radar_data(rollups):
+    """Genera datos del gráfico radar a partir de las tablas resumen."""
+    return promedio_por_dia(rollups["dia"], rollups["conteo_dias"])
 
 @st.cache_data(max_entries=3)
-def get_hourly_traffic_data(df, conteo_dias):
-    """Genera datos de tráfico por hora con caching."""
-    df_dia_hora = df.groupby(["weekday_es", "hour_label"])["station_id"].nunique().reset_index(name="vehículos")
-    df_dia_hora = df_dia_hora.merge(conteo_dias, on="weekday_es")
-    df_dia_hora["vehículos"] = df_dia_hora["vehículos"] / df_dia_hora["n_días"]
-    return df_dia_hora
+def get_hourly_traffic_data(rollups):
+    """Genera datos de tráfico por hora a partir de las tablas resumen."""
+    return get_heatmap_data(rollups)
 
 # Función para monitorear memoria
 def show_memory_usage():
@@ -167,25 +147,22 @@ def force_garbage_collection():
 # Cargar datos solo una vez
 if 'data_loaded' not in st.session_state:
     with st.spinner("Cargando datos..."):
-        df, df_denm, orden_dias, hour_categories = cached_load_data()
-        m30 = cached_load_m30_data()
-        conteo_dias = get_conteo_dias(df)
+        df_denm, m30, orden_dias, hour_categories = cached_load_data()
+        rollups = cached_load_rollups()
         st.session_state.data_loaded = True
-        st.session_state.df = df
         st.session_state.df_denm = df_denm
         st.session_state.orden_dias = orden_dias
         st.session_state.hour_categories = hour_categories
         st.session_state.m30 = m30
-        st.session_state.conteo_dias = conteo_dias
+        st.session_state.rollups = rollups
         force_garbage_collection()
 else:
     # Usar datos del session_state
-    df = st.session_state.df
     df_denm = st.session_state.df_denm
     orden_dias = st.session_state.orden_dias
     hour_categories = st.session_state.hour_categories
     m30 = st.session_state.m30
-    conteo_dias = st.session_state.conteo_dias
+    rollups = st.session_state.rollups
 
 # ===== HEADER =====
 st.markdown("""
@@ -205,11 +182,13 @@ with st.sidebar:
         force_garbage_collection()
         st.rerun()
     st.metric("Memoria en uso", show_memory_usage())
+    with st.expander("Memoria por columna (DENM)"):
+        st.dataframe(memory_report(df_denm), use_container_width=True)
 
 # ---------------------------
 # Heatmap semanal (usando datos cacheados)
 # ---------------------------
-df_heatmap = get_heatmap_data(df, conteo_dias)
+df_heatmap = get_heatmap_data(rollups)
 
 fig_heatmap = px.density_heatmap(
     df_heatmap,
@@ -243,7 +222,7 @@ fig_heatmap.update_layout(
 # ---------------------------
 # Vehículos por día (Radar) - usando datos cacheados
 # ---------------------------
-df_por_dia = get_radar_data(df, conteo_dias)
+df_por_dia = get_radar_data(rollups)
 
 fig_radar = go.Figure()
 fig_radar.add_trace(go.Scatterpolar(
@@ -271,7 +250,7 @@ fig_radar.update_layout(
 # ---------------------------
 # Tráfico por hora según el día - usando datos cacheados
 # ---------------------------
-df_dia_hora = get_hourly_traffic_data(df, conteo_dias)
+df_dia_hora = get_hourly_traffic_data(rollups)
 
 fig_dia_hora = px.line(
     df_dia_hora.sort_values(["weekday_es", "hour_label"]),
@@ -328,39 +307,58 @@ force_garbage_collection()
 # --------------------------------------------------------------------------------------------------------------------------------
 st.markdown('<h3 class="section-title">  Informe día tipo</h3>', unsafe_allow_html=True)
 
-@st.cache_data(max_entries=7)
-def get_day_analysis_data(df, selected_day):
-    """Genera datos de análisis por día con caching."""
-    df_day = df[df["weekday_es"] == selected_day].copy()
-    num_dias = df_day['day'].nunique()
-    
+@st.cache_data(max_entries=1, ttl=3600)
+def build_day_type_reports(rollups):
+    """Informes día tipo de los siete días en una sola pasada.
+
+    Tabla pequeña indexada por (weekday_es, hour_label) con vehículos por
+    hora, frenada media, velocidad media/P25/P75 y número de vehículos.
+    """
+    informe = rollups["informe_dia"].merge(rollups["conteo_dias"], on="weekday_es", how="left")
+    informe["vehículos_hora"] = informe["vehículos"] / informe["n_días"]
+
+    # Percentiles de todas las claves (día, hora) desde el histograma de la tabla resumen
+    percentiles = rollups["percentiles"][["weekday_es", "hour_label", "q25", "q75"]].copy()
+    for columna in ("weekday_es", "hour_label"):
+        informe[columna] = informe[columna].astype(str)
+        percentiles[columna] = percentiles[columna].astype(str)
+    informe = informe.merge(percentiles, on=["weekday_es", "hour_label"], how="left")
+
+    return informe.rename(columns={"q25": "p25", "q75": "p75"}).set_index(["weekday_es", "hour_label"])[
+        ["vehículos_hora", "braking_intensity", "velocidad_media", "p25", "p75", "vehículos"]
+    ].sort_index()
+
+def get_day_analysis_data(informes, selected_day):
+    """Datos del día seleccionado: consulta sobre los informes precalculados.
+
+    Un día de la semana sin filas en el histórico devuelve tablas vacías.
+    """
+    if selected_day in informes.index.get_level_values("weekday_es"):
+        informe = informes.xs(selected_day, level="weekday_es")
+    else:
+        informe = informes.iloc[:0].droplevel("weekday_es")
+
     # Vehículos por hora
-    df_day_vph = df_day.groupby("hour_label")["station_id"].nunique().reset_index(name="Vehículos únicos")
-    df_day_vph['Vehículos únicos'] = df_day_vph['Vehículos únicos'] / num_dias
-    
+    df_day_vph = informe["vehículos_hora"].rename("Vehículos únicos").reset_index()
+
     # Frenadas
-    df_day_freno = df_day[df_day["longitudinal_acc"] < 0].copy()
-    if len(df_day_freno) > 0:
-        df_day_freno["braking_intensity"] = -df_day_freno["longitudinal_acc"]
-        df_day_frenadas = df_day_freno.groupby("hour_label")["braking_intensity"].mean().reset_index()
-    else:
-        df_day_frenadas = pd.DataFrame(columns=["hour_label", "braking_intensity"])
-    
+    df_day_frenadas = informe["braking_intensity"].dropna().reset_index()
+
     # Datos de velocidad
-    grupo_hora = df_day.groupby("hour_label")["speed_kmh"]
     vel_data = {
-        'mean': grupo_hora.mean(),
-        'p25': grupo_hora.quantile(0.25),
-        'p75': grupo_hora.quantile(0.75),
-        'n_vehiculos': df_day.groupby("hour_label")["station_id"].nunique()
+        'mean': informe["velocidad_media"],
+        'p25': informe["p25"],
+        'p75': informe["p75"],
+        'n_vehiculos': informe["vehículos"]
     }
     
     return df_day_vph, df_day_frenadas, vel_data
 
-selected_day = st.selectbox("Selecciona un día", df["weekday_es"].cat.categories, key="select_dia_semana")
+selected_day = st.selectbox("Selecciona un día", orden_dias, key="select_dia_semana")
 
 # Obtener datos del día seleccionado
-df_day_vph, df_day_frenadas, vel_data = get_day_analysis_data(df, selected_day)
+informes_dia_tipo = build_day_type_reports(rollups)
+df_day_vph, df_day_frenadas, vel_data = get_day_analysis_data(informes_dia_tipo, selected_day)
 
 # Gráfico de vehículos por hora
 fig_day_vph = px.bar(df_day_vph, x="hour_label", y="Vehículos únicos",
@@ -456,40 +454,43 @@ force_garbage_collection()
 # ---------------------------
 st.markdown('<h3 class="section-title">  Día tipo por tramo</h3>', unsafe_allow_html=True)
 
-@st.cache_data(max_entries=20)
-def get_tramo_analysis_data(df, df_denm, tramo_seleccionado, selected_day, hour_categories):
-    """Genera datos de análisis por tramo con caching."""
-    # Filtrar datos por tramo
-    df_tramo = df[df["name_osmid"] == tramo_seleccionado].copy()
-    df_denm_tramo = df_denm[df_denm["station_id"].isin(df_tramo["station_id"].unique())].copy()
-    
-    # Filtrar por día seleccionado
-    df_tramo = df_tramo[df_tramo["weekday_es"] == selected_day]
-    df_denm_tramo = df_denm_tramo[df_denm_tramo["weekday_es"] == selected_day]
-    
-    # Crear hora_label si no existe
-    for _df in [df_tramo, df_denm_tramo]:
-        if 'received_at' in _df.columns and 'hora_label' not in _df.columns:
-            _df["tramo_horario"] = _df["received_at"].dt.floor("1H")
-            _df["hora_label"] = _df["tramo_horario"].dt.strftime("%H:%M")
-            _df["hora_label"] = pd.Categorical(_df["hora_label"], categories=hour_categories, ordered=True)
-    
-    # Agregación tráfico
+@st.cache_resource(max_entries=1, ttl=3600)
+def build_tramo_index(df_denm, tramos):
+    """Índice de los eventos DENM atribuidos a cada tramo de la tabla resumen."""
+    return TramoIndex(df_denm, tramos)
+
+@st.cache_data(max_entries=20, ttl=3600)
+def cached_informe_tramo(tramo, version):
+    """Informe por (día de la semana, hora) del tramo desde la tabla resumen por tramo."""
+    return read_informe_dia(get_engine(), tramo)
+
+# Alertas DENM por (tramo, día, hora) en el registro compartido: se agrupan
+# una vez por versión de los datos y cada selección solo filtra el resultado
+REGISTRO.request(
+    "alertas_tramo", "denm_historico",
+    AggSpec.de(["name_osmid", "weekday_es", "hora_label"], [("alertas", "id", "count")])
+)
+
+def get_tramo_analysis_data(indice, rollups, tramo_seleccionado, selected_day):
+    """Genera datos de análisis por tramo: tráfico desde la tabla resumen, eventos desde el índice."""
+    # Velocidad media y vehículos únicos por hora del tramo, sin recorrer el histórico CAM
+    informe = cached_informe_tramo(tramo_seleccionado, rollups["version"])
+    informe = informe[informe["weekday_es"] == selected_day]
     df_diatipo = (
-        df_tramo.groupby(["hora_label"])
-        .agg(
-            velocidad_media=("speed_kmh", "mean"),
-            vehículos=("station_id", "nunique")
-        )
-        .reset_index()
+        informe.rename(columns={"hour_label": "hora_label"})
+        [["hora_label", "velocidad_media", "vehículos"]]
+        .reset_index(drop=True)
     )
+
+    # Eventos DENM atribuidos al tramo, del día seleccionado
+    df_denm_tramo = indice.denm_tramo_rows(tramo_seleccionado)
+    df_denm_tramo = df_denm_tramo[df_denm_tramo["weekday_es"] == selected_day]
     
-    # Agregación de alertas totales
-    alertas = (
-        df_denm_tramo.groupby(["hora_label"])
-        .size()
-        .reset_index(name="alertas")
-    )
+    # Alertas totales por hora, desde el agregado compartido
+    df_denm = indice.df_denm
+    alertas = REGISTRO.get("alertas_tramo", df_denm, (len(df_denm), str(df_denm["received_at"].max())))
+    alertas = alertas[(alertas["name_osmid"] == tramo_seleccionado) & (alertas["weekday_es"] == selected_day)]
+    alertas = alertas[["hora_label", "alertas"]]
     
     # Unión tráfico + alertas
     df_diatipo = df_diatipo.merge(alertas, on="hora_label", how="left")
@@ -499,11 +500,11 @@ def get_tramo_analysis_data(df, df_denm, tramo_seleccionado, selected_day, hour_
     return df_diatipo, df_denm_tramo
 
 # Selección de tramo físico
-tramos_disponibles = df["name_osmid"].dropna().unique()
-tramo_seleccionado = st.selectbox("Selecciona un tramo:", sorted(tramos_disponibles))
+indice_tramos = build_tramo_index(df_denm, rollups["tramos"])
+tramo_seleccionado = st.selectbox("Selecciona un tramo:", list(indice_tramos.tramos))
 
 # Obtener datos del tramo
-df_diatipo, df_denm_tramo = get_tramo_analysis_data(df, df_denm, tramo_seleccionado, selected_day, hour_categories)
+df_diatipo, df_denm_tramo = get_tramo_analysis_data(indice_tramos, rollups, tramo_seleccionado, selected_day)
 
 # Gráficos tráfico y velocidad
 fig_vel_tipo_dia = px.line(
@@ -586,13 +587,14 @@ st.markdown('</div>', unsafe_allow_html=True)
 ### MAPA 2
 st.markdown('<h3 class="section-title">  Velocidades medias por tramo - todo el histórico</h3>', unsafe_allow_html=True)
 
-# Cargar el GeoDataFrame con caching
-@st.cache_data
-def cached_read_gdf_velocidades(path="./data/gdf_velocidades.geojson"):
-    """Carga el GeoDataFrame de velocidades con caching."""
-    return gpd.read_file(path)
+# Velocidades por tramo con una geometría por tramo; compartidas entre sesiones
+@st.cache_resource
+def cached_read_velocidades(path="./data/gdf_velocidades.geojson"):
+    """Carga la tabla de velocidades (geometrías y atributos separados) con caching."""
+    return load_segment_table(path)
 
-gdf_velocidades = cached_read_gdf_velocidades()
+# La geometría se une al pintar, solo con las columnas que usa la capa de Kepler
+gdf_velocidades = cached_read_velocidades().join(COLUMNAS_KEPLER_VELOCIDADES)
 
 # Cargar la configuración de KeplerGl con caching de recursos (para objetos grandes como diccionarios de configuración)
 @st.cache_resource
@@ -3,14 +3,18 @@ import pandas as pd
 import plotly.express as px
 import streamlit.components.v1 as components
 from datetime import datetime
+from dataclasses import replace
 from streamlit_plotly_events import plotly_events
-from sqlalchemy import create_engine
 import json
 from keplergl import KeplerGl
 from streamlit_keplergl import keplergl_static
-import geopandas as gpd
-from shapely.geometry import Point
-from utils.loaders import load_data, load_m30_data
+from utils.loaders import load_m30_data
+from utils.incremental import load_incremental
+from utils.db import get_engine
+from utils.normalize import normalize_denm, ORDEN_DIAS
+from utils.queries import QuerySpec, FECHA_INICIO
+from utils.denm_spatial import denm_points, add_osm_id
+from utils.aggregations import AggSpec, REGISTRO
 import psutil
 import os
 
@@ -57,32 +61,46 @@ with st.sidebar:
 
 # ----------- Cargar datos -----------
 
-@st.cache_data
-def load_data2():
-    # Conexión a la base de datos
-    db_url = st.secrets["db_url"]
-    engine = create_engine(db_url)
-
-    df = pd.read_sql("SELECT * FROM denm_ref_message", engine)
-
-    df["received_at"] = pd.to_datetime(df["received_at"])
-    df["received_at"] = df["received_at"] + pd.Timedelta(hours=1)
-    if "weekday_es" in df.columns:
-        df["weekday_es"] = pd.Categorical(
-            df["weekday_es"],
-            categories=["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"],
-            ordered=True
-        )
-    if "hour" in df.columns and "hour_label" not in df.columns:
-        df["hour"] = (df["hour"] + 1) % 24  # Para que no se pase de 23
-        df["hour_label"] = df["hour"].apply(lambda x: f"{int(x):02d}:00")
+# Columnas de DENM que usan el mapa y los gráficos (todo el histórico)
+DENM_EVENTOS = QuerySpec(
+    "denm_ref_message",
+    columnas=("id", "station_id", "latitude", "longitude", "cause_desc",
+              "subcause_desc", "weekday_es", "hour")
+)
+
+# Inicio del histórico elegido en la barra lateral (por defecto FECHA_INICIO)
+with st.sidebar:
+    fecha_desde = st.date_input("Eventos desde", value=FECHA_INICIO.date(), max_value=datetime.today())
+
+@st.cache_data(ttl=300)
+def load_data2(desde):
+    # Conexión a la base de datos (pool compartido)
+    engine = get_engine()
 
-    df["geometry"] = df.apply(lambda row: Point(row["longitude"], row["latitude"]), axis=1)
-    gdf = gpd.GeoDataFrame(df, geometry="geometry", crs="EPSG:4326")
-    return df, gdf
+    # Desde FECHA_INICIO en adelante se filtra el almacén por defecto; antes,
+    # un almacén por mes de inicio (incremental limita cuántos se conservan)
+    spec = DENM_EVENTOS if desde >= FECHA_INICIO else replace(DENM_EVENTOS, desde=desde.replace(day=1))
+    df = load_incremental(engine, spec, st.secrets.get("loader_backend", "cursor"))
+    df = normalize_denm(df)
+    df = df[df["received_at"] >= desde].reset_index(drop=True)
 
-df_denm, gdf  = load_data2()
-orden_dias = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+    # Puntos vectorizados y tramo más cercano de cada evento (atribución persistida)
+    gdf = add_osm_id(denm_points(df), load_m30_data())
+    return pd.DataFrame(gdf), gdf
+
+df_denm, gdf  = load_data2(pd.Timestamp(fecha_desde))
+st.caption(f"Eventos DENM recibidos desde el {fecha_desde:%d/%m/%Y}: {len(df_denm):,}")
+
+# Agregados de los gráficos en el registro compartido: se agrupa una vez por
+# (causa, subcausa) y otra por (causa, hora) por versión de los datos, y el
+# conteo por causa se deriva del primero
+EVENTOS = ("frecuencia", "id", "count")
+REGISTRO.request("eventos_por_causa", "denm_eventos", AggSpec.de(["cause_desc"], [EVENTOS]))
+REGISTRO.request("eventos_por_subcausa", "denm_eventos", AggSpec.de(["cause_desc", "subcause_desc"], [EVENTOS]))
+REGISTRO.request("eventos_por_hora", "denm_eventos", AggSpec.de(["cause_desc", "hour"], [EVENTOS]))
+version_eventos = (str(fecha_desde), len(df_denm), str(df_denm["received_at"].max()))
+agregados_eventos = REGISTRO.compute("denm_eventos", df_denm, version_eventos)
+orden_dias = ORDEN_DIAS
 
 
 
@@ -159,8 +177,11 @@ st.markdown('<h3 class="section-title">  Causas y subcausas de los eventos DENM<
 # Crear dos columnas
 col1, col2 = st.columns(2)
 
-df_causas = df_denm["cause_desc"].value_counts().reset_index()
-df_causas.columns = ["cause_desc", "frecuencia"]
+df_causas = (
+    agregados_eventos["eventos_por_causa"].dropna(subset=["cause_desc"])
+    .sort_values("frecuencia", ascending=False, kind="stable")
+    .reset_index(drop=True)
+)
 
 with col1:
     st.markdown('<div class="chart-container">', unsafe_allow_html=True)
@@ -209,9 +230,12 @@ with col2:
     st.markdown('<div class="chart-title"></div>', unsafe_allow_html=True)
     st.markdown('<div class="chart-title"></div>', unsafe_allow_html=True)
     st.markdown('<div class="chart-title"></div>', unsafe_allow_html=True)
-    df_subcausas = df_denm[df_denm["cause_desc"] == causa_seleccionada]
-    subcausas_counts = df_subcausas["subcause_desc"].value_counts().reset_index()
-    subcausas_counts.columns = ["subcause_desc", "frecuencia"]
+    df_subcausas = agregados_eventos["eventos_por_subcausa"]
+    subcausas_counts = (
+        df_subcausas[df_subcausas["cause_desc"] == causa_seleccionada]
+        .dropna(subset=["subcause_desc"])[["subcause_desc", "frecuencia"]]
+        .sort_values("frecuencia", ascending=False, kind="stable")
+    )
     
     if not subcausas_counts.empty:
         fig_subcausa = px.pie(
@@ -261,8 +285,11 @@ tipos_evento = df_denm["cause_desc"].dropna().unique()
 tipos_evento_sorted = sorted(tipos_evento)
 
 # Filtrar y contar eventos
-df_filtrado = df_denm[df_denm["cause_desc"] == causa_seleccionada]
-eventos_por_hora = df_filtrado.groupby("hour").size().reset_index(name="Número de eventos")
+df_filtrado = agregados_eventos["eventos_por_hora"]
+eventos_por_hora = (
+    df_filtrado[df_filtrado["cause_desc"] == causa_seleccionada][["hour", "frecuencia"]]
+    .rename(columns={"frecuencia": "Número de eventos"})
+)
 eventos_completos = horas_completas.merge(
     eventos_por_hora, 
     on='hour', 
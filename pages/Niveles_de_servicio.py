@@ -2,12 +2,17 @@ import streamlit as st
 import pandas as pd
 import streamlit.components.v1 as components
 from datetime import datetime
-import geopandas as gpd
 from sqlalchemy import create_engine
 from shapely.geometry import Point
 from keplergl import KeplerGl
 import json
-from utils.loaders import load_data, load_m30_data
+from utils.loaders import load_m30_data
+from utils.db import get_engine
+from utils.incremental import load_incremental
+from utils.normalize import ZONA_HORARIA, normalize_cam
+from utils.queries import QuerySpec
+from utils.tramo_state import TramoMetricsState, level_of_service
+from utils.assets import load_asset
 import psutil
 import os
 
@@ -74,7 +79,54 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-gdf_tramos = gpd.read_file("./data/gdf_tramos.geojson")
+# Columnas que alimentan las métricas por tramo; basta con el último día
+CAM_NIVELES = QuerySpec(
+    "cam_ref_message",
+    columnas=("station_id", "osm_id", "speed_kmh", "longitudinal_acc", "lateral_acc"),
+    dias=1
+)
+
+@st.cache_resource
+def get_tramo_state():
+    """Estado incremental por tramo, compartido entre ejecuciones y sesiones."""
+    return TramoMetricsState()
+
+# Como mucho un refresco por minuto: los reruns de widgets reutilizan el resultado
+@st.cache_data(ttl=60)
+def update_tramo_state():
+    """Incorpora al estado solo los mensajes posteriores al último ya procesado.
+
+    La primera vez se carga la ventana completa; después solo el lote que
+    trae load_incremental de la base de datos, así que cada refresco cuesta
+    O(lote) y no O(ventana). Devuelve las métricas de la última hora hasta
+    ahora (hora de Madrid) y la hora del último mensaje recibido.
+    """
+    estado = get_tramo_state()
+    backend = st.secrets.get("loader_backend", "cursor")
+    with estado.lock:
+        df = load_incremental(get_engine(), CAM_NIVELES, backend, solo_nuevas=estado.ultimo is not None)
+        if not df.empty:
+            df = normalize_cam(df)
+            if estado.ultimo is not None:
+                # El solape de la carga incremental repite filas ya procesadas
+                df = df[df["received_at"] > estado.ultimo]
+            estado.update(df)
+        ahora = pd.Timestamp.now(tz=ZONA_HORARIA).tz_localize(None)
+        return estado.window(ahora), estado.ultimo
+
+@st.cache_data
+def cached_load_tramos(path, mtime):
+    """Último estado exportado de los tramos, desde su compilado Feather (`mtime` invalida la caché)."""
+    return load_asset(path)
+
+metricas_tramos, ultimo_mensaje = update_tramo_state()
+recibido = "sin datos" if ultimo_mensaje is None else f"{ultimo_mensaje:%d/%m/%Y %H:%M}"
+if metricas_tramos.empty:
+    st.info(f"Sin mensajes en la última hora (último recibido: {recibido}): se muestra el último estado exportado.")
+    gdf_tramos = cached_load_tramos("./data/gdf_tramos.geojson", os.path.getmtime("./data/gdf_tramos.geojson"))
+else:
+    gdf_tramos = level_of_service(metricas_tramos, load_m30_data())
+    st.caption(f"Último mensaje recibido: {recibido}")
 
 
 # -------------------------------
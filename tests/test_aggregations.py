@@ -0,0 +1,70 @@
+import threading
+import numpy as np
+import pandas as pd
+from utils.aggregations import AggSpec, AggregationRegistry
+
+CONTEO = ("n", "id", "count")
+
+
+def _eventos(n=500, semilla=0):
+    rng = np.random.default_rng(semilla)
+    causas = np.array(["Obras", "Atasco", "Accidente", None], dtype=object)
+    return pd.DataFrame({
+        "id": np.arange(n),
+        "cause_desc": causas[rng.integers(0, 4, n)],
+        "subcause_desc": rng.choice(["a", "b", "c"], n),
+        "hour": rng.integers(0, 24, n),
+    })
+
+
+def _registro():
+    registro = AggregationRegistry()
+    registro.request("por_causa", "eventos", AggSpec.de(["cause_desc"], [CONTEO]))
+    registro.request("por_subcausa", "eventos", AggSpec.de(["cause_desc", "subcause_desc"], [CONTEO]))
+    registro.request("por_hora", "eventos", AggSpec.de(["cause_desc", "hour"], [CONTEO]))
+    # Mismo spec con otro nombre: comparte resultado
+    registro.request("por_causa_bis", "eventos", AggSpec.de(["cause_desc"], [CONTEO]))
+    return registro
+
+
+def test_deduplica_y_deriva_agrupados():
+    df = _eventos()
+    registro = _registro()
+    resultados = registro.compute("eventos", df, version=1)
+
+    # Dos groupby de dos claves; el de una clave se deriva de uno de ellos
+    assert registro.groupbys == 2
+    esperado = df["cause_desc"].value_counts(dropna=False)
+    obtenido = resultados["por_causa"].set_index("cause_desc")["n"]
+    assert obtenido.sort_index().to_dict() == esperado.sort_index().to_dict()
+    pd.testing.assert_frame_equal(resultados["por_causa"], resultados["por_causa_bis"])
+
+
+def test_cache_por_version():
+    df = _eventos()
+    registro = _registro()
+    registro.compute("eventos", df, version=1)
+    registro.get("por_hora", df, version=1)
+    assert registro.groupbys == 2
+
+    registro.compute("eventos", _eventos(semilla=1), version=2)
+    assert registro.groupbys == 4
+
+
+def test_resultados_son_copias():
+    df = _eventos()
+    registro = _registro()
+    resultado = registro.get("por_causa", df, version=1)
+    resultado["n"] = -1
+    assert (registro.get("por_causa", df, version=1)["n"] > 0).all()
+
+
+def test_sesiones_concurrentes_agrupan_una_vez():
+    df = _eventos(20_000)
+    registro = _registro()
+    hilos = [threading.Thread(target=registro.compute, args=("eventos", df, 1)) for _ in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert registro.groupbys == 2
@@ -0,0 +1,27 @@
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip("geopandas")
+from utils.assets import source_metadata, write_table, read_table
+
+
+def test_compilado_sin_fuente(tmp_path):
+    fuente = tmp_path / "tramos.geojson"
+    fuente.write_text("{}")
+    ruta = str(tmp_path / "tramos.feather")
+    write_table(pd.DataFrame({"osm_id": ["1", "2"]}), ruta, source_metadata(str(fuente)))
+
+    os.remove(fuente)
+    tabla = read_table(ruta, source_metadata(str(fuente)))
+    assert tabla is not None and tabla.num_rows == 2
+
+
+def test_compilado_antiguo_se_descarta(tmp_path):
+    fuente = tmp_path / "tramos.geojson"
+    fuente.write_text("{}")
+    ruta = str(tmp_path / "tramos.feather")
+    write_table(pd.DataFrame({"osm_id": ["1"]}), ruta, source_metadata(str(fuente)))
+
+    os.utime(fuente, (0, os.path.getmtime(fuente) + 10))
+    assert read_table(ruta, source_metadata(str(fuente))) is None
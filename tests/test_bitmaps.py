@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.bitmaps import Bitmap, BitmapIndex
+from utils.normalize import ORDEN_DIAS
+
+N_BITS = 10_000
+
+
+def _bitmap(conjunto):
+    return Bitmap.from_codes(np.array(sorted(conjunto), dtype=np.uint32), N_BITS)
+
+
+def _conjuntos(semilla=0):
+    rng = np.random.default_rng(semilla)
+    disperso = set(rng.choice(N_BITS, 100, replace=False).tolist())
+    denso = set(rng.choice(N_BITS, 5_000, replace=False).tolist())
+    return {"array": disperso, "bitset": denso}
+
+
+def test_representacion_segun_densidad():
+    conjuntos = _conjuntos()
+    assert _bitmap(conjuntos["array"]).words is None
+    assert _bitmap(conjuntos["bitset"]).codes is None
+
+
+@pytest.mark.parametrize("a", ["array", "bitset"])
+@pytest.mark.parametrize("b", ["array", "bitset"])
+def test_union_e_interseccion(a, b):
+    izquierda, derecha = _conjuntos(1)[a], _conjuntos(2)[b]
+    union = _bitmap(izquierda) | _bitmap(derecha)
+    interseccion = _bitmap(izquierda) & _bitmap(derecha)
+
+    assert len(union) == len(izquierda | derecha)
+    assert len(interseccion) == len(izquierda & derecha)
+    # Los elementos (no solo el tamaño) coinciden con los de un set de Python
+    todos = np.arange(N_BITS, dtype=np.uint32)
+    assert set(todos[union._contiene(todos)].tolist()) == izquierda | derecha
+    assert set(todos[interseccion._contiene(todos)].tolist()) == izquierda & derecha
+
+
+def test_operaciones_con_vacio():
+    vacio = Bitmap(N_BITS, codes=np.zeros(0, dtype=np.uint32))
+    denso = _bitmap(_conjuntos()["bitset"])
+    assert len(vacio | denso) == len(denso)
+    assert len(vacio & denso) == 0
+    assert len(denso & vacio) == 0
+
+
+def _cam(n=20_000, semilla=0):
+    rng = np.random.default_rng(semilla)
+    df = pd.DataFrame({
+        "received_at": pd.Timestamp("2024-05-06") + pd.to_timedelta(rng.integers(0, 3 * 86_400, n), unit="s"),
+        "hour": rng.integers(0, 24, n).astype(np.int8),
+        "name_osmid": rng.choice(["M-30 Norte", "M-30 Sur", "Túnel"], n),
+        # Pocos vehículos: se repiten entre horas, días y tramos
+        "station_id": rng.integers(1, 3_000, n).astype(np.float64),
+    })
+    df.loc[::97, "station_id"] = np.nan
+    df["date"] = df["received_at"].dt.normalize()
+    return df
+
+
+def test_count_exacto():
+    df = _cam()
+    indice = BitmapIndex.from_frame(df)
+
+    assert indice.count() == df["station_id"].nunique()
+    filtro = df["name_osmid"].isin(["Túnel"]) & df["hour"].isin([7, 8, 9])
+    assert indice.count(tramos=["Túnel"], horas=[7, 8, 9]) == df.loc[filtro, "station_id"].nunique()
+    assert indice.count(fechas=["2024-05-07"]) == df.loc[df["date"] == "2024-05-07", "station_id"].nunique()
+    assert indice.count(dias_semana=["Martes"]) == df.loc[df["date"].dt.dayofweek == 1, "station_id"].nunique()
+
+
+def test_combinacion_de_selecciones():
+    df = _cam()
+    indice = BitmapIndex.from_frame(df)
+    norte = set(df.loc[df["name_osmid"] == "M-30 Norte", "station_id"].dropna())
+    sur = set(df.loc[df["name_osmid"] == "M-30 Sur", "station_id"].dropna())
+
+    assert len(indice.select(tramos=["M-30 Norte"]) & indice.select(tramos=["M-30 Sur"])) == len(norte & sur)
+    assert len(indice.select(tramos=["M-30 Norte"]) | indice.select(tramos=["M-30 Sur"])) == len(norte | sur)
+
+
+def _por_grupo(df, por, valor):
+    """{grupo como tupla de textos: valor}, para comparar sin depender de los dtypes."""
+    return dict(zip(map(tuple, df[por].astype(str).to_numpy()), df[valor]))
+
+
+@pytest.mark.parametrize("por", [["date", "hour"], ["name_osmid"], ["weekday_es", "hour"]])
+def test_count_by_exacto(por):
+    df = _cam()
+    df["weekday_es"] = np.asarray(ORDEN_DIAS)[df["date"].dt.dayofweek]
+    indice = BitmapIndex.from_frame(df)
+
+    obtenido = indice.count_by(por)
+    esperado = df.dropna(subset=["station_id"]).groupby(por)["station_id"].nunique().reset_index()
+    assert _por_grupo(obtenido, por, "vehículos") == _por_grupo(esperado, por, "station_id")
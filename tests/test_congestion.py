@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from utils.congestion import detect_congestion, haversine_m
+
+# Unos 30 m hacia el norte por paso
+PASO_GRADOS = 30 / 111_195
+
+
+def _trayecto(station_id, n, inicio="2025-06-19 08:00:00", cada_s=10, velocidad=10.0, osm_id="A", lat0=40.40):
+    return pd.DataFrame({
+        "station_id": station_id,
+        "generation_time_real": pd.date_range(inicio, periods=n, freq=f"{cada_s}s", tz="UTC"),
+        "latitude": lat0 + PASO_GRADOS * np.arange(n),
+        "longitude": -3.68,
+        "speed_kmh": velocidad,
+        "osm_id": osm_id,
+    })
+
+
+def test_hueco_parte_el_tramo_lento():
+    df = pd.concat([
+        _trayecto(1, 10),
+        # Dos minutos sin mensajes: el tramo siguiente es otro
+        _trayecto(1, 10, inicio="2025-06-19 08:03:30", lat0=40.41),
+    ])
+    segmentos = detect_congestion(df.sample(frac=1, random_state=0))
+    assert len(segmentos) == 2
+    assert (segmentos["n_puntos"] == 10).all()
+    assert np.allclose(segmentos["longitud_m"], 9 * 30, rtol=0.01)
+
+
+def test_corte_de_100_metros():
+    df = pd.concat([
+        _trayecto(1, 4),             # 3 pasos, unos 90 m: no cuenta
+        _trayecto(2, 5),             # 4 pasos, unos 120 m: sí cuenta
+        _trayecto(3, 10, velocidad=50.0),  # rápido
+    ])
+    segmentos = detect_congestion(df)
+    assert segmentos["station_id"].tolist() == [2]
+    assert segmentos["longitud_m"].iloc[0] > 100
+
+
+def test_punto_rapido_corta_el_tramo():
+    df = _trayecto(1, 9)
+    df.loc[df.index[4], "speed_kmh"] = 40.0
+    # Quedan dos tramos de 4 puntos (unos 90 m cada uno): ninguno supera los 100 m
+    assert detect_congestion(df).empty
+
+
+def test_osm_id_mayoritario():
+    df = _trayecto(1, 7)
+    df["osm_id"] = ["A", "A", "B", "B", "B", "B", "A"]
+    segmentos = detect_congestion(df)
+    assert segmentos["osm_id"].tolist() == ["B"]
+
+
+def test_haversine():
+    assert abs(haversine_m(40.4, -3.68, 40.4 + PASO_GRADOS, -3.68) - 30) < 0.1
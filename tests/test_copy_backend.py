@@ -0,0 +1,43 @@
+import io
+import os
+import pandas as pd
+from utils.copy_backend import parse_copy_csv, read_copy_file
+
+# Volcado de `COPY (SELECT ...) TO STDOUT WITH (FORMAT csv, HEADER true)` con TIME ZONE 'UTC'
+VOLCADO = os.path.join(os.path.dirname(__file__), "data", "denm_copy.csv")
+
+
+def test_nulo_frente_a_cadena_vacia():
+    df = read_copy_file(VOLCADO)
+    # Vacío sin comillas es NULL; "" entrecomillado es la cadena vacía
+    assert df["subcause_desc"].iloc[0] == ""
+    assert pd.isna(df["subcause_desc"].iloc[1])
+    assert pd.isna(df["cause_desc"].iloc[1])
+    assert df["cause_desc"].iloc[2] == "Atasco, retención"
+
+
+def test_offsets_de_zona_horaria():
+    df = read_copy_file(VOLCADO)
+    assert str(df["received_at"].dt.tz) == "UTC"
+    assert df["received_at"].tolist() == [
+        pd.Timestamp("2025-06-19 08:00:00.123", tz="UTC"),
+        pd.Timestamp("2025-06-19 22:30:00", tz="UTC"),
+        pd.Timestamp("2025-06-20 00:00:01.5", tz="UTC"),
+    ]
+
+
+def test_enteros_con_nulos():
+    df = read_copy_file(VOLCADO)
+    # station_id usa todo el rango de 32 bits sin signo y admite nulos
+    assert df["station_id"].dtype == "UInt32"
+    assert df["station_id"].iloc[0] == 2**32 - 1
+    assert pd.isna(df["station_id"].iloc[1])
+    assert df["cause_code"].dtype == "Int16"
+    # Sin nulos se mantiene el tipo compacto no nullable
+    assert df["message_id"].dtype == "int64"
+
+
+def test_flujo_en_memoria_igual_que_fichero():
+    with open(VOLCADO, "rb") as f:
+        desde_flujo = parse_copy_csv(io.BytesIO(f.read()))
+    pd.testing.assert_frame_equal(desde_flujo, read_copy_file(VOLCADO))
@@ -0,0 +1,181 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+from utils import incremental, parquet_cache
+from dataclasses import replace
+from utils.incremental import load_incremental, read_watermark, SOLAPE, MAX_ALMACENES_DESDE
+from utils.parquet_cache import list_partitions, read_partitions, store_lock, write_partitions
+from utils.queries import QuerySpec
+from utils.streaming import coerce_chunk
+
+SPEC = QuerySpec("denm_ref_message", dias=2)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(parquet_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(incremental, "CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+def _filas(ids, recibido):
+    return pd.DataFrame({
+        "message_id": ids,
+        "station_id": np.asarray(ids) % 7 + 1,
+        "cause_desc": "Obras",
+        "received_at": [str(pd.Timestamp(t)) for t in recibido],
+    })
+
+
+def _insertar(engine, df):
+    df.to_sql("denm_ref_message", engine, index=False, if_exists="append")
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'v2x.db'}")
+    hoy = pd.Timestamp.today().normalize()
+    # Una hora de mensajes por minuto de ayer y otra de hace una semana (fuera de ventana)
+    _insertar(engine, _filas(range(1, 61), pd.date_range(hoy - pd.Timedelta(hours=14), periods=60, freq="min")))
+    _insertar(engine, _filas(range(1001, 1011), pd.date_range(hoy - pd.Timedelta(days=7), periods=10, freq="min")))
+    return engine
+
+
+def _sin_frescura(monkeypatch):
+    monkeypatch.setattr(incremental, "FRESCURA_S", 0)
+
+
+def test_carga_inicial_y_marca_de_agua(cache_dir, engine):
+    df = load_incremental(engine, SPEC)
+
+    assert sorted(df["message_id"]) == list(range(1, 61))
+    wm = read_watermark(SPEC.store_key())
+    assert wm["message_id"] == 60
+    assert wm["received_at"] == df["received_at"].max()
+    assert list_partitions(SPEC.store_key())
+
+
+def test_solape_y_deduplicado(cache_dir, engine, monkeypatch):
+    _sin_frescura(monkeypatch)
+    df = load_incremental(engine, SPEC)
+    ultimo = df["received_at"].max()
+
+    # Dos filas nuevas y una llegada tardía (received_at anterior al solape, id nuevo)
+    _insertar(engine, _filas([61, 62], [ultimo + pd.Timedelta(minutes=1), ultimo + pd.Timedelta(minutes=2)]))
+    _insertar(engine, _filas([63], [ultimo - pd.Timedelta(minutes=40)]))
+    nuevas = load_incremental(engine, SPEC, solo_nuevas=True)
+
+    # Se vuelven a pedir los últimos SOLAPE minutos además de lo nuevo
+    en_solape = df.loc[df["received_at"] > ultimo - SOLAPE, "message_id"]
+    assert set(nuevas["message_id"]) == set(en_solape) | {61, 62, 63}
+
+    completo = load_incremental(engine, SPEC)
+    assert completo["message_id"].is_unique
+    assert sorted(completo["message_id"]) == list(range(1, 64))
+    assert read_watermark(SPEC.store_key())["message_id"] == 63
+
+
+def test_cache_fresca_no_consulta(cache_dir, engine, monkeypatch):
+    load_incremental(engine, SPEC)
+    consultas = []
+    monkeypatch.setitem(incremental.BACKENDS, "cursor", lambda *a: consultas.append(a) or pd.DataFrame())
+
+    _insertar(engine, _filas([61], [pd.Timestamp.today().normalize()]))
+    df = load_incremental(engine, SPEC)
+    assert not consultas
+    assert 61 not in set(df["message_id"])
+    assert load_incremental(engine, SPEC, solo_nuevas=True).empty
+
+
+def test_recorte_de_ventana(cache_dir, engine, monkeypatch):
+    _sin_frescura(monkeypatch)
+    nombre = SPEC.store_key()
+    hoy = pd.Timestamp.today().normalize()
+    inicio = SPEC.inicio_ventana()
+    # Restos de cargas anteriores: un día ya fuera y filas del primer día antes del inicio
+    # (tipadas como las escribe el backend)
+    viejas = _filas([2001], [hoy - pd.Timedelta(days=5)])
+    borde = _filas([2002, 2003], [inicio - pd.Timedelta(hours=1), inicio + pd.Timedelta(minutes=30)])
+    write_partitions(nombre, coerce_chunk(viejas), "message_id")
+    write_partitions(nombre, coerce_chunk(borde), "message_id")
+
+    df = load_incremental(engine, SPEC)
+    assert pd.Timestamp(hoy - pd.Timedelta(days=5)) not in list_partitions(nombre)
+    assert 2001 not in set(df["message_id"]) and 2002 not in set(df["message_id"])
+    assert 2003 in set(df["message_id"])
+    assert (df["received_at"] > inicio).all()
+
+
+def test_cache_vacia_fuerza_consulta_completa(cache_dir, engine):
+    load_incremental(engine, SPEC)
+    nombre = SPEC.store_key()
+    for dia in list_partitions(nombre):
+        os.remove(parquet_cache.partition_path(nombre, dia))
+
+    # La marca de agua es fresca pero no quedan particiones: se vuelve a pedir todo
+    df = load_incremental(engine, SPEC)
+    assert sorted(df["message_id"]) == list(range(1, 61))
+    assert read_partitions(nombre) is not None
+
+
+def test_sesiones_concurrentes_consultan_una_vez(cache_dir, engine, monkeypatch):
+    consultas = []
+    leer = incremental.BACKENDS["cursor"]
+
+    def contar(*args):
+        consultas.append(threading.get_ident())
+        return leer(*args)
+
+    monkeypatch.setitem(incremental.BACKENDS, "cursor", contar)
+    resultados = []
+    hilos = [
+        threading.Thread(target=lambda: resultados.append(load_incremental(engine, SPEC)))
+        for _ in range(6)
+    ]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    # La primera sesión consulta bajo store_lock; las demás sirven su caché fresca
+    assert len(consultas) == 1
+    assert all(sorted(df["message_id"]) == list(range(1, 61)) for df in resultados)
+
+
+def test_almacenes_con_inicio_propio_acotados(cache_dir, engine):
+    base = QuerySpec("denm_ref_message", columnas=("station_id", "cause_desc"))
+    meses = [pd.Timestamp(f"2024-0{m}-01") for m in range(1, 5)]
+    for desde in meses:
+        df = load_incremental(engine, replace(base, desde=desde))
+        # Todo el histórico desde `desde`, incluidas las filas de hace una semana
+        assert len(df) == 70
+
+    conservados = [d for d in os.listdir(cache_dir) if os.path.isdir(cache_dir / d)]
+    assert len(conservados) == MAX_ALMACENES_DESDE
+    # Se queda el último usado junto al pedido ahora
+    assert sorted(conservados) == [replace(base, desde=d).store_key() for d in meses[-MAX_ALMACENES_DESDE:]]
+    assert all(n.startswith(base.store_key() + "_desde") for n in conservados)
+
+
+def test_store_lock_reentrante_y_exclusivo(cache_dir):
+    orden = []
+
+    def otra_sesion():
+        with store_lock("denm"):
+            orden.append("otra")
+
+    with store_lock("denm"):
+        # Reentrante en el mismo hilo (load_incremental -> write_partitions)
+        with store_lock("denm"):
+            orden.append("dentro")
+        hilo = threading.Thread(target=otra_sesion)
+        hilo.start()
+        hilo.join(timeout=0.2)
+        assert hilo.is_alive()
+        orden.append("suelta")
+    hilo.join()
+    assert orden == ["dentro", "suelta", "otra"]
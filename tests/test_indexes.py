@@ -0,0 +1,20 @@
+import pandas as pd
+from utils.indexes import TramoIndex
+
+
+def test_filas_denm_por_tramo():
+    df_denm = pd.DataFrame({
+        "id": [1, 2, 3, 4, 5],
+        "name_osmid": ["B", "A", None, "B", "C"],
+    })
+    indice = TramoIndex(df_denm, ["A", "B", "D"])
+
+    assert indice.denm_tramo_rows("B")["id"].tolist() == [1, 4]
+    assert indice.denm_tramo_rows("A")["id"].tolist() == [2]
+    # Tramo con datos de tráfico pero sin eventos
+    assert indice.denm_tramo_rows("D").empty
+
+
+def test_sin_columna_de_tramo():
+    indice = TramoIndex(pd.DataFrame({"id": [1, 2]}), ["A"])
+    assert indice.denm_tramo_rows("A").empty
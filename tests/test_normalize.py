@@ -0,0 +1,33 @@
+import pandas as pd
+from utils.normalize import normalize_cam, normalize_denm
+
+
+def _fila_medianoche():
+    # 22:30 UTC de un jueves de verano son las 00:30 del viernes en Madrid (UTC+2)
+    return pd.DataFrame({
+        "received_at": pd.to_datetime(["2025-06-19 22:30:00+00:00"]),
+        "weekday_es": ["Jueves"],
+        "hour": [22],
+    })
+
+
+def test_cam_hora_y_dia_locales_al_cruzar_medianoche():
+    df = normalize_cam(_fila_medianoche())
+    assert df["received_at"].iloc[0] == pd.Timestamp("2025-06-20 00:30:00")
+    assert df["hour"].iloc[0] == 0
+    assert df["hour_label"].iloc[0] == "00:00"
+    assert df["weekday_es"].iloc[0] == "Viernes"
+
+
+def test_cam_y_denm_comparten_claves():
+    cam = normalize_cam(_fila_medianoche())
+    denm = normalize_denm(_fila_medianoche())
+    for columna in ["received_at", "hour", "hour_label", "weekday_es"]:
+        assert cam[columna].iloc[0] == denm[columna].iloc[0]
+
+
+def test_hora_de_invierno():
+    df = pd.DataFrame({"received_at": pd.to_datetime(["2025-01-15 23:10:00+00:00"]), "hour": [23]})
+    df = normalize_cam(df)
+    assert df["hour"].iloc[0] == 0
+    assert df["received_at"].iloc[0] == pd.Timestamp("2025-01-16 00:10:00")
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("streamlit")
+from utils.rollups import ANCHO_BIN_KMH, _cuantiles_histograma
+
+
+def test_percentiles_desde_histograma():
+    rng = np.random.default_rng(0)
+    velocidades = {("Lunes", 8): rng.normal(60, 15, 20_000).clip(0), ("Martes", 9): rng.uniform(20, 90, 5_000)}
+    filas = []
+    for (dia, hora), v in velocidades.items():
+        bins, n = np.unique(np.floor(v / ANCHO_BIN_KMH).astype(int), return_counts=True)
+        filas.append(pd.DataFrame({"weekday_es": dia, "hour": hora, "bin": bins, "n": n}))
+    # Desordenado, como llega de la base de datos
+    histograma = pd.concat(filas).sample(frac=1, random_state=0)
+
+    cuantiles = _cuantiles_histograma(histograma, ["weekday_es", "hour"], (0.25, 0.75))
+    for (dia, hora), v in velocidades.items():
+        fila = cuantiles[(cuantiles["weekday_es"] == dia) & (cuantiles["hour"] == hora)].iloc[0]
+        assert abs(fila["q25"] - np.quantile(v, 0.25)) < ANCHO_BIN_KMH
+        assert abs(fila["q75"] - np.quantile(v, 0.75)) < ANCHO_BIN_KMH
@@ -0,0 +1,185 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import sketch_cache
+from utils.sketches import DistinctSketchStore, KLLSketch, QuantileSketchStore, ERROR_HLL
+from utils.sketch_cache import daily_sketches
+
+
+def _cam(n=60_000, dias=3, semilla=0):
+    rng = np.random.default_rng(semilla)
+    inicio = pd.Timestamp("2024-05-06")
+    return pd.DataFrame({
+        "received_at": inicio + pd.to_timedelta(rng.integers(0, dias * 86_400, n), unit="s"),
+        "hour": rng.integers(0, 24, n).astype(np.int8),
+        "name_osmid": rng.choice(["M-30 Norte", "M-30 Sur", "Túnel"], n),
+        "station_id": rng.integers(1, 2**32, n, dtype=np.uint64).astype(np.uint32),
+    })
+
+
+def _por_fecha_hora(store):
+    return store.count_by(["date", "hour"]).set_index(["date", "hour"])["vehículos"].sort_index()
+
+
+def test_hll_error_dentro_de_la_cota():
+    rng = np.random.default_rng(1)
+    errores = []
+    for n in (50, 500, 5_000, 50_000, 200_000):
+        ids = rng.choice(2**32, n, replace=False)
+        store = DistinctSketchStore().update(
+            np.full(n, np.datetime64("2024-05-06")), np.zeros(n), np.full(n, "Túnel"), ids
+        )
+        errores.append(abs(store.count() - n) / n)
+    # Error típico 1.04/sqrt(2^p) <= ERROR_HLL; ninguna muestra fuera de 3 sigmas
+    assert np.mean(errores) <= ERROR_HLL
+    assert max(errores) <= 3 * ERROR_HLL
+
+
+def test_hll_repetidos_no_cuentan():
+    ids = np.arange(1_000)
+    store = DistinctSketchStore().update(
+        np.full(3_000, np.datetime64("2024-05-06")), np.zeros(3_000), np.full(3_000, "Túnel"), np.tile(ids, 3)
+    )
+    assert abs(store.count() - 1_000) <= 3 * ERROR_HLL * 1_000
+
+
+def test_fusion_igual_a_construccion_completa():
+    df = _cam()
+    completo = DistinctSketchStore.from_frame(df)
+
+    dias = df["received_at"].dt.normalize()
+    fusion = None
+    for dia in sorted(dias.unique()):
+        parcial = DistinctSketchStore.from_frame(df[dias == dia])
+        fusion = parcial if fusion is None else fusion.merge(parcial)
+
+    # HLL es un máximo por registro: la fusión es exactamente el sketch completo
+    pd.testing.assert_series_equal(_por_fecha_hora(fusion), _por_fecha_hora(completo))
+    assert fusion.count() == completo.count()
+    assert fusion.count(tramos=["Túnel"], horas=[8, 9]) == completo.count(tramos=["Túnel"], horas=[8, 9])
+
+
+# Cota de error de rango normalizado de KLL con k=200 (99 % de confianza)
+ERROR_RANGO_KLL = 0.0165
+CUANTILES = [0.01, 0.1, 0.25, 0.5, 0.75, 0.85, 0.9, 0.99]
+
+
+def _velocidades(n=200_000, semilla=0):
+    """Velocidades bimodales (congestión y flujo libre), como en la M-30."""
+    rng = np.random.default_rng(semilla)
+    lentos = rng.gamma(4, 4, n // 4)
+    rapidos = rng.normal(75, 12, n - n // 4)
+    return rng.permutation(np.concatenate([lentos, rapidos])).astype(np.float32)
+
+
+def _error_rango(valores, sketch, qs=CUANTILES):
+    """Máxima distancia entre la probabilidad pedida y el rango real del cuantil devuelto."""
+    ordenados = np.sort(valores)
+    estimados = sketch.quantiles(qs).astype(np.float32)
+    abajo = np.searchsorted(ordenados, estimados, side="left") / len(ordenados)
+    arriba = np.searchsorted(ordenados, estimados, side="right") / len(ordenados)
+    # Con valores repetidos cualquier rango entre abajo y arriba es correcto
+    return max(max(0.0, abajo[i] - q, q - arriba[i]) for i, q in enumerate(qs))
+
+
+def test_kll_exacto_con_pocos_valores():
+    valores = np.arange(1, 101, dtype=np.float32)
+    sketch = KLLSketch().update(valores)
+    assert sketch.quantile(0.5) == 50
+    assert sketch.quantile(0.85) == 85
+    assert np.isnan(KLLSketch().quantile(0.5))
+
+
+def test_kll_error_de_rango_dentro_de_la_cota():
+    valores = _velocidades()
+    sketch = KLLSketch().update(valores)
+    assert sketch.n == len(valores)
+    assert _error_rango(valores, sketch) <= ERROR_RANGO_KLL
+
+
+def test_kll_fusion_dentro_de_la_cota():
+    valores = _velocidades(semilla=1)
+    fusion = KLLSketch()
+    for i, lote in enumerate(np.array_split(valores, 24)):
+        fusion.merge(KLLSketch(semilla=i).update(lote))
+    assert fusion.n == len(valores)
+    assert _error_rango(valores, fusion) <= ERROR_RANGO_KLL
+
+
+def test_quantile_store_por_grupo():
+    rng = np.random.default_rng(2)
+    df = pd.DataFrame({
+        "hour": rng.integers(0, 24, 100_000),
+        "speed_kmh": _velocidades(100_000, semilla=3),
+    })
+    # Almacenes parciales fusionados, como los de daily_sketches
+    store = QuantileSketchStore(["hour"])
+    for inicio in range(0, len(df), 20_000):
+        store.merge(QuantileSketchStore.from_frame(df.iloc[inicio:inicio + 20_000], ["hour"]))
+
+    por_hora = store.quantiles_by(["hour"], [0.25, 0.85])
+    assert list(por_hora.columns) == ["hour", "q25", "q85"]
+    for fila in por_hora.itertuples():
+        valores = np.sort(df.loc[df["hour"] == fila.hour, "speed_kmh"].to_numpy())
+        for q, estimado in ((0.25, fila.q25), (0.85, fila.q85)):
+            rango = np.searchsorted(valores, np.float32(estimado), side="right") / len(valores)
+            assert abs(rango - q) <= ERROR_RANGO_KLL + 1 / len(valores)
+
+    # Una franja horaria se responde fusionando los sketches de sus horas
+    manana = np.sort(df[df["hour"].isin([7, 8, 9])]["speed_kmh"].to_numpy())
+    v85 = np.float32(store.quantile(0.85, hour=[7, 8, 9]))
+    assert abs(np.searchsorted(manana, v85, side="right") / len(manana) - 0.85) <= ERROR_RANGO_KLL + 1 / len(manana)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(sketch_cache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr("utils.parquet_cache.CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_daily_sketches_persistidos(cache_dir):
+    df = _cam()
+    llamadas = []
+
+    def construir(filas):
+        llamadas.append(len(filas))
+        return DistinctSketchStore.from_frame(filas)
+
+    primero = daily_sketches("hll", df, construir, version="p11")
+    assert len(llamadas) == 3
+    directorio = cache_dir / "sketches" / "hll" / f"v{sketch_cache.FORMATO}-p11"
+    assert sorted(os.listdir(directorio)) == [f"day=2024-05-0{d}.pkl" for d in (6, 7, 8)]
+
+    # Días cerrados: la segunda llamada lee de disco sin recorrer filas
+    segundo = daily_sketches("hll", df, construir, version="p11")
+    assert len(llamadas) == 3
+    pd.testing.assert_series_equal(_por_fecha_hora(segundo), _por_fecha_hora(primero))
+    pd.testing.assert_series_equal(_por_fecha_hora(segundo), _por_fecha_hora(DistinctSketchStore.from_frame(df)))
+
+
+def test_daily_sketches_otra_version_reconstruye(cache_dir):
+    df = _cam(n=5_000)
+    daily_sketches("hll", df, DistinctSketchStore.from_frame, version="p11")
+
+    llamadas = []
+
+    def construir(filas):
+        llamadas.append(len(filas))
+        return DistinctSketchStore.from_frame(filas, error=0.05)
+
+    daily_sketches("hll", df, construir, version="p9")
+    # No se reutilizan los pickles de otra precisión y el directorio antiguo se borra
+    assert len(llamadas) == 3
+    assert os.listdir(cache_dir / "sketches" / "hll") == [f"v{sketch_cache.FORMATO}-p9"]
+
+
+def test_daily_sketches_borra_dias_fuera_de_ventana(cache_dir):
+    df = _cam(n=5_000)
+    daily_sketches("hll", df, DistinctSketchStore.from_frame, version="p11")
+    ultimo = df[df["received_at"] >= "2024-05-08"]
+    daily_sketches("hll", ultimo, DistinctSketchStore.from_frame, version="p11")
+    directorio = cache_dir / "sketches" / "hll" / f"v{sketch_cache.FORMATO}-p11"
+    assert os.listdir(directorio) == ["day=2024-05-08.pkl"]
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+from utils.streaming import ColumnBuffers, read_sql_chunked
+
+
+def _motor(tmp_path, n=1_000):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'v2x.db'}")
+    rng = np.random.default_rng(0)
+    station = rng.integers(1, 2**31, n).astype("float64")
+    # Nulos solo en la segunda mitad: los primeros bloques llegan sin ellos
+    station[n // 2::7] = np.nan
+    pd.DataFrame({
+        "id": np.arange(n),
+        "station_id": station,
+        "speed_kmh": rng.uniform(0, 120, n),
+        "cause_desc": rng.choice(["Obras", "Atasco", "Accidente"], n),
+        "texto": np.where(np.arange(n) % 5 == 0, None, "tramo"),
+        "received_at": pd.date_range("2024-05-01", periods=n, freq="min").astype(str),
+    }).to_sql("denm_ref_message", engine, index=False)
+    return engine
+
+
+def test_bloques_y_crecimiento(tmp_path):
+    engine = _motor(tmp_path)
+    df = read_sql_chunked(engine, "SELECT * FROM denm_ref_message ORDER BY id", chunksize=64)
+    esperado = pd.read_sql("SELECT * FROM denm_ref_message ORDER BY id", engine)
+
+    assert len(df) == len(esperado)
+    assert (df["id"].to_numpy() == esperado["id"].to_numpy()).all()
+    np.testing.assert_allclose(df["speed_kmh"], esperado["speed_kmh"], rtol=1e-6)
+    assert isinstance(df["cause_desc"].dtype, pd.CategoricalDtype)
+    assert (df["cause_desc"].astype(str) == esperado["cause_desc"]).all()
+    assert pd.api.types.is_datetime64_any_dtype(df["received_at"])
+
+
+def test_cadenas_y_enteros_nullable(tmp_path):
+    engine = _motor(tmp_path)
+    df = read_sql_chunked(engine, "SELECT * FROM denm_ref_message ORDER BY id", chunksize=64)
+    esperado = pd.read_sql("SELECT * FROM denm_ref_message ORDER BY id", engine)
+
+    # Las cadenas no se guardan como objetos de Python
+    assert isinstance(df["texto"].dtype, pd.StringDtype)
+    assert df["texto"].dtype.storage == "pyarrow"
+    assert df["texto"].isna().sum() == esperado["texto"].isna().sum()
+    # station_id pasa de uint32 a UInt32 en cuanto aparece un bloque con nulos
+    assert df["station_id"].dtype == "UInt32"
+    assert df["station_id"].isna().sum() == esperado["station_id"].isna().sum()
+    presentes = esperado["station_id"].notna().to_numpy()
+    assert (df["station_id"].to_numpy()[presentes].astype("int64")
+            == esperado["station_id"].to_numpy()[presentes].astype("int64")).all()
+
+
+def test_buffers_crecen_desde_capacidad_pequena():
+    buffers = ColumnBuffers(2)
+    for inicio in range(0, 30, 3):
+        buffers.append(pd.DataFrame({"x": np.arange(inicio, inicio + 3, dtype="int32")}))
+    df = buffers.to_frame()
+    assert buffers.capacidad >= 30
+    assert df["x"].dtype == "int32"
+    assert df["x"].tolist() == list(range(30))
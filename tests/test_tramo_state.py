@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("streamlit")
+from utils.tramo_state import TramoMetricsState
+
+
+def _cam(inicio, minutos, por_minuto=20, semilla=0):
+    rng = np.random.default_rng(semilla)
+    n = minutos * por_minuto
+    return pd.DataFrame({
+        "received_at": pd.Timestamp(inicio) + pd.to_timedelta(np.repeat(np.arange(minutos), por_minuto), unit="min"),
+        "osm_id": rng.choice(["1", "2", "3"], n),
+        "station_id": rng.integers(1, 200, n),
+        "speed_kmh": rng.uniform(10, 100, n),
+        "longitudinal_acc": rng.normal(0, 1, n),
+        "lateral_acc": rng.normal(0, 1, n),
+    })
+
+
+def _vivas(df, estado, ahora):
+    """Filas de los buckets que siguen en la ventana que termina en `ahora`."""
+    inicio_bucket = df["received_at"].dt.floor(estado.ancho)
+    return df[inicio_bucket + estado.ancho > ahora - estado.ventana]
+
+
+def test_ventana_desde_el_ultimo_dato():
+    df = _cam("2025-06-19 08:00", 120)
+    estado = TramoMetricsState().update(df)
+    metricas = estado.window().set_index("osm_id")
+
+    vivas = _vivas(df, estado, df["received_at"].max())
+    assert len(vivas) < len(df)
+    esperado = vivas.groupby("osm_id")["speed_kmh"].agg(["size", "mean"])
+    assert metricas["n_mensajes"].sort_index().tolist() == esperado["size"].tolist()
+    assert np.allclose(metricas["speed_mean"].sort_index(), esperado["mean"])
+
+
+def test_lotes_equivalen_a_una_carga():
+    df = _cam("2025-06-19 08:00", 90, semilla=1)
+    completo = TramoMetricsState().update(df).window().set_index("osm_id").sort_index()
+
+    por_lotes = TramoMetricsState()
+    for _, lote in df.groupby(df["received_at"].dt.floor("7min")):
+        por_lotes.update(lote)
+    incremental = por_lotes.window().set_index("osm_id").sort_index()
+
+    assert incremental["n_mensajes"].tolist() == completo["n_mensajes"].tolist()
+    for columna in ["speed_mean", "speed_std", "speed_min", "speed_max", "long_acc_mean"]:
+        assert np.allclose(incremental[columna], completo[columna])
+
+
+def test_ventana_medida_desde_ahora():
+    df = _cam("2025-06-19 08:00", 30)
+    estado = TramoMetricsState().update(df)
+
+    ahora = df["received_at"].max() + pd.Timedelta(minutes=40)
+    vivas = _vivas(df, estado, ahora)
+    assert estado.window(ahora)["n_mensajes"].sum() == len(vivas)
+
+    # Feed detenido más de una hora: no quedan métricas antiguas a la vista
+    assert estado.window(df["received_at"].max() + pd.Timedelta(hours=2)).empty
+    assert estado.acumulado.n.sum() == 0
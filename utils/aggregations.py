@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# Funciones cuyo resultado puede reagregarse desde un agrupado más fino
+# (nunique, mean o quantile no: necesitan las filas originales)
+REAGREGABLES = {"sum": "sum", "count": "sum", "size": "sum", "min": "min", "max": "max"}
+
+# Versiones de datos que se conservan por fuente (sesiones con datos distintos)
+MAX_VERSIONES = 4
+
+
+@dataclass(frozen=True)
+class AggSpec:
+    """Agregado con nombre: claves de agrupación, medidas y filtros.
+
+    `medidas` son tuplas (nombre, columna, función) y `filtros` tuplas
+    (columna, valores). Dos peticiones con el mismo AggSpec comparten
+    resultado.
+    """
+    claves: tuple
+    medidas: tuple
+    filtros: tuple = ()
+
+    @classmethod
+    def de(cls, claves, medidas, filtros=None):
+        """Construye el spec normalizado (tuplas ordenadas, hashable)."""
+        filtros = tuple(sorted((c, tuple(v)) for c, v in (filtros or {}).items()))
+        return cls(tuple(claves), tuple(sorted(tuple(m) for m in medidas)), filtros)
+
+
+def _agrupar(df, claves, medidas, filtros):
+    """Un único groupby con todas las medidas pedidas para esas claves."""
+    for columna, valores in filtros:
+        df = df[df[columna].isin(valores)]
+    agregados = {nombre: (columna, funcion) for nombre, columna, funcion in medidas}
+    # Los nulos forman su propio grupo: así los agrupados gruesos derivados cuadran
+    return df.groupby(list(claves), observed=True, dropna=False).agg(**agregados).reset_index()
+
+
+def _reagregar(base, claves, medidas):
+    """Deriva un agrupado más grueso a partir de uno más fino ya calculado."""
+    agregados = {nombre: (nombre, REAGREGABLES[funcion]) for nombre, _, funcion in medidas}
+    return base.groupby(list(claves), observed=True, dropna=False).agg(**agregados).reset_index()
+
+
+class AggregationRegistry:
+    """Registro central de agregados por fuente de datos.
+
+    Las páginas declaran agregados con nombre sobre una fuente; al calcularla
+    se deduplican los specs idénticos, se hace un solo groupby por cada
+    combinación (claves, filtros) y los agrupados más gruesos se derivan del
+    más fino cuando las medidas lo permiten. Los resultados se guardan por
+    (fuente, versión de los datos), así que cada groupby corre una vez por
+    refresco aunque varias sesiones y gráficos los pidan. Todo el estado se
+    modifica bajo un lock.
+    """
+
+    def __init__(self, max_versiones=MAX_VERSIONES):
+        self.specs = {}
+        self.max_versiones = max_versiones
+        self.groupbys = 0
+        self._resultados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def request(self, nombre, fuente, spec):
+        """Registra (o reemplaza) el agregado `nombre` sobre `fuente`."""
+        with self._lock:
+            if self.specs.get(nombre) != (fuente, spec):
+                self.specs[nombre] = (fuente, spec)
+                # El plan de esa fuente cambia: se recalcula en la próxima petición
+                for clave in [k for k in self._resultados if k[0] == fuente]:
+                    del self._resultados[clave]
+        return nombre
+
+    def _planificar(self, fuente, df):
+        specs = {spec for f, spec in self.specs.values() if f == fuente}
+        grupos = {}
+        for spec in specs:
+            grupos.setdefault((spec.claves, spec.filtros), set()).update(spec.medidas)
+
+        # De más fino a más grueso, para poder reagregar desde lo ya calculado
+        calculados = {}
+        for (claves, filtros), medidas in sorted(grupos.items(), key=lambda g: -len(g[0][0])):
+            base = next(
+                (
+                    resultado for (claves_base, filtros_base), (resultado, medidas_base) in calculados.items()
+                    if filtros_base == filtros and set(claves) < set(claves_base)
+                    and medidas <= medidas_base and all(m[2] in REAGREGABLES for m in medidas)
+                ),
+                None,
+            )
+            if base is None:
+                resultado = _agrupar(df, claves, medidas, filtros)
+                self.groupbys += 1
+            else:
+                resultado = _reagregar(base, claves, medidas)
+            calculados[(claves, filtros)] = (resultado, medidas)
+
+        return {
+            spec: calculados[(spec.claves, spec.filtros)][0][list(spec.claves) + [m[0] for m in spec.medidas]]
+            for spec in specs
+        }
+
+    def _por_version(self, fuente, df, version):
+        """Resultados por spec de `fuente` para esa versión de los datos."""
+        clave = (fuente, version)
+        with self._lock:
+            if clave in self._resultados:
+                self._resultados.move_to_end(clave)
+            else:
+                self._resultados[clave] = self._planificar(fuente, df)
+                versiones = [k for k in self._resultados if k[0] == fuente]
+                for antigua in versiones[:-self.max_versiones]:
+                    del self._resultados[antigua]
+            return self._resultados[clave], dict(self.specs)
+
+    def compute(self, fuente, df, version):
+        """Todos los agregados registrados sobre `fuente`, por nombre.
+
+        `version` identifica los datos de `df` (p. ej. número de filas y
+        último received_at): con la misma versión no se vuelve a agrupar.
+        Se devuelven copias, porque los resultados se comparten entre sesiones.
+        """
+        por_spec, specs = self._por_version(fuente, df, version)
+        return {nombre: por_spec[spec].copy() for nombre, (f, spec) in specs.items() if f == fuente}
+
+    def get(self, nombre, df, version):
+        """Un agregado por nombre (copia)."""
+        fuente, _ = self.specs[nombre]
+        por_spec, specs = self._por_version(fuente, df, version)
+        return por_spec[specs[nombre][1]].copy()
+
+
+# Registro único del proceso; las páginas declaran sus agregados al ejecutarse
+REGISTRO = AggregationRegistry()
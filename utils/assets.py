@@ -0,0 +1,97 @@
+import os
+import json
+import pyarrow as pa
+import pyarrow.feather as feather
+import shapely
+import geopandas as gpd
+from utils.parquet_cache import CACHE_DIR, temp_path
+
+# Los ficheros estáticos de data/ (GeoJSON, shapefile) son la fuente y el
+# formato de exportación; las páginas leen su versión compilada en Arrow IPC
+# (Feather v2, sin compresión para poder leerla con memory-map).
+ASSETS_DIR = os.path.join(CACHE_DIR, "assets")
+
+# Se incrementa si cambia el formato compilado
+VERSION_ASSETS = "1"
+
+
+def asset_path(fuente):
+    """Ruta del fichero compilado de una fuente."""
+    nombre = os.path.splitext(os.path.basename(fuente))[0]
+    return os.path.join(ASSETS_DIR, f"{nombre}.feather")
+
+
+def source_metadata(fuente, **extra):
+    """Metadatos que validan un compilado: versión del formato y mtime de la fuente.
+
+    Si la fuente no está (despliegue solo con los compilados) no se comprueba
+    el mtime y vale el compilado existente de la misma versión.
+    """
+    metadatos = {"version": VERSION_ASSETS, **extra}
+    if os.path.exists(fuente):
+        metadatos["mtime_fuente"] = str(os.path.getmtime(fuente))
+    return metadatos
+
+
+def write_table(df, ruta, metadatos):
+    """Escribe un DataFrame como Feather sin compresión, de forma atómica."""
+    tabla = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+    tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}), **metadatos})
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    tmp = temp_path(ruta)
+    feather.write_feather(tabla, tmp, compression="uncompressed")
+    os.replace(tmp, ruta)
+    return tabla
+
+
+def read_table(ruta, metadatos, columnas=None):
+    """Tabla Arrow con memory-map, o None si falta o sus metadatos no coinciden."""
+    if not os.path.exists(ruta):
+        return None
+    tabla = feather.read_table(ruta, columns=columnas, memory_map=True)
+    guardados = tabla.schema.metadata or {}
+    if any(guardados.get(k.encode()) != v.encode() for k, v in metadatos.items()):
+        return None
+    return tabla
+
+
+def compile_asset(fuente, ruta=None):
+    """Convierte un fichero geoespacial (GeoJSON, shapefile) a Feather con la geometría en WKB.
+
+    La geometría se describe con los metadatos `geo` de GeoParquet
+    (columna principal, codificación y CRS), de modo que el fichero también
+    se puede abrir con `gpd.read_feather`.
+    """
+    ruta = asset_path(fuente) if ruta is None else ruta
+    gdf = gpd.read_file(fuente)
+    columna = gdf.geometry.name
+    df = gdf.drop(columns=columna).assign(**{columna: shapely.to_wkb(gdf.geometry.to_numpy())})
+    crs = gdf.crs.to_string() if gdf.crs is not None else ""
+    geo = {
+        "version": "1.0.0",
+        "primary_column": columna,
+        "columns": {columna: {"encoding": "WKB", "crs": gdf.crs.to_json_dict() if gdf.crs is not None else None}},
+    }
+    return write_table(df, ruta, source_metadata(fuente, crs=crs, geo=json.dumps(geo)))
+
+
+def load_asset(fuente, columnas=None):
+    """GeoDataFrame de una fuente estática leyendo solo las columnas pedidas.
+
+    La fuente solo se parsea la primera vez o si es más reciente que su
+    compilado. La geometría siempre se incluye.
+    """
+    ruta = asset_path(fuente)
+    metadatos = source_metadata(fuente)
+    if read_table(ruta, metadatos, columnas=[]) is None:
+        compile_asset(fuente, ruta)
+
+    esquema = feather.read_table(ruta, columns=[], memory_map=True).schema.metadata
+    columna = json.loads(esquema[b"geo"])["primary_column"]
+    if columnas is not None:
+        columnas = [c for c in columnas if c != columna] + [columna]
+    tabla = feather.read_table(ruta, columns=columnas, memory_map=True)
+
+    df = tabla.drop_columns([columna]).to_pandas()
+    geometria = shapely.from_wkb(tabla.column(columna).to_numpy(zero_copy_only=False))
+    return gpd.GeoDataFrame(df, geometry=geometria, crs=esquema[b"crs"].decode() or None)
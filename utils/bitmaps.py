@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+from utils.normalize import ORDEN_DIAS, HOUR_CATEGORIES
+
+
+def _to_words(codes, n_bits):
+    """Bitset de palabras de 64 bits con los códigos indicados a 1."""
+    words = np.zeros((n_bits + 63) // 64, dtype=np.uint64)
+    np.bitwise_or.at(words, codes >> 6, np.uint64(1) << (codes & 63).astype(np.uint64))
+    return words
+
+
+class Bitmap:
+    """Conjunto exacto de códigos de station_id.
+
+    Como en los contenedores de Roaring, se guarda como array ordenado de
+    códigos mientras es disperso y como bitset de palabras de 64 bits cuando
+    ocupa menos así (más de un código por cada 32 posibles).
+    """
+
+    __slots__ = ("n_bits", "codes", "words")
+
+    def __init__(self, n_bits, codes=None, words=None):
+        self.n_bits = n_bits
+        self.codes = codes
+        self.words = words
+
+    @classmethod
+    def from_codes(cls, codes, n_bits):
+        """Crea el bitmap desde códigos únicos y ordenados, eligiendo la representación."""
+        codes = np.asarray(codes, dtype=np.uint32)
+        if len(codes) * 32 <= n_bits:
+            return cls(n_bits, codes=codes)
+        return cls(n_bits, words=_to_words(codes, n_bits))
+
+    def _words(self):
+        return self.words if self.words is not None else _to_words(self.codes, self.n_bits)
+
+    def _contiene(self, codes):
+        """Máscara de qué códigos (de un array) están en el bitmap."""
+        if self.words is None:
+            return np.isin(codes, self.codes, assume_unique=True)
+        return ((self.words[codes >> 6] >> (codes & 63).astype(np.uint64)) & np.uint64(1)).astype(bool)
+
+    def __or__(self, otro):
+        if self.words is None and otro.words is None:
+            return Bitmap.from_codes(np.union1d(self.codes, otro.codes), self.n_bits)
+        return Bitmap(self.n_bits, words=self._words() | otro._words())
+
+    def __and__(self, otro):
+        if self.words is None and otro.words is None:
+            return Bitmap(self.n_bits, codes=np.intersect1d(self.codes, otro.codes, assume_unique=True))
+        if self.words is None:
+            return Bitmap(self.n_bits, codes=self.codes[otro._contiene(self.codes)])
+        if otro.words is None:
+            return Bitmap(self.n_bits, codes=otro.codes[self._contiene(otro.codes)])
+        return Bitmap.from_codes(np.flatnonzero(np.unpackbits(
+            (self.words & otro.words).view(np.uint8), bitorder="little")), self.n_bits)
+
+    def __len__(self):
+        if self.words is None:
+            return len(self.codes)
+        return int(np.bitwise_count(self.words).sum())
+
+
+class BitmapIndex:
+    """Índice exacto de vehículos distintos por (fecha, hora, name_osmid).
+
+    station_id se codifica con un diccionario y cada clave guarda sus códigos
+    ordenados; uniones e intersecciones de claves (una franja horaria, un
+    tramo, "tramo A y tramo B") se resuelven con operaciones de conjuntos.
+    Expone la misma interfaz count/count_by que DistinctSketchStore.
+    """
+
+    CLAVES = ["date", "hour", "name_osmid"]
+
+    def __init__(self, fechas, horas, tramos, station_ids):
+        claves = pd.DataFrame({
+            "date": pd.to_datetime(pd.Series(fechas)).dt.normalize().to_numpy(),
+            "hour": np.asarray(horas, dtype=np.int8),
+            "name_osmid": pd.Series(tramos).astype(str).to_numpy(),
+        })
+        validos = pd.notna(np.asarray(station_ids, dtype=float)) & (claves["hour"].to_numpy() >= 0)
+        claves = claves[validos]
+
+        codigos, self.station_ids = pd.factorize(np.asarray(station_ids)[validos], sort=True)
+        self.n_bits = max(len(self.station_ids), 1)
+        clave_id, unicas = pd.MultiIndex.from_frame(claves).factorize(sort=True)
+        self.claves = unicas.to_frame(index=False, name=self.CLAVES)
+
+        # Pares (clave, vehículo) únicos y ordenados: formato CSR por clave
+        pares = np.unique(clave_id.astype(np.int64) * self.n_bits + codigos)
+        self.codes = (pares % self.n_bits).astype(np.uint32)
+        self.offsets = np.searchsorted(pares // self.n_bits, np.arange(len(self.claves) + 1))
+
+    @classmethod
+    def from_frame(cls, df, hora="hour"):
+        """Construye el índice desde un DataFrame de CAM (received_at, hora, name_osmid, station_id)."""
+        horas = df[hora]
+        if isinstance(horas.dtype, pd.CategoricalDtype):
+            horas = horas.cat.codes
+        tramos = df["name_osmid"] if "name_osmid" in df.columns else pd.Series("", index=df.index)
+        return cls(df["received_at"], horas, tramos, df["station_id"])
+
+    def _mascara(self, fechas=None, horas=None, tramos=None, dias_semana=None):
+        """Claves que cumplen los filtros."""
+        m = np.ones(len(self.claves), dtype=bool)
+        if fechas is not None:
+            m &= self.claves["date"].isin(pd.to_datetime(pd.Series(fechas)).dt.normalize()).to_numpy()
+        if horas is not None:
+            m &= self.claves["hour"].isin(horas).to_numpy()
+        if tramos is not None:
+            m &= self.claves["name_osmid"].isin([str(t) for t in tramos]).to_numpy()
+        if dias_semana is not None:
+            dias = np.asarray(ORDEN_DIAS)[pd.to_datetime(self.claves["date"]).dt.dayofweek.to_numpy()]
+            m &= np.isin(dias, list(dias_semana))
+        return m
+
+    def _union(self, filas):
+        """Bitmap con la unión de las claves indicadas."""
+        trozos = [self.codes[self.offsets[i]:self.offsets[i + 1]] for i in filas]
+        if not trozos:
+            return Bitmap(self.n_bits, codes=np.zeros(0, dtype=np.uint32))
+        return Bitmap.from_codes(np.unique(np.concatenate(trozos)), self.n_bits)
+
+    def select(self, **filtros):
+        """Bitmap de los vehículos vistos en las claves filtradas (para combinar con | y &)."""
+        return self._union(np.flatnonzero(self._mascara(**filtros)))
+
+    def count(self, **filtros):
+        """Vehículos distintos exactos en la unión de las claves filtradas."""
+        return len(self.select(**filtros))
+
+    def count_by(self, por, **filtros):
+        """Vehículos distintos exactos por grupo (p. ej. ["date", "hour"])."""
+        filas = np.flatnonzero(self._mascara(**filtros))
+        claves = self.claves.iloc[filas].reset_index(drop=True)
+        if "weekday_es" in por:
+            claves["weekday_es"] = pd.Categorical(
+                np.asarray(ORDEN_DIAS)[pd.to_datetime(claves["date"]).dt.dayofweek.to_numpy()],
+                categories=ORDEN_DIAS, ordered=True
+            )
+        if claves.empty:
+            return pd.DataFrame(columns=list(por) + ["vehículos"])
+
+        grupos = claves.groupby(list(por), observed=True, sort=True).indices
+        resultado = pd.DataFrame(list(grupos.keys()), columns=list(por))
+        resultado["vehículos"] = [len(self._union(filas[i])) for i in grupos.values()]
+        if "hour" in por:
+            resultado["hour_label"] = pd.Categorical.from_codes(
+                resultado["hour"].astype(np.int8), categories=HOUR_CATEGORIES, ordered=True
+            )
+        return resultado
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+# Definición del README: más de 100 m recorridos por debajo de 20 km/h
+UMBRAL_LENTO_KMH = 20
+LONGITUD_MINIMA_M = 100
+
+# Un hueco mayor entre mensajes del mismo vehículo corta el tramo lento
+HUECO_MAXIMO = pd.Timedelta(seconds=60)
+
+RADIO_TIERRA_M = 6_371_008.8
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Distancia en metros entre pares de puntos (grados), vectorizada."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * RADIO_TIERRA_M * np.arcsin(np.sqrt(a))
+
+
+def _tramo_mayoritario(run, osm_ids):
+    """osm_id más frecuente de cada tramo lento."""
+    conteos = (
+        pd.DataFrame({"run": run, "osm_id": osm_ids})
+        .value_counts(sort=False).rename("n").reset_index()
+        .sort_values(["run", "n"], ascending=[True, False], kind="stable")
+        .drop_duplicates("run")
+    )
+    return conteos.set_index("run")["osm_id"]
+
+
+def _nanosegundos(serie):
+    """generation_time_real como enteros en ns (UTC si la columna tiene zona horaria)."""
+    tiempos = pd.to_datetime(serie)
+    if tiempos.dt.tz is not None:
+        tiempos = tiempos.dt.tz_convert("UTC").dt.tz_localize(None)
+    return tiempos.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+def _orden_vehiculo_tiempo(estaciones, tiempos):
+    """Permutación que ordena por (station_id, tiempo).
+
+    Si el código del vehículo y el tiempo relativo caben juntos en 63 bits se
+    ordena una sola clave empaquetada, bastante más rápido que lexsort. Los
+    mensajes de un vehículo con idéntico tiempo quedan en orden arbitrario.
+    """
+    codigos, unicos = pd.factorize(estaciones, sort=True)
+    relativos = tiempos - tiempos.min()
+    bits_tiempo = int(relativos.max()).bit_length()
+    if int(len(unicos)).bit_length() + bits_tiempo <= 63:
+        return np.argsort((codigos.astype(np.int64) << bits_tiempo) | relativos)
+    return np.lexsort((tiempos, estaciones))
+
+
+def detect_congestion(df, umbral_kmh=UMBRAL_LENTO_KMH, longitud_minima_m=LONGITUD_MINIMA_M,
+                      hueco_maximo=HUECO_MAXIMO):
+    """Segmentos de congestión por vehículo, sin bucles por vehículo.
+
+    Se ordena una vez por (station_id, generation_time_real); los puntos
+    consecutivos del mismo vehículo por debajo de `umbral_kmh` forman
+    tramos lentos (run-lengths) y su longitud es la suma de las distancias
+    haversine entre puntos. Se devuelven los tramos de más de
+    `longitud_minima_m` con inicio/fin, longitud, velocidad media y osm_id.
+    """
+    columnas = ["station_id", "inicio", "fin", "lat_inicio", "lon_inicio", "lat_fin", "lon_fin",
+                "longitud_m", "n_puntos", "velocidad_media", "osm_id"]
+    if df.empty:
+        return pd.DataFrame(columns=columnas)
+
+    estaciones = df["station_id"].to_numpy(dtype=np.int64, na_value=-1)
+    tiempos = _nanosegundos(df["generation_time_real"])
+    orden = _orden_vehiculo_tiempo(estaciones, tiempos)
+    estaciones, tiempos = estaciones[orden], tiempos[orden]
+    lat = df["latitude"].to_numpy(dtype=np.float64)[orden]
+    lon = df["longitude"].to_numpy(dtype=np.float64)[orden]
+    velocidad = df["speed_kmh"].to_numpy(dtype=np.float64, na_value=np.nan)[orden]
+
+    # Un punto continúa el tramo del anterior si es el mismo vehículo, sin hueco, y ambos son lentos
+    lento = (velocidad < umbral_kmh) & (estaciones >= 0)
+    continua = np.zeros(len(lento), dtype=bool)
+    continua[1:] = (
+        lento[1:] & lento[:-1]
+        & (estaciones[1:] == estaciones[:-1])
+        & (np.diff(tiempos) <= hueco_maximo.value)
+    )
+    inicios = np.flatnonzero(lento & ~continua)
+    if len(inicios) == 0:
+        return pd.DataFrame(columns=columnas)
+    # El tramo termina en el último punto lento al que no continúa el siguiente
+    finales = np.flatnonzero(lento & ~np.r_[continua[1:], False])
+    run = np.cumsum(lento & ~continua) - 1
+    en_run = lento
+
+    pasos = np.zeros(len(lento))
+    i = np.flatnonzero(continua)
+    pasos[i] = haversine_m(lat[i - 1], lon[i - 1], lat[i], lon[i])
+    run_puntos = run[en_run]
+    longitud = np.bincount(run_puntos, weights=pasos[en_run], minlength=len(inicios))
+    n_puntos = np.bincount(run_puntos, minlength=len(inicios))
+    velocidad_media = np.bincount(run_puntos, weights=velocidad[en_run], minlength=len(inicios)) / n_puntos
+
+    # Solo los tramos suficientemente largos pasan a la salida
+    largos = np.flatnonzero(longitud > longitud_minima_m)
+    inicios, finales = inicios[largos], finales[largos]
+    segmentos = pd.DataFrame({
+        "station_id": estaciones[inicios],
+        "inicio": tiempos[inicios].view("datetime64[ns]"),
+        "fin": tiempos[finales].view("datetime64[ns]"),
+        "lat_inicio": lat[inicios],
+        "lon_inicio": lon[inicios],
+        "lat_fin": lat[finales],
+        "lon_fin": lon[finales],
+        "longitud_m": longitud[largos],
+        "n_puntos": n_puntos[largos],
+        "velocidad_media": velocidad_media[largos],
+    })
+    if "osm_id" in df.columns:
+        puntos = np.flatnonzero(en_run)
+        puntos = puntos[np.isin(run[puntos], largos)]
+        osm_ids = df["osm_id"].to_numpy()[orden[puntos]]
+        segmentos["osm_id"] = _tramo_mayoritario(run[puntos], osm_ids).reindex(largos).to_numpy()
+    else:
+        segmentos["osm_id"] = None
+
+    return segmentos[columnas]
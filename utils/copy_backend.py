@@ -0,0 +1,48 @@
+import re
+import tempfile
+import pyarrow.csv as pv
+from utils.streaming import coerce_chunk
+
+# A partir de este tamaño el volcado de COPY pasa de memoria a disco
+SPOOL_MAX_BYTES = 64 * 1024 * 1024
+
+_PARAM = re.compile(r"(?<!:):(\w+)")
+
+
+def parse_copy_csv(stream):
+    """Parsea un flujo `COPY ... TO STDOUT WITH (FORMAT csv, HEADER true)`.
+
+    El parseo lo hace pyarrow en C, por columnas; los vacíos sin comillas son
+    NULL y los "" entrecomillados cadenas vacías, como los emite PostgreSQL.
+    """
+    tabla = pv.read_csv(
+        stream,
+        convert_options=pv.ConvertOptions(strings_can_be_null=True, quoted_strings_can_be_null=False),
+    )
+    return coerce_chunk(tabla.to_pandas())
+
+
+def read_copy_file(ruta):
+    """Lee un volcado COPY guardado en disco (sustituto sin base de datos)."""
+    with open(ruta, "rb") as f:
+        return parse_copy_csv(f)
+
+
+def read_sql_copy(engine, query, params=None):
+    """Extrae `query` con COPY ... TO STDOUT y la parsea de forma vectorizada.
+
+    Los parámetros `:nombre` de la consulta se enlazan con mogrify de psycopg2,
+    porque COPY no admite parámetros de servidor.
+    """
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        # Offsets en UTC para que pyarrow interprete received_at sin ambigüedad
+        cur.execute("SET TIME ZONE 'UTC'")
+        sql = cur.mogrify(_PARAM.sub(r"%(\1)s", query.text), params or {}).decode("utf-8")
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as volcado:
+            cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", volcado)
+            volcado.seek(0)
+            return parse_copy_csv(volcado)
+    finally:
+        conn.close()
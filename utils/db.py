@@ -0,0 +1,61 @@
+import threading
+import streamlit as st
+from sqlalchemy import create_engine, event, text
+
+# Pool compartido por todas las sesiones del proceso
+POOL_SIZE = 5
+MAX_OVERFLOW = 5
+POOL_RECYCLE_S = 1800
+
+# Límite por defecto de cada sentencia; se puede cambiar por consulta
+STATEMENT_TIMEOUT_MS = 120_000
+
+_metricas = {"conexiones": 0, "checkouts": 0, "checkins": 0, "invalidadas": 0}
+_lock = threading.Lock()
+
+
+def _contar(nombre):
+    with _lock:
+        _metricas[nombre] += 1
+
+
+def _instrumentar(engine):
+    """Registra eventos del pool para las métricas."""
+    event.listen(engine, "connect", lambda *_: _contar("conexiones"))
+    event.listen(engine, "checkout", lambda *_: _contar("checkouts"))
+    event.listen(engine, "checkin", lambda *_: _contar("checkins"))
+    event.listen(engine, "invalidate", lambda *_: _contar("invalidadas"))
+
+
+@st.cache_resource
+def get_engine():
+    """Engine único del proceso, con pool, pre-ping y statement_timeout."""
+    engine = create_engine(
+        st.secrets["db_url"],
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_pre_ping=True,
+        pool_recycle=POOL_RECYCLE_S,
+        connect_args={"options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"},
+    )
+    _instrumentar(engine)
+    return engine
+
+
+def set_statement_timeout(conn, ms):
+    """Cambia el statement_timeout solo para la transacción en curso de `conn`."""
+    conn.execute(text(f"SET LOCAL statement_timeout = {int(ms)}"))
+
+
+def pool_metrics():
+    """Estado del pool y contadores acumulados de conexiones."""
+    pool = get_engine().pool
+    with _lock:
+        metricas = dict(_metricas)
+    metricas.update({
+        "tamaño": pool.size(),
+        "en_uso": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "libres": pool.checkedin(),
+    })
+    return metricas
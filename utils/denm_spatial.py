@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from utils.parquet_cache import CACHE_DIR, store_lock, temp_path
+from utils.geometry_store import CRS_METRICO
+
+# Atribución persistida: una fila por evento DENM (id → osm_id)
+RUTA_ATRIBUCION = os.path.join(CACHE_DIR, "denm_tramo.parquet")
+
+# Distancia máxima admitida al tramo (en CRS_METRICO)
+DISTANCIA_MAXIMA_M = 50
+
+
+def denm_points(df):
+    """GeoDataFrame de eventos DENM con puntos construidos de forma vectorizada."""
+    return gpd.GeoDataFrame(
+        df, geometry=gpd.points_from_xy(df["longitude"], df["latitude"]), crs="EPSG:4326"
+    )
+
+
+def _tramo_mas_cercano(gdf_eventos, m30):
+    """sjoin_nearest indexado de eventos a tramos, en EPSG:25830."""
+    eventos = gdf_eventos[["id", "geometry"]].to_crs(epsg=CRS_METRICO)
+    tramos = m30[["osm_id", "geometry"]].to_crs(epsg=CRS_METRICO)
+    unidos = gpd.sjoin_nearest(
+        eventos, tramos, how="left", max_distance=DISTANCIA_MAXIMA_M, distance_col="distancia_m"
+    )
+    # En caso de empate a la misma distancia se queda el primer tramo
+    unidos = unidos[~unidos.index.duplicated(keep="first")]
+    return pd.DataFrame({
+        "id": unidos["id"].to_numpy(dtype=np.int64),
+        "osm_id": unidos["osm_id"].astype("string").to_numpy(),
+        "distancia_m": unidos["distancia_m"].to_numpy(dtype=np.float64),
+    })
+
+
+def _leer_atribucion():
+    if not os.path.exists(RUTA_ATRIBUCION):
+        return pd.DataFrame({
+            "id": pd.Series(dtype="int64"),
+            "osm_id": pd.Series(dtype="string"),
+            "distancia_m": pd.Series(dtype="float64"),
+        })
+    return pd.read_parquet(RUTA_ATRIBUCION)
+
+
+def attribute_denm(gdf_eventos, m30):
+    """osm_id del tramo más cercano de cada evento, persistido entre ejecuciones.
+
+    Solo se calcula la unión espacial de los ids que aún no están en
+    RUTA_ATRIBUCION; el resultado se guarda de forma atómica y bajo
+    store_lock. Los eventos a más de DISTANCIA_MAXIMA_M de cualquier tramo
+    quedan sin osm_id.
+    """
+    with store_lock("denm_tramo"):
+        atribucion = _leer_atribucion()
+        nuevos = gdf_eventos[~gdf_eventos["id"].isin(atribucion["id"])]
+        if not nuevos.empty:
+            atribucion = pd.concat([atribucion, _tramo_mas_cercano(nuevos, m30)], ignore_index=True)
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp = temp_path(RUTA_ATRIBUCION)
+            atribucion.to_parquet(tmp, index=False)
+            os.replace(tmp, RUTA_ATRIBUCION)
+    return atribucion
+
+
+def add_osm_id(df, m30):
+    """Añade osm_id (tramo más cercano) y la distancia al tramo a los eventos DENM."""
+    gdf = df if isinstance(df, gpd.GeoDataFrame) else denm_points(df)
+    atribucion = attribute_denm(gdf, m30).set_index("id")
+    gdf["osm_id"] = atribucion["osm_id"].reindex(gdf["id"].to_numpy()).to_numpy()
+    gdf["distancia_tramo_m"] = atribucion["distancia_m"].reindex(gdf["id"].to_numpy()).to_numpy()
+    return gdf
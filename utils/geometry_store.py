@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+import streamlit as st
+from utils.assets import ASSETS_DIR, source_metadata, write_table, read_table
+
+# Fuente (shapefile OSM) y almacén compilado en formato Arrow IPC (Feather v2)
+RUTA_SHP = "./data/m30_osm_v3.shp"
+RUTA_ALMACEN = os.path.join(ASSETS_DIR, "m30_geometrias.feather")
+
+# CRS geográfico de los mapas y CRS métrico de longitudes y distancias
+CRS_GEOGRAFICO = 4326
+CRS_METRICO = 25830
+
+
+def compile_geometry_store(ruta_shp=RUTA_SHP, ruta=RUTA_ALMACEN):
+    """Compila el shapefile de la M30 a un fichero Arrow con las geometrías en ambos CRS.
+
+    Una fila por tramo con su código entero (posición), los atributos del
+    shapefile, la geometría en WKB en EPSG:4326 y EPSG:25830, la longitud en
+    metros y la caja envolvente en ambos CRS, con utils.assets.write_table.
+    """
+    gdf = gpd.read_file(ruta_shp).to_crs(epsg=CRS_GEOGRAFICO).reset_index(drop=True)
+    geograficas = gdf.geometry.to_numpy()
+    metricas = gdf.geometry.to_crs(epsg=CRS_METRICO).to_numpy()
+    caja = shapely.bounds(geograficas)
+    caja_m = shapely.bounds(metricas)
+
+    tabla = pd.DataFrame(gdf.drop(columns="geometry"))
+    tabla.insert(0, "osm_code", np.arange(len(gdf), dtype=np.int32))
+    tabla["longitud_m"] = shapely.length(metricas)
+    for i, eje in enumerate(["xmin", "ymin", "xmax", "ymax"]):
+        tabla[eje] = caja[:, i]
+        tabla[f"{eje}_m"] = caja_m[:, i]
+    tabla["wkb_4326"] = shapely.to_wkb(geograficas)
+    tabla["wkb_25830"] = shapely.to_wkb(metricas)
+
+    return write_table(tabla, ruta, source_metadata(ruta_shp))
+
+
+class GeometryStore:
+    """Geometrías de los tramos de la M30 precompiladas en ambos CRS.
+
+    Los atributos, longitudes y cajas se leen tal cual del fichero Arrow; el
+    WKB de cada CRS solo se decodifica la primera vez que se pide y queda
+    guardado. El código entero de un tramo es su posición en la tabla, el
+    mismo `osm_code` que usan las métricas por tramo.
+    """
+
+    def __init__(self, tabla):
+        self.tabla = tabla
+        self._geometrias = {}
+        columnas = [c for c in tabla.column_names if not c.startswith("wkb_")]
+        self.atributos = tabla.select(columnas).to_pandas()
+
+    @classmethod
+    def load(cls, ruta=RUTA_ALMACEN, ruta_shp=RUTA_SHP):
+        """Abre el almacén y lo recompila antes si falta o el shapefile (si está) es más reciente."""
+        tabla = read_table(ruta, source_metadata(ruta_shp))
+        if tabla is None:
+            tabla = compile_geometry_store(ruta_shp, ruta)
+        return cls(tabla)
+
+    def __len__(self):
+        return self.tabla.num_rows
+
+    def geometries(self, epsg=CRS_GEOGRAFICO):
+        """Array de geometrías shapely en EPSG:4326 o EPSG:25830."""
+        if epsg not in self._geometrias:
+            wkb = self.tabla.column(f"wkb_{epsg}").to_numpy(zero_copy_only=False)
+            self._geometrias[epsg] = shapely.from_wkb(wkb)
+        return self._geometrias[epsg]
+
+    def codes(self, osm_ids):
+        """Código entero de cada osm_id (-1 si no es un tramo de la M30)."""
+        return pd.Index(self.atributos["osm_id"].astype(str)).get_indexer(pd.Series(osm_ids).astype(str))
+
+    def names(self, osm_ids):
+        """Nombre OSM del tramo de cada osm_id (la clave `name_osmid` de CAM); NaN fuera de la M30."""
+        codigos = self.codes(osm_ids)
+        nombres = self.atributos["name"].to_numpy(dtype=object)[np.where(codigos >= 0, codigos, 0)]
+        return pd.Series(nombres, index=getattr(osm_ids, "index", None)).where(codigos >= 0)
+
+    def to_gdf(self, epsg=CRS_GEOGRAFICO):
+        """GeoDataFrame de tramos con atributos, longitud y cajas."""
+        return gpd.GeoDataFrame(
+            self.atributos.drop(columns="osm_code"),
+            geometry=self.geometries(epsg),
+            crs=f"EPSG:{epsg}",
+        )
+
+
+def segment_lengths_m(m30):
+    """Longitud en metros de cada tramo: precompilada si está, si no en EPSG:25830."""
+    if "longitud_m" in m30.columns:
+        return m30["longitud_m"].to_numpy(dtype=np.float64)
+    return m30.geometry.to_crs(epsg=CRS_METRICO).length.to_numpy()
+
+
+@st.cache_resource
+def get_geometry_store():
+    """Almacén de geometrías de la M30, abierto una vez por proceso y compartido por las páginas."""
+    return GeometryStore.load()
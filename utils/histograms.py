@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from utils.normalize import HOUR_CATEGORIES
+
+# Bins fijos de 5 km/h: 0-5, ..., 95-100 y 100+
+ANCHO_BIN_KMH = 5
+N_BINS = 21
+ETIQUETAS_BINS = [f"{i}-{i + ANCHO_BIN_KMH} km/h" for i in range(0, 100, ANCHO_BIN_KMH)] + ["100+ km/h"]
+TODAS_LAS_HORAS = "Todas las horas"
+
+
+def speed_bin_codes(velocidades):
+    """Código de bin (0..20) de cada velocidad; N_BINS para los valores nulos."""
+    velocidades = np.asarray(velocidades, dtype=np.float64)
+    nulos = np.isnan(velocidades)
+    codigos = np.floor_divide(np.nan_to_num(velocidades), ANCHO_BIN_KMH).astype(np.int64)
+    codigos = np.clip(codigos, 0, N_BINS - 1)
+    codigos[nulos] = N_BINS
+    return codigos
+
+
+def speed_histogram_cube(horas, velocidades):
+    """Matriz de conteos hora × bin de velocidad en una sola pasada.
+
+    `horas` son los códigos 0..23 de `hour_label` (-1 si falta la hora). Devuelve
+    el cubo (24 horas + "Todas las horas" × 21 bins), el número total de filas
+    por hora (incluidas las que no tienen velocidad) y la velocidad media.
+    """
+    horas = np.asarray(horas, dtype=np.int64)
+    velocidades = np.asarray(velocidades, dtype=np.float64)
+    codigos = speed_bin_codes(velocidades)
+    con_hora = horas >= 0
+
+    # Índice plano hora * (bins + nulos) + bin
+    celdas = horas[con_hora] * (N_BINS + 1) + codigos[con_hora]
+    conteos = np.bincount(celdas, minlength=24 * (N_BINS + 1)).reshape(24, N_BINS + 1)
+    sumas = np.bincount(
+        horas[con_hora], weights=np.nan_to_num(velocidades[con_hora]), minlength=24
+    )
+    conteos = np.vstack([conteos, np.bincount(codigos, minlength=N_BINS + 1)])
+    sumas = np.append(sumas, np.nansum(velocidades))
+
+    filas = HOUR_CATEGORIES + [TODAS_LAS_HORAS]
+    cubo = pd.DataFrame(conteos[:, :N_BINS], index=filas, columns=ETIQUETAS_BINS)
+    totales = pd.Series(conteos.sum(axis=1), index=filas)
+    validos = conteos[:, :N_BINS].sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        medias = pd.Series(sumas / validos, index=filas)
+    return cubo, totales, medias
+
+
+def speed_distribution(cubo, totales, fila):
+    """Porcentaje por bin (solo bins con datos) de una fila del cubo."""
+    conteos = cubo.loc[fila]
+    porcentajes = (conteos / totales.loc[fila] * 100).round(1)
+    return porcentajes[conteos > 0]
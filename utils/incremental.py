@@ -0,0 +1,161 @@
+import json
+import os
+import shutil
+import time
+from contextlib import suppress
+from dataclasses import replace
+import pandas as pd
+from utils.queries import build_query
+from utils.streaming import read_sql_chunked
+from utils.copy_backend import read_sql_copy
+from utils.parquet_cache import (
+    CACHE_DIR, store_dir, store_lock, temp_path, write_partitions, read_partitions, drop_partitions_before
+)
+
+# Margen hacia atrás sobre la marca de agua para recoger llegadas tardías
+SOLAPE = pd.Timedelta(minutes=15)
+
+# Métodos de extracción disponibles; se eligen con `loader_backend` en secrets
+BACKENDS = {
+    "cursor": read_sql_chunked,
+    "copy": read_sql_copy,
+}
+
+# Si la marca de agua es más reciente que esto, se sirve la caché sin ir a la base de datos
+FRESCURA_S = 300
+
+# Almacenes con inicio propio (`QuerySpec.desde`) que se conservan por consulta;
+# al pasar de este número se borran los usados hace más tiempo
+MAX_ALMACENES_DESDE = 2
+
+
+def _ruta_watermark(nombre):
+    """Ruta de la marca de agua de un almacén."""
+    return os.path.join(CACHE_DIR, f"{nombre}.watermark.json")
+
+
+def read_watermark(nombre):
+    """Lee la marca de agua (máximo received_at y message_id) de un almacén."""
+    ruta_wm = _ruta_watermark(nombre)
+    try:
+        with open(ruta_wm, encoding="utf-8") as f:
+            wm = json.load(f)
+        edad_s = time.time() - os.path.getmtime(ruta_wm)
+    except FileNotFoundError:
+        # No existe o la ha borrado otra sesión entre medias
+        return None
+    return {
+        "received_at": pd.Timestamp(wm["received_at"]),
+        "message_id": int(wm["message_id"]),
+        "edad_s": edad_s,
+    }
+
+
+def _write_watermark(nombre, received_at, message_id):
+    """Guarda la marca de agua de forma atómica."""
+    ruta_wm = _ruta_watermark(nombre)
+    tmp = temp_path(ruta_wm)
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"received_at": pd.Timestamp(received_at).isoformat(), "message_id": int(message_id)}, f)
+    os.replace(tmp, ruta_wm)
+
+
+def _borrar_almacen(nombre):
+    """Borra las particiones y la marca de agua de un almacén."""
+    with store_lock(nombre):
+        shutil.rmtree(store_dir(nombre), ignore_errors=True)
+        with suppress(FileNotFoundError):
+            os.remove(_ruta_watermark(nombre))
+
+
+def evict_desde_stores(spec, conservar=MAX_ALMACENES_DESDE):
+    """Limita los almacenes con inicio propio de la misma consulta que `spec`.
+
+    Cada `desde` distinto crea su almacén con una descarga completa; se
+    conservan los `conservar` usados más recientemente (por la fecha de su
+    marca de agua) y siempre el de `spec`.
+    """
+    prefijo = replace(spec, desde=None).store_key() + "_desde"
+    # Directorio de particiones, <nombre>.watermark.json y <nombre>.lock
+    nombres = {entrada.split(".")[0] for entrada in os.listdir(CACHE_DIR) if entrada.startswith(prefijo)}
+    nombres.discard(spec.store_key())
+
+    def _ultimo_uso(nombre):
+        with suppress(FileNotFoundError):
+            return os.path.getmtime(_ruta_watermark(nombre))
+        return 0.0
+
+    for nombre in sorted(nombres, key=_ultimo_uso, reverse=True)[max(conservar - 1, 0):]:
+        _borrar_almacen(nombre)
+
+
+def _recortar_ventana(df, inicio):
+    """Descarta las filas anteriores al inicio de la ventana."""
+    recibido = pd.to_datetime(df["received_at"])
+    inicio = pd.Timestamp(inicio)
+    if recibido.dt.tz is not None and inicio.tz is None:
+        inicio = inicio.tz_localize(recibido.dt.tz)
+    return df[recibido > inicio]
+
+
+def load_incremental(engine, spec, backend="cursor", solo_nuevas=False):
+    """Trae solo las filas nuevas de la consulta `spec` y las añade a la caché diaria.
+
+    Se piden las filas con received_at posterior a la marca de agua menos
+    SOLAPE, o con clave mayor que la última vista. Si la marca de agua tiene
+    menos de FRESCURA_S segundos se lee directamente de la caché. `backend`
+    elige el método de extracción de BACKENDS. Todo el ciclo se hace bajo
+    store_lock del almacén. Si `spec` fija `desde`, antes se recortan los
+    almacenes de otros inicios de la misma consulta (evict_desde_stores).
+
+    Devuelve la ventana completa; con `solo_nuevas=True`, solo las filas
+    traídas de la base de datos en esta llamada (incluido el solape, vacío
+    si se sirvió la caché), sin leer las particiones: para consumidores que
+    mantienen su propio estado incremental.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    nombre = spec.store_key()
+    inicio = spec.inicio_ventana()
+    if spec.desde is not None:
+        evict_desde_stores(spec)
+
+    # Lectura de la marca, consulta, escritura de particiones y nueva marca como
+    # una sola sección crítica: otra sesión espera y después sirve la caché
+    with store_lock(nombre):
+        wm = read_watermark(nombre)
+        df_nuevo = None
+        if wm is None:
+            query, params = build_query(spec)
+        elif wm["edad_s"] < FRESCURA_S:
+            query = None
+        else:
+            query, params = build_query(spec, desde=wm["received_at"] - SOLAPE, ultimo_id=wm["message_id"])
+
+        if query is not None:
+            df_nuevo = BACKENDS[backend](engine, query, params)
+            if not df_nuevo.empty:
+                write_partitions(nombre, df_nuevo, spec.clave)
+                received_at = pd.to_datetime(df_nuevo["received_at"]).max()
+                message_id = df_nuevo[spec.clave].max()
+                if wm is not None:
+                    received_at = max(received_at, wm["received_at"])
+                    message_id = max(message_id, wm["message_id"])
+                _write_watermark(nombre, received_at, message_id)
+            elif wm is not None:
+                # Sin filas nuevas: se renueva la marca para no volver a consultar enseguida
+                _write_watermark(nombre, wm["received_at"], wm["message_id"])
+
+        drop_partitions_before(nombre, inicio)
+        if solo_nuevas:
+            if df_nuevo is None or df_nuevo.empty:
+                return pd.DataFrame()
+            return _recortar_ventana(df_nuevo, inicio).reset_index(drop=True)
+        df = read_partitions(nombre, desde=inicio)
+        if df is None:
+            if df_nuevo is None:
+                # Caché vacía para esta ventana: se fuerza la consulta completa
+                with suppress(FileNotFoundError):
+                    os.remove(_ruta_watermark(nombre))
+                return load_incremental(engine, spec, backend)
+            return df_nuevo
+        return _recortar_ventana(df, inicio).reset_index(drop=True)
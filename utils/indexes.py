@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+
+class TramoIndex:
+    """Índice de filas DENM por tramo.
+
+    Las filas DENM con tramo atribuido se ordenan (una sola vez) por
+    `name_osmid`: cada tramo ocupa un rango contiguo de esa permutación. Así,
+    consultar un tramo cuesta O(filas del tramo) sin recorrer la tabla
+    completa; el DataFrame no se copia, solo se guarda la permutación. La
+    lista de tramos la da quien construye el índice (la tabla resumen por
+    tramo), de modo que un tramo sin eventos devuelve cero filas.
+    """
+
+    def __init__(self, df_denm, tramos, clave="name_osmid"):
+        self.df_denm = df_denm
+        self.tramos = pd.Index(tramos, name=clave)
+
+        if clave in df_denm.columns:
+            codigos = self.tramos.get_indexer(df_denm[clave])
+        else:
+            codigos = np.full(len(df_denm), -1)
+        orden = np.argsort(codigos, kind="stable")
+        # Las filas sin tramo (código -1) quedan al principio y se descartan
+        self.orden = orden[np.count_nonzero(codigos < 0):]
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(codigos[codigos >= 0], minlength=len(self.tramos)))]
+        )
+
+    def denm_tramo_rows(self, tramo):
+        """Filas DENM atribuidas al tramo (búsqueda directa por clave)."""
+        i = self.tramos.get_loc(tramo)
+        return self.df_denm.take(self.orden[self.offsets[i]:self.offsets[i + 1]])
@@ -1,44 +1,79 @@
-import pandas as pd
-import geopandas as gpd
+import time
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
-from sqlalchemy import create_engine
+from utils.db import get_engine
+from utils.incremental import load_incremental
+from utils.queries import QuerySpec
+from utils.normalize import normalize_cam, normalize_denm
+from utils.schema import CAM_SCHEMA, DENM_SCHEMA, apply_schema
+from utils.geometry_store import get_geometry_store
+
+# Consultas por defecto: todas las columnas desde FECHA_INICIO
+CAM_TODO = QuerySpec("cam_ref_message")
+DENM_TODO = QuerySpec("denm_ref_message")
+
+
+def _load_table(engine, spec, backend, normalizar, schema):
+    """Carga una tabla de forma incremental, la normaliza y aplica su esquema compacto."""
+    # Solo se descargan las filas nuevas; el histórico se lee del almacén local
+    df = load_incremental(engine, spec, backend)
+    return apply_schema(normalizar(df), schema)
+
+
+def _read_m30(store):
+    """Tramos de la M30 en EPSG:4326 desde el almacén de geometrías precompilado."""
+    return store.to_gdf()
+
+
+def _run_concurrently(tareas):
+    """Ejecuta tareas de E/S independientes en hilos y mide cada una.
+
+    Devuelve los resultados y los segundos por tarea; la latencia total queda
+    acotada por la tarea más lenta.
+    """
+    def _medir(func):
+        inicio = time.perf_counter()
+        resultado = func()
+        return resultado, time.perf_counter() - inicio
+
+    with ThreadPoolExecutor(max_workers=len(tareas)) as pool:
+        futuros = {nombre: pool.submit(_medir, func) for nombre, func in tareas.items()}
+        salidas = {nombre: futuro.result() for nombre, futuro in futuros.items()}
+
+    resultados = {nombre: salida[0] for nombre, salida in salidas.items()}
+    tiempos = {nombre: salida[1] for nombre, salida in salidas.items()}
+    return resultados, tiempos
+
+
+@st.cache_data(ttl=300)
+def load_all(cam_spec=CAM_TODO, denm_spec=DENM_TODO):
+    """Carga CAM, DENM y la geometría M30 en paralelo, con tiempos por tarea.
+
+    Con `cam_spec=None` no se carga CAM (páginas que leen el tráfico de las
+    tablas resumen) y se devuelve None en su lugar.
+    """
+    engine = get_engine()
+    backend = st.secrets.get("loader_backend", "cursor")
+    # Los recursos cacheados de Streamlit se resuelven en el hilo del script,
+    # no dentro de los hilos del pool
+    store = get_geometry_store()
+
+    tareas = {
+        "denm": lambda: _load_table(engine, denm_spec, backend, normalize_denm, DENM_SCHEMA),
+        "m30": lambda: _read_m30(store),
+    }
+    if cam_spec is not None:
+        tareas["cam"] = lambda: _load_table(engine, cam_spec, backend, normalize_cam, CAM_SCHEMA)
+    resultados, tiempos = _run_concurrently(tareas)
+    return resultados.get("cam"), resultados["denm"], resultados["m30"], tiempos
+
+
+def load_data(cam_spec=CAM_TODO, denm_spec=DENM_TODO):
+    """CAM y DENM normalizados; atajo sobre load_all (misma caché)."""
+    cam, denm, _, _ = load_all(cam_spec, denm_spec)
+    return cam, denm
 
-@st.cache_data
-def load_data():
-    db_url = st.secrets["db_url"]
-    engine = create_engine(db_url)
-
-    df = pd.read_sql("SELECT * FROM cam_ref_message WHERE received_at > '2025-06-11 00:00:00'", engine)
-    df_denm = pd.read_sql("SELECT * FROM denm_ref_message WHERE received_at > '2025-06-11 00:00:00'", engine)
-
-    df["received_at"] = pd.to_datetime(df["received_at"])
-    df["received_at"] = df["received_at"] + pd.Timedelta(hours=1)
-    if "weekday_es" in df.columns:
-        df["weekday_es"] = pd.Categorical(
-            df["weekday_es"],
-            categories=["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"],
-            ordered=True
-        )
-    if "hour" in df.columns and "hour_label" not in df.columns:
-        df["hour_label"] = df["hour"].apply(lambda x: f"{int(x):02d}:00")
-
-    df_denm["received_at"] = pd.to_datetime(df_denm["received_at"])
-    df_denm["received_at"] = df_denm["received_at"] + pd.Timedelta(hours=1)
-    if "weekday_es" in df_denm.columns:
-        df_denm["weekday_es"] = pd.Categorical(
-            df_denm["weekday_es"],
-            categories=["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"],
-            ordered=True
-        )
-    if "hour" in df_denm.columns and "hour_label" not in df_denm.columns:
-        df["hour"] = (df["hour"] + 1) % 24  # Para que no se pase de 23
-        df["hour_label"] = df["hour"].apply(lambda x: f"{int(x):02d}:00")
-
-    return df, df_denm
 
 @st.cache_data
 def load_m30_data():
-    gdf = gpd.read_file("./data/m30_osm_v3.shp")
-    gdf = gdf.to_crs(epsg=4326)
-    return gdf
-
+    return _read_m30(get_geometry_store())
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import shapely
+import streamlit as st
+from pyproj import Transformer
+from utils.geometry_store import CRS_METRICO, get_geometry_store
+
+# Distancia máxima de un punto a su tramo y diferencia de rumbo admitida
+RADIO_BUSQUEDA_M = 30
+TOLERANCIA_RUMBO = 45
+
+# Paso (m) a cada lado de la proyección para medir el rumbo del tramo
+PASO_RUMBO_M = 2
+
+# Valores de `oneway` en el shapefile de OSM
+SENTIDO_DIRECTO = {"yes", "true", "1", "F"}
+SENTIDO_INVERSO = {"-1", "T"}
+
+_A_METRICO = Transformer.from_crs(4326, CRS_METRICO, always_xy=True)
+
+
+class MapMatcher:
+    """Asigna posiciones CAM al tramo de m30_osm_v3 compatible más cercano.
+
+    Los tramos se indexan una vez en un STRtree en EPSG:25830. Cada lote se
+    proyecta de golpe, se consultan en bloque los tramos a menos de
+    RADIO_BUSQUEDA_M y, entre los candidatos, se prefiere el más cercano
+    cuyo rumbo coincide con el heading del vehículo (así se distingue la
+    calzada de cada sentido). Si ningún candidato es compatible se toma el
+    más cercano y se marca `rumbo_ok=False`.
+
+    Es una utilidad de biblioteca: la carga de CAM no la usa, porque
+    `name_osmid` ya llega asignado desde la base de datos.
+    """
+
+    def __init__(self, geometrias, atributos, sentido):
+        self.geometrias = np.asarray(geometrias)
+        self.atributos = atributos.reset_index(drop=True)
+        # +1 sentido de digitalización, -1 sentido contrario, 0 ambos
+        self.sentido = np.asarray(sentido, dtype=np.int8)
+        self.arbol = shapely.STRtree(self.geometrias)
+
+    @staticmethod
+    def _sentido(oneway):
+        oneway = oneway.fillna("").astype(str).str.strip()
+        return np.where(oneway.isin(SENTIDO_DIRECTO), 1, np.where(oneway.isin(SENTIDO_INVERSO), -1, 0))
+
+    @classmethod
+    def from_gdf(cls, gdf):
+        return cls(
+            gdf.to_crs(epsg=CRS_METRICO).geometry.to_numpy(),
+            gdf[["osm_id", "name", "fclass"]],
+            cls._sentido(gdf["oneway"]),
+        )
+
+    @classmethod
+    def from_store(cls, almacen):
+        """Desde el almacén de geometrías, sin reproyectar: usa el WKB en EPSG:25830."""
+        atributos = almacen.atributos
+        return cls(
+            almacen.geometries(CRS_METRICO),
+            atributos[["osm_id", "name", "fclass"]],
+            cls._sentido(atributos["oneway"]),
+        )
+
+    def _rumbo_tramo(self, tramos, puntos):
+        """Rumbo (grados desde el norte, horario) de cada tramo en la proyección del punto."""
+        geometrias = self.geometrias[tramos]
+        posicion = shapely.line_locate_point(geometrias, puntos)
+        antes = shapely.line_interpolate_point(geometrias, np.maximum(posicion - PASO_RUMBO_M, 0))
+        despues = shapely.line_interpolate_point(geometrias, posicion + PASO_RUMBO_M)
+        dx = shapely.get_x(despues) - shapely.get_x(antes)
+        dy = shapely.get_y(despues) - shapely.get_y(antes)
+        return np.degrees(np.arctan2(dx, dy)) % 360
+
+    def match(self, latitudes, longitudes, headings=None):
+        """Tramo asignado a cada punto: índice en m30 (-1 sin tramo), distancia y rumbo_ok."""
+        x, y = _A_METRICO.transform(np.asarray(longitudes, dtype=np.float64), np.asarray(latitudes, dtype=np.float64))
+        puntos = shapely.points(x, y)
+        n = len(puntos)
+        resultado = pd.DataFrame({
+            "tramo": np.full(n, -1, dtype=np.int64),
+            "distancia_m": np.full(n, np.nan),
+            "rumbo_ok": np.zeros(n, dtype=bool),
+        })
+
+        # Consulta en bloque: pares (punto, tramo) a menos del radio
+        i_punto, i_tramo = self.arbol.query(puntos, predicate="dwithin", distance=RADIO_BUSQUEDA_M)
+        if len(i_punto) == 0:
+            return resultado
+        distancia = shapely.distance(puntos[i_punto], self.geometrias[i_tramo])
+
+        if headings is None:
+            compatible = np.ones(len(i_punto), dtype=bool)
+        else:
+            heading = np.asarray(headings, dtype=np.float64)[i_punto]
+            diferencia = np.abs((heading - self._rumbo_tramo(i_tramo, puntos[i_punto]) + 180) % 360 - 180)
+            sentido = self.sentido[i_tramo]
+            # Tramos de doble sentido: vale el rumbo en cualquiera de los dos sentidos
+            diferencia = np.where(sentido == 0, np.minimum(diferencia, 180 - diferencia), diferencia)
+            diferencia = np.where(sentido == -1, 180 - diferencia, diferencia)
+            compatible = np.isnan(heading) | (diferencia <= TOLERANCIA_RUMBO)
+
+        # Por punto: primero los compatibles, después el más cercano
+        orden = np.lexsort((distancia, ~compatible, i_punto))
+        primeros = orden[np.r_[True, np.diff(i_punto[orden]) != 0]]
+        elegidos = i_punto[primeros]
+        resultado.loc[elegidos, "tramo"] = i_tramo[primeros]
+        resultado.loc[elegidos, "distancia_m"] = distancia[primeros]
+        resultado.loc[elegidos, "rumbo_ok"] = compatible[primeros]
+        return resultado
+
+    def match_frame(self, df):
+        """Añade osm_id, name y fclass del tramo asignado a un DataFrame CAM."""
+        headings = df["heading"] if "heading" in df.columns else None
+        asignacion = self.match(df["latitude"], df["longitude"], headings)
+        tramo = asignacion["tramo"].to_numpy()
+        con_tramo = tramo >= 0
+        salida = df.copy()
+        for columna in self.atributos.columns:
+            valores = self.atributos[columna].to_numpy()[np.where(con_tramo, tramo, 0)]
+            salida[columna] = pd.Series(valores, index=df.index).where(con_tramo)
+        salida["distancia_tramo_m"] = asignacion["distancia_m"].to_numpy()
+        salida["rumbo_ok"] = asignacion["rumbo_ok"].to_numpy()
+        return salida
+
+
+@st.cache_resource
+def get_map_matcher():
+    """Índice espacial de la M30, construido una vez por proceso."""
+    return MapMatcher.from_store(get_geometry_store())
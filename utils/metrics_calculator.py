@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from utils.loaders import load_m30_data
+from utils.normalize import hour_labels
+from utils.congestion import detect_congestion
+from utils.geometry_store import segment_lengths_m
+
+# Columnas que necesita el detector de segmentos de congestión
+COLUMNAS_CONGESTION = ["station_id", "generation_time_real", "latitude", "longitude", "speed_kmh", "osm_id"]
+
+# Atributos del shapefile que acompañan a las métricas
+ATRIBUTOS_M30 = ["osm_id", "name", "fclass", "maxspeed", "ref", "lanes"]
+
+# Fecha fija para la animación temporal de Kepler
+FECHA_KEPLER = "2025-06-19"
+
+
+def _codigos_osm(df_cam, m30):
+    """Código entero de cada fila CAM: posición de su osm_id en m30 (-1 si no está)."""
+    return pd.Index(m30["osm_id"].astype(str)).get_indexer(df_cam["osm_id"].astype(str))
+
+
+def _por_vehiculo(df_cam, codigos, claves_extra=()):
+    """Paso 1: medias por vehículo y tramo (y claves extra), con códigos enteros."""
+    df = df_cam.assign(osm_code=codigos)
+    df = df[df["osm_code"] >= 0]
+    agregados = {
+        "speed_kmh": ("speed_kmh", "mean"),
+        "longitudinal_acc": ("longitudinal_acc", "mean"),
+        "lateral_acc": ("lateral_acc", "mean"),
+    }
+    if "received_at" in df.columns:
+        agregados["fecha"] = ("received_at", "first")
+    return (
+        df.groupby(["osm_code", *claves_extra, "station_id"], observed=True, sort=False)
+        .agg(**agregados)
+        .reset_index()
+    )
+
+
+def _estadisticas(por_vehiculo, claves):
+    """Paso 2: estadísticas por tramo sobre las medias de cada vehículo."""
+    grupo = por_vehiculo.groupby(claves, observed=True)
+    metricas = grupo.agg(
+        conteo_vehiculos=("station_id", "size"),
+        speed_mean=("speed_kmh", "mean"),
+        speed_max=("speed_kmh", "max"),
+        speed_min=("speed_kmh", "min"),
+        speed_std=("speed_kmh", "std"),
+        long_acc_mean=("longitudinal_acc", "mean"),
+        long_acc_max=("longitudinal_acc", "max"),
+        long_acc_min=("longitudinal_acc", "min"),
+        lat_acc_mean=("lateral_acc", "mean"),
+        lat_acc_max=("lateral_acc", "max"),
+    )
+    cuartiles = grupo["speed_kmh"].quantile([0.25, 0.75]).unstack()
+    metricas["speed_q25"] = cuartiles[0.25]
+    metricas["speed_q75"] = cuartiles[0.75]
+    return metricas
+
+
+def _unir_m30(metricas, m30, columnas):
+    """Añade atributos y geometría de m30 por código entero (posición)."""
+    codigos = metricas["osm_code"].to_numpy()
+    for columna in columnas:
+        metricas[columna] = m30[columna].to_numpy()[codigos]
+    return gpd.GeoDataFrame(
+        metricas.drop(columns="osm_code"),
+        geometry=m30.geometry.to_numpy()[codigos],
+        crs=m30.crs,
+    )
+
+
+def _redondear(df):
+    # float32 se pasa a float64 antes de redondear: redondeado en float32,
+    # 70.16 se exporta como 70.16000366
+    df = df.astype({c: "float64" for c in df.select_dtypes("float32").columns})
+    columnas = df.select_dtypes("number").columns
+    df[columnas] = df[columnas].round(2)
+    return df
+
+
+def calculate_metrics_osmid(df_cam, m30=None):
+    """Métricas por tramo (osm_id) para el mapa de niveles de servicio.
+
+    Estadísticas de velocidad y aceleración, exceso sobre la velocidad
+    máxima, porcentaje de vehículos con algún segmento de congestión en el
+    tramo, densidad (vehículos/km) y hora pico. Todo con agregaciones con
+    nombre sobre códigos enteros.
+    """
+    m30 = load_m30_data() if m30 is None else m30
+    codigos = _codigos_osm(df_cam, m30)
+    por_vehiculo = _por_vehiculo(df_cam, codigos)
+    if set(COLUMNAS_CONGESTION) <= set(df_cam.columns):
+        # Definición del README: más de 100 m por debajo de 20 km/h dentro del tramo
+        segmentos = detect_congestion(df_cam[COLUMNAS_CONGESTION])
+        congestionados = pd.MultiIndex.from_arrays([
+            _codigos_osm(segmentos, m30), segmentos["station_id"].to_numpy(dtype=np.int64)
+        ])
+        por_vehiculo["congestionado"] = pd.MultiIndex.from_arrays([
+            por_vehiculo["osm_code"].to_numpy(), por_vehiculo["station_id"].to_numpy(dtype=np.int64)
+        ]).isin(congestionados)
+
+    metricas = _estadisticas(por_vehiculo, "osm_code")
+    if "congestionado" in por_vehiculo.columns:
+        metricas["porcentaje_congestion"] = (
+            por_vehiculo.groupby("osm_code")["congestionado"].mean() * 100
+        )
+    else:
+        # Sin posiciones ni tiempos no se puede aplicar la definición: no disponible
+        metricas["porcentaje_congestion"] = np.nan
+
+    # Hora pico: hora con más vehículos distintos en el tramo
+    con_tramo = codigos >= 0
+    horas = (
+        pd.DataFrame({
+            "osm_code": codigos[con_tramo],
+            "hour": df_cam["hour"].to_numpy()[con_tramo],
+            "station_id": df_cam["station_id"].to_numpy()[con_tramo],
+        })
+        .drop_duplicates()
+        .groupby(["osm_code", "hour"]).size()
+        .rename("vehiculos").reset_index()
+        .sort_values(["osm_code", "vehiculos"], ascending=[True, False])
+        .drop_duplicates("osm_code")
+        .set_index("osm_code")
+    )
+    metricas["hora_pico"] = hour_labels(horas["hour"].reindex(metricas.index)).astype(str)
+    metricas = metricas.reset_index()
+
+    # Atributos del tramo: velocidad máxima y longitud en metros (EPSG:25830)
+    codigos_tramo = metricas["osm_code"].to_numpy()
+    maxspeed = pd.to_numeric(m30["maxspeed"], errors="coerce").to_numpy(dtype=np.float64)[codigos_tramo]
+    longitud_km = segment_lengths_m(m30)[codigos_tramo] / 1000
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Sin velocidad máxima el exceso no está definido (NaN, no 0 %)
+        metricas["exceso_velocidad_pct"] = np.where(
+            maxspeed > 0, (metricas["speed_mean"] - maxspeed) / maxspeed, np.nan
+        )
+        metricas["densidad_veh_km"] = np.where(
+            longitud_km > 0, metricas["conteo_vehiculos"] / longitud_km, np.nan
+        )
+
+    gdf = _unir_m30(metricas, m30, ["osm_id", "name", "fclass"])
+    gdf["maxspeed"] = maxspeed
+    return _redondear(gdf)
+
+
+def clasificar_velocidad(velocidades):
+    """Rango de velocidad de una serie, vectorizado."""
+    return pd.cut(
+        velocidades,
+        bins=[-np.inf, 30, 50, 70, np.inf],
+        labels=["0–30 km/h", "30–50 km/h", "50–70 km/h", "70-90+ km/h"],
+    )
+
+
+def calculate_velocity_metrics(df_cam, m30=None):
+    """Métricas de velocidad por tramo, hora y día de la semana (capa temporal)."""
+    m30 = load_m30_data() if m30 is None else m30
+    codigos = _codigos_osm(df_cam, m30)
+    por_vehiculo = _por_vehiculo(df_cam, codigos, claves_extra=("hour", "weekday_es"))
+
+    metricas = _estadisticas(por_vehiculo, ["osm_code", "hour", "weekday_es"])
+    if "fecha" in por_vehiculo.columns:
+        metricas["fecha"] = por_vehiculo.groupby(["osm_code", "hour", "weekday_es"], observed=True)["fecha"].first()
+    metricas = metricas.reset_index()
+
+    metricas["hour_label"] = hour_labels(metricas["hour"])
+    metricas["fecha_kepler"] = pd.to_datetime(FECHA_KEPLER) + pd.to_timedelta(metricas["hour"].astype(int), unit="h")
+    metricas["velocidad_rango"] = clasificar_velocidad(metricas["speed_mean"])
+
+    gdf = _unir_m30(metricas, m30, ATRIBUTOS_M30)
+    return _redondear(gdf)
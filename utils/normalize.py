@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+ZONA_HORARIA = "Europe/Madrid"
+
+ORDEN_DIAS = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+HOUR_CATEGORIES = [f"{h:02d}:00" for h in range(24)]
+
+
+def to_local_time(serie):
+    """Pasa received_at (UTC) a hora local de Madrid, sin zona, respetando el horario de verano."""
+    serie = pd.to_datetime(serie)
+    if serie.dt.tz is None:
+        serie = serie.dt.tz_localize("UTC")
+    return serie.dt.tz_convert(ZONA_HORARIA).dt.tz_localize(None)
+
+
+def weekday_categorical(serie):
+    """weekday_es como categórica ordenada de lunes a domingo."""
+    if isinstance(serie.dtype, pd.CategoricalDtype) and list(serie.cat.categories) == ORDEN_DIAS:
+        return serie
+    return pd.Categorical(serie, categories=ORDEN_DIAS, ordered=True)
+
+
+def hour_labels(horas):
+    """Etiquetas "HH:00" categóricas construidas desde los códigos enteros de la hora."""
+    codigos = pd.Series(horas).fillna(-1).to_numpy().astype(np.int8)
+    return pd.Categorical.from_codes(codigos, categories=HOUR_CATEGORIES, ordered=True)
+
+
+def _normalize(df):
+    """Normalización común de CAM y DENM, vectorizada y sobre el propio DataFrame.
+
+    `weekday_es` y `hour` se recalculan desde received_at en hora local, de
+    modo que CAM, DENM y las tablas resumen comparten las mismas claves.
+    """
+    df["received_at"] = to_local_time(df["received_at"])
+    if "weekday_es" in df.columns:
+        dias = np.asarray(ORDEN_DIAS)[df["received_at"].dt.dayofweek.to_numpy()]
+        df["weekday_es"] = weekday_categorical(dias)
+    if "hour" in df.columns:
+        df["hour"] = df["received_at"].dt.hour.astype(np.int8)
+        df["hour_label"] = hour_labels(df["hour"])
+    return df
+
+
+def normalize_cam(df):
+    """Normaliza un DataFrame de cam_ref_message."""
+    return _normalize(df)
+
+
+def normalize_denm(df):
+    """Normaliza un DataFrame de denm_ref_message."""
+    return _normalize(df)
+
+
+def add_hora_label(df):
+    """Añade hora_label (hora local de received_at) como categórica."""
+    df["hora_label"] = hour_labels(df["received_at"].dt.hour)
+    return df
@@ -0,0 +1,140 @@
+import os
+import re
+import tempfile
+import threading
+from contextlib import contextmanager, suppress
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Raíz de la caché local: un directorio por almacén y un fichero por día
+CACHE_DIR = "./data/cache"
+
+_PATRON_PARTICION = re.compile(r"^day=(\d{4}-\d{2}-\d{2})\.parquet$")
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se serializan los hilos del proceso
+    fcntl = None
+
+_LOCKS = {}
+_LOCKS_GUARD = threading.Lock()
+_TENIDOS = threading.local()
+
+
+@contextmanager
+def store_lock(nombre):
+    """Bloqueo exclusivo de un almacén entre hilos (RLock) y procesos (flock).
+
+    Es reentrante en el mismo hilo: load_incremental lo toma y
+    write_partitions puede volver a pedirlo sin bloquearse.
+    """
+    with _LOCKS_GUARD:
+        lock = _LOCKS.setdefault(nombre, threading.RLock())
+    with lock:
+        tenidos = getattr(_TENIDOS, "nombres", None)
+        if tenidos is None:
+            tenidos = _TENIDOS.nombres = set()
+        if nombre in tenidos:
+            yield
+            return
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(os.path.join(CACHE_DIR, f"{nombre}.lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            tenidos.add(nombre)
+            try:
+                yield
+            finally:
+                tenidos.discard(nombre)
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def temp_path(ruta):
+    """Fichero temporal único junto a `ruta`, para escribir y luego hacer os.replace."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(ruta) or ".", prefix=os.path.basename(ruta) + ".", suffix=".tmp")
+    os.close(fd)
+    return tmp
+
+
+def store_dir(nombre):
+    """Directorio de particiones de un almacén."""
+    return os.path.join(CACHE_DIR, nombre)
+
+
+def partition_path(nombre, dia):
+    """Ruta del fichero Parquet de un día."""
+    return os.path.join(store_dir(nombre), f"day={pd.Timestamp(dia):%Y-%m-%d}.parquet")
+
+
+def list_partitions(nombre, desde=None, hasta=None):
+    """Días con partición en disco, opcionalmente limitados a [desde, hasta]."""
+    directorio = store_dir(nombre)
+    if not os.path.isdir(directorio):
+        return []
+    desde = None if desde is None else pd.Timestamp(desde).normalize().tz_localize(None)
+    hasta = None if hasta is None else pd.Timestamp(hasta).normalize().tz_localize(None)
+
+    dias = []
+    for fichero in os.listdir(directorio):
+        m = _PATRON_PARTICION.match(fichero)
+        if not m:
+            continue
+        dia = pd.Timestamp(m.group(1))
+        if (desde is None or dia >= desde) and (hasta is None or dia <= hasta):
+            dias.append(dia)
+    return sorted(dias)
+
+
+def _dia_particion(df):
+    """Día (de received_at) al que pertenece cada fila."""
+    recibido = pd.to_datetime(df["received_at"])
+    if recibido.dt.tz is not None:
+        recibido = recibido.dt.tz_localize(None)
+    return recibido.dt.normalize()
+
+
+def write_partitions(nombre, df, clave):
+    """Fusiona `df` con las particiones diarias existentes, deduplicando por `clave`.
+
+    La lectura-fusión-escritura de cada partición se hace bajo store_lock, así
+    que dos sesiones que escriben el mismo día no se pisan las filas.
+    """
+    if df.empty:
+        return []
+    os.makedirs(store_dir(nombre), exist_ok=True)
+
+    dias = []
+    with store_lock(nombre):
+        for dia, df_dia in df.groupby(_dia_particion(df), sort=False):
+            ruta = partition_path(nombre, dia)
+            if os.path.exists(ruta):
+                df_dia = pd.concat([pd.read_parquet(ruta), df_dia], ignore_index=True)
+            # Las filas repetidas (solape) se quedan con la versión más reciente
+            df_dia = df_dia.drop_duplicates(subset=clave, keep="last")
+            tmp = temp_path(ruta)
+            df_dia.to_parquet(tmp, index=False)
+            os.replace(tmp, ruta)
+            dias.append(dia)
+    return dias
+
+
+def read_partitions(nombre, desde=None, hasta=None, columnas=None):
+    """Lee con memory-map solo las particiones del rango pedido."""
+    tablas = [
+        pq.read_table(partition_path(nombre, dia), columns=columnas, memory_map=True)
+        for dia in list_partitions(nombre, desde, hasta)
+    ]
+    if not tablas:
+        return None
+    return pa.concat_tables(tablas, promote_options="default").to_pandas()
+
+
+def drop_partitions_before(nombre, dia):
+    """Borra las particiones anteriores a `dia` (fuera de la ventana)."""
+    limite = pd.Timestamp(dia).normalize().tz_localize(None)
+    with store_lock(nombre):
+        for d in list_partitions(nombre, hasta=limite - pd.Timedelta(days=1)):
+            with suppress(FileNotFoundError):
+                os.remove(partition_path(nombre, d))
@@ -0,0 +1,67 @@
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Optional
+import pandas as pd
+from sqlalchemy import text
+
+# Fecha desde la que se cargan datos cuando una consulta no fija ventana; se
+# puede cambiar sin tocar el código con la variable de entorno FECHA_INICIO
+FECHA_INICIO = pd.Timestamp(os.environ.get("FECHA_INICIO", "2025-06-11 00:00:00"))
+
+
+@dataclass(frozen=True)
+class QuerySpec:
+    """Columnas y ventana temporal que una página necesita de una tabla."""
+    tabla: str
+    columnas: tuple = ()  # vacío = todas las columnas
+    dias: Optional[int] = None  # None = todo el histórico desde `desde`
+    clave: str = "message_id"
+    desde: Optional[pd.Timestamp] = None  # inicio del histórico; None = FECHA_INICIO
+
+    def columnas_sql(self):
+        """Columnas a seleccionar; siempre incluye received_at y la clave."""
+        if not self.columnas:
+            return "*"
+        extra = [c for c in ("received_at", self.clave) if c not in self.columnas]
+        return ", ".join(list(self.columnas) + extra)
+
+    def inicio_ventana(self):
+        """Primer received_at (sin desplazar) que entra en la ventana."""
+        if self.dias is None:
+            return FECHA_INICIO if self.desde is None else pd.Timestamp(self.desde)
+        # received_at está en UTC y las páginas filtran en hora de Madrid (UTC+1/+2)
+        return pd.Timestamp.today().normalize() - pd.Timedelta(days=self.dias, hours=2)
+
+    def store_key(self):
+        """Nombre del almacén local; consultas con distintas columnas o inicio no lo comparten.
+
+        El almacén se recorta al inicio de su ventana, así que una consulta
+        con un `desde` propio no puede compartirlo con las que empiezan
+        después: lleva el sufijo `_desde<AAAAMMDD>` tras el nombre del almacén
+        sin `desde` (ver incremental.MAX_ALMACENES_DESDE).
+        """
+        nombre = self.tabla
+        if self.columnas:
+            firma = hashlib.md5(self.columnas_sql().encode("utf-8")).hexdigest()[:8]
+            nombre = f"{nombre}_{firma}"
+        if self.desde is not None:
+            nombre = f"{nombre}_desde{pd.Timestamp(self.desde):%Y%m%d}"
+        return nombre
+
+
+def build_query(spec, desde=None, ultimo_id=None):
+    """Construye el SELECT con proyección de columnas y filtro sobre received_at.
+
+    Sin `desde` se pide la ventana completa de `spec`; con `desde`/`ultimo_id`
+    solo las filas posteriores a la marca de agua dentro de esa ventana.
+    """
+    sql = f"SELECT {spec.columnas_sql()} FROM {spec.tabla} WHERE received_at > :inicio"
+    params = {"inicio": spec.inicio_ventana().to_pydatetime()}
+
+    if desde is not None:
+        sql += f" AND (received_at > :desde OR {spec.clave} > :ultimo_id)"
+        params["desde"] = pd.Timestamp(desde).to_pydatetime()
+        params["ultimo_id"] = -1 if ultimo_id is None else int(ultimo_id)
+
+    return text(sql), params
@@ -0,0 +1,263 @@
+import pandas as pd
+from sqlalchemy import text
+from utils.db import set_statement_timeout
+from utils.normalize import ZONA_HORARIA, ORDEN_DIAS, weekday_categorical, hour_labels
+
+# Tablas resumen por hora local: global por día y por tramo (name_osmid).
+# El sufijo cambia si cambia la definición de las claves (las de hora UTC no se reutilizan)
+ROLLUP_DIA = "cam_rollup_dia_hora_local"
+ROLLUP_TRAMO = "cam_rollup_tramo_hora_local"
+# Histograma de velocidad por hora local: estado de los percentiles del histórico
+ROLLUP_VELOCIDAD = "cam_rollup_velocidad_hora_local"
+
+# Ancho (km/h) de los bins del histograma y último bin (velocidades mayores)
+ANCHO_BIN_KMH = 1
+MAX_BIN = 250
+
+# Día, hora y día de la semana desde received_at (timestamptz) en hora de Madrid
+_LOCAL = f"(received_at AT TIME ZONE '{ZONA_HORARIA}')"
+_DIAS_SQL = "ARRAY[" + ", ".join(f"'{d}'" for d in ORDEN_DIAS) + "]"
+_CLAVES_LOCALES = f"""
+    {_LOCAL}::date AS day,
+    EXTRACT(HOUR FROM {_LOCAL})::smallint AS hour
+"""
+_DIA_SEMANA = f"({_DIAS_SQL})[EXTRACT(ISODOW FROM {_LOCAL})::int]"
+
+# La primera construcción recorre todo el histórico: se le da más margen
+REFRESH_TIMEOUT_MS = 600_000
+
+# Días que se recalculan hacia atrás en cada refresco (llegadas tardías)
+DIAS_SOLAPE = 1
+
+_DDL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {ROLLUP_DIA} (
+        day date NOT NULL,
+        hour smallint NOT NULL,
+        weekday_es text,
+        n_mensajes bigint,
+        speed_sum double precision,
+        speed_n bigint,
+        braking_sum double precision,
+        braking_n bigint,
+        station_ids bigint[],
+        PRIMARY KEY (day, hour)
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {ROLLUP_TRAMO} (
+        day date NOT NULL,
+        hour smallint NOT NULL,
+        name_osmid text NOT NULL,
+        weekday_es text,
+        n_mensajes bigint,
+        speed_sum double precision,
+        speed_n bigint,
+        braking_sum double precision,
+        braking_n bigint,
+        station_ids bigint[],
+        PRIMARY KEY (day, hour, name_osmid)
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {ROLLUP_VELOCIDAD} (
+        day date NOT NULL,
+        hour smallint NOT NULL,
+        weekday_es text,
+        bin smallint NOT NULL,
+        n bigint,
+        PRIMARY KEY (day, hour, bin)
+    )
+    """,
+    # station_id es un entero sin signo de 32 bits (ETSI): las tablas creadas
+    # con integer[] fallan con ids >= 2^31 y se migran una vez a bigint[]
+    *(
+        f"""
+        DO $$ BEGIN
+            IF EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_name = '{tabla}' AND column_name = 'station_ids'
+                       AND udt_name = '_int4') THEN
+                ALTER TABLE {tabla} ALTER COLUMN station_ids TYPE bigint[];
+            END IF;
+        END $$
+        """
+        for tabla in (ROLLUP_DIA, ROLLUP_TRAMO)
+    ),
+]
+
+# Medidas comunes: conteos, sumas de velocidad y de frenada, vehículos distintos
+_MEDIDAS = """
+    COUNT(*),
+    SUM(speed_kmh),
+    COUNT(speed_kmh),
+    SUM(-longitudinal_acc) FILTER (WHERE longitudinal_acc < 0),
+    COUNT(*) FILTER (WHERE longitudinal_acc < 0),
+    array_agg(DISTINCT station_id)
+"""
+
+
+# Límite sobre received_at: medianoche local de :desde
+_FILTRO = "received_at >= (CAST(:desde AS timestamp) AT TIME ZONE :zona)"
+_BIN = f"LEAST(FLOOR(speed_kmh / {ANCHO_BIN_KMH})::int, {MAX_BIN})"
+
+# SELECT que rellena cada tabla resumen desde cam_ref_message
+_CONSULTAS = {
+    ROLLUP_DIA: f"""
+        SELECT {_CLAVES_LOCALES}, MIN({_DIA_SEMANA}), {_MEDIDAS}
+        FROM cam_ref_message
+        WHERE {_FILTRO}
+        GROUP BY 1, 2
+    """,
+    ROLLUP_TRAMO: f"""
+        SELECT {_CLAVES_LOCALES}, name_osmid, MIN({_DIA_SEMANA}), {_MEDIDAS}
+        FROM cam_ref_message
+        WHERE {_FILTRO} AND name_osmid IS NOT NULL
+        GROUP BY 1, 2, name_osmid
+    """,
+    ROLLUP_VELOCIDAD: f"""
+        SELECT {_CLAVES_LOCALES}, MIN({_DIA_SEMANA}), {_BIN}, COUNT(*)
+        FROM cam_ref_message
+        WHERE {_FILTRO} AND speed_kmh >= 0
+        GROUP BY 1, 2, 4
+    """,
+}
+
+
+def refresh_rollups(engine):
+    """Recalcula las tablas resumen desde el último día cargado.
+
+    En cada tabla solo se reconstruyen los días a partir del último presente
+    menos DIAS_SOLAPE, así que el coste depende del tráfico nuevo; una tabla
+    vacía (recién creada) se construye desde el primer día del histórico.
+    Todo ocurre en una transacción con un advisory lock: dos sesiones que
+    refrescan a la vez se ejecutan una tras otra en lugar de borrar o
+    duplicar filas.
+    """
+    with engine.begin() as conn:
+        set_statement_timeout(conn, REFRESH_TIMEOUT_MS)
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:nombre))"), {"nombre": ROLLUP_DIA})
+        for ddl in _DDL:
+            conn.execute(text(ddl))
+
+        primero = None
+        for tabla, consulta in _CONSULTAS.items():
+            ultimo = conn.execute(text(f"SELECT MAX(day) FROM {tabla}")).scalar()
+            if ultimo is None:
+                if primero is None:
+                    primero = conn.execute(text(f"SELECT MIN({_LOCAL})::date FROM cam_ref_message")).scalar()
+                    if primero is None:
+                        return
+                desde = primero
+            else:
+                desde = pd.Timestamp(ultimo) - pd.Timedelta(days=DIAS_SOLAPE)
+            params = {"desde": pd.Timestamp(desde).date(), "zona": ZONA_HORARIA}
+
+            conn.execute(text(f"DELETE FROM {tabla} WHERE day >= :desde"), params)
+            conn.execute(text(f"INSERT INTO {tabla} {consulta}"), params)
+
+
+def _etiquetar(df):
+    """Añade weekday_es y hour_label como categóricas ordenadas."""
+    df["weekday_es"] = weekday_categorical(df["weekday_es"])
+    if "hour" in df.columns:
+        df["hour_label"] = hour_labels(df["hour"])
+    return df
+
+
+def read_conteo_dias(engine):
+    """Número de días distintos registrados para cada día de la semana."""
+    df = pd.read_sql(text(f"""
+        SELECT weekday_es, COUNT(DISTINCT day) AS "n_días"
+        FROM {ROLLUP_DIA}
+        GROUP BY weekday_es
+    """), engine)
+    return _etiquetar(df).sort_values("weekday_es").reset_index(drop=True)
+
+
+def read_tramos(engine):
+    """Tramos (name_osmid) con datos en la tabla resumen por tramo, ordenados."""
+    df = pd.read_sql(text(f"SELECT DISTINCT name_osmid FROM {ROLLUP_TRAMO} ORDER BY name_osmid"), engine)
+    return df["name_osmid"].tolist()
+
+
+def read_vehiculos_dia_hora(engine):
+    """Vehículos únicos por (día de la semana, hora) sobre todo el histórico."""
+    df = pd.read_sql(text(f"""
+        SELECT weekday_es, hour, COUNT(DISTINCT sid) AS "vehículos"
+        FROM {ROLLUP_DIA}, unnest(station_ids) AS sid
+        GROUP BY weekday_es, hour
+    """), engine)
+    return _etiquetar(df)
+
+
+def read_vehiculos_dia(engine):
+    """Vehículos únicos por día de la semana sobre todo el histórico."""
+    df = pd.read_sql(text(f"""
+        SELECT weekday_es, COUNT(DISTINCT sid) AS "vehículos"
+        FROM {ROLLUP_DIA}, unnest(station_ids) AS sid
+        GROUP BY weekday_es
+    """), engine)
+    return _etiquetar(df).sort_values("weekday_es").reset_index(drop=True)
+
+
+def _cuantiles_histograma(df, claves, cuantiles):
+    """Cuantiles por grupo desde un histograma (claves, bin, n), interpolando dentro del bin."""
+    df = df.sort_values([*claves, "bin"]).reset_index(drop=True)
+    grupos = df.groupby(claves, observed=True, sort=False)["n"]
+    acumulado = grupos.cumsum()
+    total = grupos.transform("sum")
+
+    salida = df[claves].drop_duplicates().reset_index(drop=True)
+    for q in cuantiles:
+        objetivo = q * total
+        # Primer bin de cada grupo cuyo acumulado alcanza el rango buscado
+        filas = df[acumulado >= objetivo].groupby(claves, observed=True, sort=False).head(1)
+        previo = acumulado[filas.index] - filas["n"]
+        valor = (filas["bin"] + (objetivo[filas.index] - previo) / filas["n"]) * ANCHO_BIN_KMH
+        salida = salida.merge(
+            filas[claves].assign(**{f"q{round(q * 100)}": valor.to_numpy()}), on=claves, how="left"
+        )
+    return salida
+
+
+def read_percentiles_velocidad(engine, cuantiles=(0.25, 0.75)):
+    """Percentiles de velocidad por (día de la semana, hora) sobre todo el histórico.
+
+    Se calculan desde el histograma de la tabla resumen (bins de
+    ANCHO_BIN_KMH, error menor que un bin), sin leer las filas CAM.
+    """
+    df = pd.read_sql(text(f"""
+        SELECT weekday_es, hour, bin, SUM(n) AS n
+        FROM {ROLLUP_VELOCIDAD}
+        GROUP BY weekday_es, hour, bin
+    """), engine)
+    df = _cuantiles_histograma(df, ["weekday_es", "hour"], cuantiles)
+    return _etiquetar(df).sort_values(["weekday_es", "hour"]).reset_index(drop=True)
+
+
+def read_informe_dia(engine, tramo=None):
+    """Vehículos únicos, velocidad media y frenada media por (día de la semana, hora).
+
+    Con `tramo` se lee la tabla por name_osmid filtrada a ese tramo.
+    """
+    tabla, filtro, params = ROLLUP_DIA, "", {}
+    if tramo is not None:
+        tabla, filtro, params = ROLLUP_TRAMO, "WHERE name_osmid = :tramo", {"tramo": tramo}
+
+    df_medias = pd.read_sql(text(f"""
+        SELECT weekday_es, hour,
+               SUM(speed_sum) / NULLIF(SUM(speed_n), 0) AS velocidad_media,
+               SUM(braking_sum) / NULLIF(SUM(braking_n), 0) AS braking_intensity
+        FROM {tabla}
+        {filtro}
+        GROUP BY weekday_es, hour
+    """), engine, params=params)
+    df_vehiculos = pd.read_sql(text(f"""
+        SELECT weekday_es, hour, COUNT(DISTINCT sid) AS "vehículos"
+        FROM {tabla}, unnest(station_ids) AS sid
+        {filtro}
+        GROUP BY weekday_es, hour
+    """), engine, params=params)
+
+    df = df_medias.merge(df_vehiculos, on=["weekday_es", "hour"], how="left")
+    return _etiquetar(df).sort_values(["weekday_es", "hour"]).reset_index(drop=True)
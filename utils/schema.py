@@ -0,0 +1,78 @@
+import pandas as pd
+from utils.normalize import ORDEN_DIAS, HOUR_CATEGORIES
+
+# Tipo de las columnas de texto que no se declaran como categóricas
+TEXTO = "string[pyarrow]"
+
+DIA_SEMANA = pd.CategoricalDtype(ORDEN_DIAS, ordered=True)
+HORA = pd.CategoricalDtype(HOUR_CATEGORIES, ordered=True)
+
+# Esquema compacto de cam_ref_message; las columnas ausentes se ignoran
+CAM_SCHEMA = {
+    "message_id": "int64",
+    "station_id": "uint32",
+    "latitude": "float64",
+    "longitude": "float64",
+    "altitude": "float32",
+    "heading": "float32",
+    "speed_kmh": "float32",
+    "longitudinal_acc": "float32",
+    "lateral_acc": "float32",
+    "hour": "int8",
+    "weekday_es": DIA_SEMANA,
+    "hour_label": HORA,
+    "fclass": "category",
+    "name_osmid": "category",
+    "osm_id": "category",
+    "tipo_dia": "category",
+}
+
+# Esquema compacto de denm_ref_message
+DENM_SCHEMA = {
+    "id": "int64",
+    "message_id": "int64",
+    "station_id": "uint32",
+    "latitude": "float64",
+    "longitude": "float64",
+    "cause_code": "int16",
+    "subcause_code": "int16",
+    "cause_desc": "category",
+    "subcause_desc": "category",
+    "event_type": "category",
+    "hour": "int8",
+    "weekday_es": DIA_SEMANA,
+    "hour_label": HORA,
+}
+
+# Vista por nombre de columna para tipar bloques sin saber de qué tabla vienen
+COLUMN_TYPES = {**CAM_SCHEMA, **DENM_SCHEMA}
+
+_NULABLES = {"int8": "Int8", "int16": "Int16", "int32": "Int32", "int64": "Int64", "uint32": "UInt32"}
+
+
+def apply_schema(df, schema=COLUMN_TYPES):
+    """Aplica los tipos declarados a las columnas presentes, sin inspeccionar valores.
+
+    Los enteros con nulos pasan a su tipo nullable y el resto de columnas de
+    texto a cadenas respaldadas por Arrow.
+    """
+    for col in df.columns:
+        tipo = schema.get(col)
+        if tipo is None:
+            if df[col].dtype == object:
+                df[col] = df[col].astype(TEXTO)
+            continue
+        if tipo in _NULABLES and df[col].isna().any():
+            tipo = _NULABLES[tipo]
+        if df[col].dtype != tipo:
+            df[col] = df[col].astype(tipo)
+    return df
+
+
+def memory_report(df):
+    """Memoria por columna (MB) y tipo, ordenada de mayor a menor."""
+    memoria = df.memory_usage(deep=True, index=False) / 1024**2
+    return (
+        pd.DataFrame({"tipo": df.dtypes.astype(str), "MB": memoria.round(2)})
+        .sort_values("MB", ascending=False)
+    )
@@ -0,0 +1,105 @@
+import os
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+from utils.assets import ASSETS_DIR, source_metadata, write_table, read_table
+
+# Columnas que usa la capa de velocidades de Kepler (data/config/velocidades_tramos.json)
+COLUMNAS_KEPLER_VELOCIDADES = ["osm_id", "hour", "weekday_es", "conteo_vehiculos", "speed_mean", "fecha_kepler"]
+
+
+def _compactar(df):
+    """Texto repetido a category y horas a int8."""
+    for columna in df.columns.drop("geometry", errors="ignore"):
+        if df[columna].dtype == object or pd.api.types.is_string_dtype(df[columna]):
+            df[columna] = df[columna].astype("category")
+    if "hour" in df.columns:
+        df["hour"] = df["hour"].astype(np.int8)
+    return df
+
+
+class SegmentTable:
+    """Métricas por tramo con la geometría normalizada: una sola por tramo.
+
+    `geometrias` tiene una fila por tramo (código entero = posición) con su
+    geometría y los atributos que no varían dentro del tramo; `atributos`
+    tiene una fila por medida con la columna `codigo` en lugar de la
+    geometría. La geometría solo se une al pintar, con un take posicional.
+    """
+
+    def __init__(self, geometrias, atributos, clave="osm_id", crs="EPSG:4326"):
+        self.geometrias = geometrias
+        self.atributos = atributos
+        self.clave = clave
+        self.crs = crs
+
+    @classmethod
+    def from_gdf(cls, gdf, clave="osm_id"):
+        """Separa un GeoDataFrame con la geometría repetida por fila."""
+        codigos, tramos = pd.factorize(gdf[clave].astype(str))
+        primeras = np.unique(codigos, return_index=True)[1]
+        atributos = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+
+        # Atributos constantes dentro de cada tramo pasan a la tabla de geometrías
+        distintos = atributos.assign(codigo=codigos).groupby("codigo").nunique(dropna=False).max()
+        por_tramo = [c for c in distintos.index[distintos <= 1] if c != clave]
+        geometrias = pd.DataFrame({clave: tramos})
+        for columna in por_tramo:
+            geometrias[columna] = atributos[columna].to_numpy()[primeras]
+        geometrias["geometry"] = gdf.geometry.to_numpy()[primeras]
+
+        atributos = atributos.drop(columns=[clave, *por_tramo])
+        atributos.insert(0, "codigo", codigos.astype(np.int32))
+        return cls(_compactar(geometrias), _compactar(atributos), clave, gdf.crs)
+
+    def join(self, columnas=None, filas=None):
+        """GeoDataFrame listo para pintar: atributos (filtrados) con la geometría de su tramo.
+
+        `columnas` limita lo que se envía al navegador; `filas` es una máscara
+        o índice sobre `atributos`.
+        """
+        atributos = self.atributos if filas is None else self.atributos[filas]
+        codigos = atributos["codigo"].to_numpy()
+        salida = pd.DataFrame(index=atributos.index)
+        for columna in columnas or [self.clave, *self.geometrias.columns.drop(["geometry", self.clave]),
+                                    *atributos.columns.drop("codigo")]:
+            if columna in atributos.columns:
+                salida[columna] = atributos[columna]
+            else:
+                salida[columna] = self.geometrias[columna].to_numpy()[codigos]
+        return gpd.GeoDataFrame(
+            salida.reset_index(drop=True),
+            geometry=self.geometrias["geometry"].to_numpy()[codigos],
+            crs=self.crs,
+        )
+
+
+def _rutas(nombre):
+    return (os.path.join(ASSETS_DIR, f"{nombre}_geometrias.feather"),
+            os.path.join(ASSETS_DIR, f"{nombre}_atributos.feather"))
+
+
+def load_segment_table(ruta_geojson, clave="osm_id"):
+    """SegmentTable de un GeoJSON, compilado a dos ficheros Feather en ASSETS_DIR.
+
+    El GeoJSON solo se lee si los ficheros compilados faltan o son más
+    antiguos que él (sin GeoJSON se usan los compilados tal cual); la
+    geometría se guarda como WKB una vez por tramo.
+    """
+    nombre = os.path.splitext(os.path.basename(ruta_geojson))[0]
+    ruta_geom, ruta_attr = _rutas(nombre)
+    metadatos = source_metadata(ruta_geojson, clave=clave)
+
+    geometrias, atributos = read_table(ruta_geom, metadatos), read_table(ruta_attr, metadatos)
+    if geometrias is None or atributos is None:
+        tabla = SegmentTable.from_gdf(gpd.read_file(ruta_geojson), clave)
+        geom = tabla.geometrias.assign(geometry=shapely.to_wkb(tabla.geometrias["geometry"].to_numpy()))
+        write_table(geom, ruta_geom, {**metadatos, "crs": tabla.crs.to_string()})
+        write_table(tabla.atributos, ruta_attr, metadatos)
+        return tabla
+
+    crs = geometrias.schema.metadata[b"crs"].decode()
+    geometrias = geometrias.to_pandas()
+    geometrias["geometry"] = shapely.from_wkb(geometrias["geometry"].to_numpy())
+    return SegmentTable(geometrias, atributos.to_pandas(), clave, crs)
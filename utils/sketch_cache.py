@@ -0,0 +1,85 @@
+import os
+import pickle
+import shutil
+from contextlib import suppress
+import pandas as pd
+from utils.parquet_cache import CACHE_DIR, store_lock, temp_path
+
+# Días que aún pueden recibir filas (hoy y ayer, por el solape de la carga
+# incremental): sus sketches se reconstruyen; los anteriores ya no cambian
+DIAS_ABIERTOS = 2
+
+# Versión del formato de los pickles; se sube al cambiar las clases de sketches
+FORMATO = 1
+
+
+def _directorio(nombre, version):
+    return os.path.join(CACHE_DIR, "sketches", nombre, f"v{FORMATO}-{version}")
+
+
+def _ruta(nombre, version, dia):
+    return os.path.join(_directorio(nombre, version), f"day={dia:%Y-%m-%d}.pkl")
+
+
+def _leer(ruta):
+    try:
+        with open(ruta, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _guardar(ruta, sketch):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    tmp = temp_path(ruta)
+    with open(tmp, "wb") as f:
+        pickle.dump(sketch, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, ruta)
+
+
+def daily_sketches(nombre, df, construir, version, fecha="received_at"):
+    """Sketch fusionado de todos los días de `df`, persistido día a día.
+
+    Cada día cerrado se construye una sola vez con `construir(filas_del_día)`
+    y se guarda en CACHE_DIR/sketches/<nombre>/v<FORMATO>-<version>; en
+    llamadas posteriores se lee de disco y solo se recorren las filas de los
+    días abiertos. `version` identifica los parámetros del sketch (p. ej. la
+    precisión HLL), de modo que al cambiarlos no se fusionan sketches
+    incompatibles. Los sketches deben ofrecer `merge`. Los ficheros de días
+    que ya no están en `df` y los directorios de otras versiones se borran.
+    """
+    dias_fila = pd.to_datetime(df[fecha]).dt.normalize()
+    dias = sorted(dias_fila.dropna().unique())
+    limite = pd.Timestamp.today().normalize() - pd.Timedelta(days=DIAS_ABIERTOS - 1)
+
+    total = None
+    with store_lock(f"sketches_{nombre}"):
+        for dia in map(pd.Timestamp, dias):
+            cerrado = dia < limite
+            sketch = _leer(_ruta(nombre, version, dia)) if cerrado else None
+            if sketch is None:
+                sketch = construir(df[(dias_fila == dia).to_numpy()])
+                if cerrado:
+                    _guardar(_ruta(nombre, version, dia), sketch)
+            total = sketch if total is None else total.merge(sketch)
+
+        directorio = _directorio(nombre, version)
+        vigentes = {os.path.basename(_ruta(nombre, version, pd.Timestamp(d))) for d in dias}
+        if os.path.isdir(directorio):
+            for fichero in set(os.listdir(directorio)) - vigentes:
+                if fichero.endswith(".pkl"):
+                    with suppress(FileNotFoundError):
+                        os.remove(os.path.join(directorio, fichero))
+
+        # Versiones anteriores (y ficheros sueltos del formato sin versión)
+        raiz = os.path.dirname(directorio)
+        for entrada in os.listdir(raiz) if os.path.isdir(raiz) else []:
+            ruta = os.path.join(raiz, entrada)
+            if ruta == directorio:
+                continue
+            with suppress(FileNotFoundError):
+                if os.path.isdir(ruta):
+                    shutil.rmtree(ruta)
+                else:
+                    os.remove(ruta)
+    return construir(df) if total is None else total
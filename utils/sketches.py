@@ -0,0 +1,309 @@
+import math
+import numpy as np
+import pandas as pd
+from utils.normalize import ORDEN_DIAS, HOUR_CATEGORIES
+
+# Error relativo típico por defecto de los conteos de vehículos distintos
+ERROR_HLL = 0.03
+
+_MASCARA_64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _hash64(valores):
+    """splitmix64 vectorizado: reparte station_id uniformemente en 64 bits."""
+    with np.errstate(over="ignore"):
+        z = np.asarray(valores).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return (z ^ (z >> np.uint64(31))) & _MASCARA_64
+
+
+def _bit_length(w):
+    """Número de bits significativos de cada entero sin signo (búsqueda binaria)."""
+    w = w.copy()
+    n = np.zeros(w.shape, dtype=np.int64)
+    for s in (32, 16, 8, 4, 2, 1):
+        mayor = w >= (np.uint64(1) << np.uint64(s))
+        n += mayor * s
+        w = np.where(mayor, w >> np.uint64(s), w)
+    return n + (w > 0)
+
+
+def precision_for_error(error):
+    """Precisión p (2^p registros) para un error relativo típico 1.04/sqrt(2^p)."""
+    return int(min(16, max(4, math.ceil(2 * math.log2(1.04 / error)))))
+
+
+def _registro_y_rango(valores, p):
+    """Registro destino y rango (posición del primer 1) de cada valor."""
+    h = _hash64(valores)
+    idx = (h >> np.uint64(64 - p)).astype(np.int64)
+    resto = h & np.uint64((1 << (64 - p)) - 1)
+    rango = (64 - p) - _bit_length(resto) + 1
+    return idx, rango.astype(np.uint8)
+
+
+def _estimar(registros, p):
+    """Estimador HyperLogLog con corrección de rango bajo (linear counting)."""
+    registros = np.atleast_2d(registros)
+    m = 1 << p
+    alpha = 0.7213 / (1 + 1.079 / m)
+    suma = np.sum(np.ldexp(1.0, -registros.astype(np.int64)), axis=1)
+    estimacion = alpha * m * m / suma
+    ceros = np.count_nonzero(registros == 0, axis=1)
+    lineal = m * np.log(m / np.maximum(ceros, 1))
+    return np.where((estimacion <= 2.5 * m) & (ceros > 0), lineal, estimacion)
+
+
+class DistinctSketchStore:
+    """Sketches HyperLogLog de station_id por (fecha, hora, name_osmid).
+
+    Cualquier ventana o tipo de día se responde fusionando sketches (máximo
+    por registro). Cada sketch ocupa 2^p bytes y el error relativo típico es
+    1.04/sqrt(2^p); con ERROR_HLL=0.03, p=11 y 2 KB por clave.
+    """
+
+    CLAVES = ["date", "hour", "name_osmid"]
+
+    def __init__(self, error=ERROR_HLL):
+        self.p = precision_for_error(error)
+        self.claves = pd.DataFrame(columns=self.CLAVES)
+        self.registros = np.zeros((0, 1 << self.p), dtype=np.uint8)
+
+    def update(self, fechas, horas, tramos, station_ids):
+        """Añade observaciones; las claves nuevas se crean y las existentes se fusionan."""
+        obs = pd.DataFrame({
+            "date": pd.to_datetime(pd.Series(fechas)).dt.normalize().to_numpy(),
+            "hour": np.asarray(horas, dtype=np.int8),
+            "name_osmid": pd.Series(tramos).astype(str).to_numpy(),
+        })
+        validos = pd.notna(np.asarray(station_ids, dtype=float)) & (obs["hour"].to_numpy() >= 0)
+        obs = obs[validos]
+        ids = np.asarray(station_ids, dtype=float)[validos]
+
+        # Código de clave de cada observación, reutilizando las ya existentes
+        todas = pd.concat([self.claves, obs.drop_duplicates()], ignore_index=True).drop_duplicates(self.CLAVES)
+        todas = todas.reset_index(drop=True)
+        n_nuevas = len(todas) - len(self.claves)
+        if n_nuevas:
+            self.registros = np.vstack([self.registros, np.zeros((n_nuevas, 1 << self.p), dtype=np.uint8)])
+        self.claves = todas
+        indice = pd.MultiIndex.from_frame(todas[self.CLAVES])
+        fila = indice.get_indexer(pd.MultiIndex.from_frame(obs[self.CLAVES]))
+
+        idx, rango = _registro_y_rango(ids.astype(np.uint64), self.p)
+        np.maximum.at(self.registros, (fila, idx), rango)
+        return self
+
+    def merge(self, otro):
+        """Fusiona otro almacén de la misma precisión (máximo por registro en las claves comunes)."""
+        todas = pd.concat([self.claves, otro.claves], ignore_index=True).drop_duplicates(self.CLAVES)
+        todas = todas.reset_index(drop=True)
+        registros = np.zeros((len(todas), 1 << self.p), dtype=np.uint8)
+        indice = pd.MultiIndex.from_frame(todas[self.CLAVES])
+        for almacen in (self, otro):
+            if len(almacen.claves):
+                fila = indice.get_indexer(pd.MultiIndex.from_frame(almacen.claves[self.CLAVES]))
+                registros[fila] = np.maximum(registros[fila], almacen.registros)
+        self.claves, self.registros = todas, registros
+        return self
+
+    @classmethod
+    def from_frame(cls, df, hora="hour", error=ERROR_HLL):
+        """Construye el almacén desde un DataFrame de CAM (received_at, hora, name_osmid, station_id)."""
+        horas = df[hora]
+        if isinstance(horas.dtype, pd.CategoricalDtype):
+            horas = horas.cat.codes
+        tramos = df["name_osmid"] if "name_osmid" in df.columns else pd.Series("", index=df.index)
+        return cls(error).update(df["received_at"], horas, tramos, df["station_id"])
+
+    def _mascara(self, fechas=None, horas=None, tramos=None, dias_semana=None):
+        """Filas de claves que cumplen los filtros."""
+        m = np.ones(len(self.claves), dtype=bool)
+        if fechas is not None:
+            m &= self.claves["date"].isin(pd.to_datetime(pd.Series(fechas)).dt.normalize()).to_numpy()
+        if horas is not None:
+            m &= self.claves["hour"].isin(horas).to_numpy()
+        if tramos is not None:
+            m &= self.claves["name_osmid"].isin([str(t) for t in tramos]).to_numpy()
+        if dias_semana is not None:
+            dias = np.asarray(ORDEN_DIAS)[pd.to_datetime(self.claves["date"]).dt.dayofweek.to_numpy()]
+            m &= np.isin(dias, list(dias_semana))
+        return m
+
+    def count(self, **filtros):
+        """Vehículos distintos estimados en la unión de las claves filtradas."""
+        m = self._mascara(**filtros)
+        if not m.any():
+            return 0
+        return int(round(_estimar(self.registros[m].max(axis=0), self.p)[0]))
+
+    def count_by(self, por, **filtros):
+        """Vehículos distintos estimados por grupo (p. ej. ["date", "hour"] o ["weekday_es", "hour"])."""
+        m = self._mascara(**filtros)
+        claves = self.claves[m].reset_index(drop=True)
+        registros = self.registros[m]
+        if "weekday_es" in por:
+            claves["weekday_es"] = pd.Categorical(
+                np.asarray(ORDEN_DIAS)[pd.to_datetime(claves["date"]).dt.dayofweek.to_numpy()],
+                categories=ORDEN_DIAS, ordered=True
+            )
+        if claves.empty:
+            return pd.DataFrame(columns=list(por) + ["vehículos"])
+
+        # Se ordenan las claves por grupo y se fusiona cada tramo contiguo con reduceat
+        grupo, unicos = pd.MultiIndex.from_frame(claves[list(por)]).factorize(sort=True)
+        orden = np.argsort(grupo, kind="stable")
+        inicios = np.flatnonzero(np.r_[True, np.diff(grupo[orden]) != 0])
+        fusion = np.maximum.reduceat(registros[orden], inicios, axis=0)
+
+        resultado = unicos.to_frame(index=False, name=list(por))
+        resultado["vehículos"] = np.round(_estimar(fusion, self.p)).astype(np.int64)
+        if "hour" in por:
+            resultado["hour_label"] = pd.Categorical.from_codes(
+                resultado["hour"].astype(np.int8), categories=HOUR_CATEGORIES, ordered=True
+            )
+        return resultado
+
+
+# Parámetro k de los sketches de cuantiles: error de rango ~1.65 % (99 % de confianza) con k=200
+K_KLL = 200
+
+
+class KLLSketch:
+    """Sketch de cuantiles KLL, fusionable y de tamaño acotado.
+
+    Cada nivel h guarda elementos de peso 2^h; cuando un nivel supera su
+    capacidad se ordena y se promueve uno de cada dos elementos al nivel
+    siguiente. Con k=200 el error de rango normalizado es del orden de 1.65 %
+    con un 99 % de confianza (la cota de referencia de KLL), así que V85
+    queda entre los percentiles ~83.4 y ~86.6 reales. Con menos de k
+    elementos el resultado es exacto.
+    """
+
+    def __init__(self, k=K_KLL, semilla=0):
+        self.k = k
+        self.niveles = [np.zeros(0, dtype=np.float32)]
+        self.n = 0
+        self._rng = np.random.default_rng(semilla)
+
+    def _capacidad(self, h):
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.niveles) - 1 - h))))
+
+    def _compactar(self):
+        """Compacta de abajo arriba hasta que cada nivel cabe en su capacidad."""
+        h = 0
+        while h < len(self.niveles):
+            nivel = self.niveles[h]
+            if len(nivel) > self._capacidad(h):
+                nivel = np.sort(nivel)
+                # Con longitud impar el último elemento se queda en el nivel
+                resto, nivel = nivel[len(nivel) & ~1:], nivel[: len(nivel) & ~1]
+                promovidos = nivel[self._rng.integers(2)::2]
+                if h + 1 == len(self.niveles):
+                    self.niveles.append(np.zeros(0, dtype=np.float32))
+                self.niveles[h + 1] = np.concatenate([self.niveles[h + 1], promovidos])
+                self.niveles[h] = resto
+                # Un nivel nuevo reduce la capacidad de los inferiores: se revisa desde abajo
+                h = 0
+                continue
+            h += 1
+
+    def update(self, valores):
+        """Añade un lote de valores (se ignoran los NaN)."""
+        valores = np.asarray(valores, dtype=np.float32)
+        valores = valores[~np.isnan(valores)]
+        if len(valores):
+            self.niveles[0] = np.concatenate([self.niveles[0], valores])
+            self.n += len(valores)
+            self._compactar()
+        return self
+
+    def merge(self, otro):
+        """Fusiona otro sketch en este."""
+        while len(self.niveles) < len(otro.niveles):
+            self.niveles.append(np.zeros(0, dtype=np.float32))
+        for h, nivel in enumerate(otro.niveles):
+            self.niveles[h] = np.concatenate([self.niveles[h], nivel])
+        self.n += otro.n
+        self._compactar()
+        return self
+
+    def quantiles(self, qs):
+        """Cuantiles aproximados para una lista de probabilidades."""
+        if self.n == 0:
+            return np.full(len(qs), np.nan)
+        valores = np.concatenate(self.niveles)
+        pesos = np.concatenate([np.full(len(nivel), 2.0 ** h) for h, nivel in enumerate(self.niveles)])
+        orden = np.argsort(valores, kind="stable")
+        acumulado = np.cumsum(pesos[orden])
+        posiciones = np.searchsorted(acumulado, np.asarray(qs) * acumulado[-1], side="left")
+        return valores[orden][np.minimum(posiciones, len(valores) - 1)].astype(np.float64)
+
+    def quantile(self, q):
+        return float(self.quantiles([q])[0])
+
+
+class QuantileSketchStore:
+    """Sketches KLL de una medida (p. ej. speed_kmh) por las claves indicadas.
+
+    Los cuantiles de cualquier combinación de claves (una hora, un día de la
+    semana, un tramo...) se obtienen fusionando sus sketches.
+    """
+
+    def __init__(self, claves, k=K_KLL):
+        self.claves = list(claves)
+        self.k = k
+        self.sketches = {}
+
+    def update(self, df, valor="speed_kmh"):
+        """Añade las filas de `df` al sketch de su clave."""
+        for clave, grupo in df.groupby(self.claves, observed=True, sort=False)[valor]:
+            clave = clave if isinstance(clave, tuple) else (clave,)
+            sketch = self.sketches.get(clave)
+            if sketch is None:
+                sketch = self.sketches[clave] = KLLSketch(self.k)
+            sketch.update(grupo.to_numpy())
+        return self
+
+    def merge(self, otro):
+        """Fusiona otro almacén con las mismas claves; `otro` no se modifica."""
+        for clave, sketch in otro.sketches.items():
+            propio = self.sketches.get(clave)
+            if propio is None:
+                propio = self.sketches[clave] = KLLSketch(self.k)
+            propio.merge(sketch)
+        return self
+
+    @classmethod
+    def from_frame(cls, df, claves, valor="speed_kmh", k=K_KLL):
+        return cls(claves, k).update(df, valor)
+
+    def _seleccion(self, filtros):
+        """Claves que cumplen los filtros {columna: valores}."""
+        posiciones = {c: i for i, c in enumerate(self.claves)}
+        return [
+            clave for clave in self.sketches
+            if all(clave[posiciones[c]] in set(v) for c, v in filtros.items())
+        ]
+
+    def quantiles(self, qs, **filtros):
+        """Cuantiles de la unión de las claves filtradas."""
+        fusion = KLLSketch(self.k)
+        for clave in self._seleccion(filtros):
+            fusion.merge(self.sketches[clave])
+        return fusion.quantiles(qs)
+
+    def quantile(self, q, **filtros):
+        return float(self.quantiles([q], **filtros)[0])
+
+    def quantiles_by(self, por, qs, **filtros):
+        """Cuantiles por grupo; una columna por probabilidad (q25, q75...)."""
+        posiciones = [self.claves.index(c) for c in por]
+        grupos = {}
+        for clave in self._seleccion(filtros):
+            grupo = tuple(clave[i] for i in posiciones)
+            grupos.setdefault(grupo, KLLSketch(self.k)).merge(self.sketches[clave])
+        filas = [list(grupo) + list(sketch.quantiles(qs)) for grupo, sketch in grupos.items()]
+        columnas = list(por) + [f"q{int(round(q * 100))}" for q in qs]
+        return pd.DataFrame(filas, columns=columnas).sort_values(list(por)).reset_index(drop=True)
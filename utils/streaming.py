@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from utils.schema import apply_schema
+
+# Filas por bloque leídas del cursor de servidor
+CHUNK_SIZE = 100_000
+
+
+def coerce_chunk(chunk):
+    """Tipos de un bloque, todo vectorizado.
+
+    received_at pasa a datetime y el resto de columnas al esquema declarado
+    en utils.schema. hour_label no se deriva aquí: lo hace utils.normalize.
+    """
+    if "received_at" in chunk.columns:
+        chunk["received_at"] = pd.to_datetime(chunk["received_at"])
+    return apply_schema(chunk)
+
+
+class ColumnBuffers:
+    """Buffers numpy donde se van copiando los bloques por columna.
+
+    Las columnas numéricas, de fecha y categóricas se copian en arrays que
+    crecen de forma geométrica; las cadenas Arrow y los enteros nullable se
+    guardan como trozos de pyarrow (sin pasar por objetos de Python) y se
+    unen al final.
+    """
+
+    def __init__(self, n_filas):
+        self.capacidad = n_filas
+        self.n = 0
+        self.arrays = {}
+        self.categorias = {}
+        self.zonas = {}
+        self.extension = {}
+        self.trozos = {}
+
+    def _crecer(self, minimo):
+        """Amplía los buffers cuando el bloque no cabe (x1.25 o lo necesario)."""
+        self.capacidad = max(minimo, int(self.capacidad * 1.25) + 1)
+        for col, arr in self.arrays.items():
+            nuevo = np.empty(self.capacidad, dtype=arr.dtype)
+            nuevo[:self.n] = arr[:self.n]
+            self.arrays[col] = nuevo
+
+    def append(self, chunk):
+        """Copia un bloque en los buffers y lo libera."""
+        fin = self.n + len(chunk)
+        if fin > self.capacidad:
+            self._crecer(fin)
+
+        for col in chunk.columns:
+            serie = chunk[col]
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                previo = self.categorias.get(col)
+                if previo is not None and not previo.categories.equals(serie.cat.categories):
+                    # Categorías nuevas al final: los códigos ya copiados siguen valiendo
+                    nuevas = serie.cat.categories.difference(previo.categories, sort=False)
+                    serie = serie.cat.set_categories(previo.categories.append(nuevas))
+                self.categorias[col] = serie.dtype
+                valores = serie.cat.codes.to_numpy()
+            elif isinstance(serie.dtype, pd.DatetimeTZDtype):
+                self.zonas[col] = serie.dt.tz
+                valores = serie.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy()
+            elif col in self.trozos or pd.api.types.is_extension_array_dtype(serie.dtype):
+                # Cadenas Arrow y enteros nullable: trozos pyarrow, sin objetos de Python
+                self._append_arrow(col, serie)
+                continue
+            else:
+                valores = serie.to_numpy()
+
+            arr = self.arrays.get(col)
+            if arr is None:
+                arr = np.empty(self.capacidad, dtype=valores.dtype)
+            elif not np.can_cast(valores.dtype, arr.dtype, casting="safe"):
+                # Un bloque con nulos convierte enteros en float, por ejemplo
+                arr = arr.astype(np.result_type(arr.dtype, valores.dtype))
+            arr[self.n:fin] = valores
+            self.arrays[col] = arr
+        self.n = fin
+
+    def _append_arrow(self, col, serie):
+        """Añade un bloque como trozo pyarrow del tipo de la columna.
+
+        Si la columna ya tenía un buffer numpy (p. ej. enteros sin nulos en
+        los primeros bloques) su contenido pasa a ser el primer trozo.
+        """
+        if pd.api.types.is_extension_array_dtype(serie.dtype):
+            self.extension[col] = serie.dtype
+            trozo = pa.array(serie.array)
+        else:
+            trozo = pa.array(serie.to_numpy())
+
+        trozos = self.trozos.get(col)
+        if trozos is None:
+            previo = self.arrays.pop(col, None)
+            trozos = self.trozos[col] = [] if previo is None else [pa.array(previo[:self.n]).cast(trozo.type)]
+        trozos.append(trozo.cast(trozos[0].type) if trozos else trozo)
+
+    def to_frame(self):
+        """Construye el DataFrame final sobre los buffers sin copiar."""
+        columnas = {}
+        for col, arr in self.arrays.items():
+            valores = arr[:self.n]
+            if col in self.categorias:
+                valores = pd.Categorical.from_codes(valores, dtype=self.categorias[col])
+            elif col in self.zonas:
+                valores = pd.DatetimeIndex(valores).tz_localize("UTC").tz_convert(self.zonas[col])
+            columnas[col] = valores
+        for col, trozos in self.trozos.items():
+            columnas[col] = self.extension[col].__from_arrow__(pa.chunked_array(trozos))
+        return pd.DataFrame(columnas, copy=False)
+
+
+def read_sql_chunked(engine, query, params=None, chunksize=CHUNK_SIZE):
+    """Lee `query` por bloques con cursor de servidor y memoria acotada.
+
+    La consulta se ejecuta una sola vez: los buffers empiezan con un bloque
+    de capacidad y crecen según llegan filas. Cada bloque se tipa con
+    `coerce_chunk` y se copia en ellos, así que el pico ronda el tamaño final
+    (más el margen de crecimiento) más un bloque.
+    """
+    params = params or {}
+    opciones = {"stream_results": True, "max_row_buffer": chunksize}
+
+    with engine.connect() as conn:
+        conn = conn.execution_options(**opciones)
+        with conn.begin():
+            buffers = ColumnBuffers(chunksize)
+            for chunk in pd.read_sql(query, conn, params=params, chunksize=chunksize):
+                buffers.append(coerce_chunk(chunk))
+                del chunk
+
+    return buffers.to_frame()
@@ -0,0 +1,206 @@
+import threading
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from utils.geometry_store import segment_lengths_m
+from utils.sketches import ERROR_HLL, K_KLL, KLLSketch, precision_for_error, _registro_y_rango, _estimar
+
+# Ancho de los buckets temporales y ventana por defecto del mapa
+ANCHO_BUCKET = pd.Timedelta(minutes=5)
+VENTANA = pd.Timedelta(hours=1)
+
+# Momentos de cada medida que se pueden sumar y restar entre buckets
+MEDIDAS = {"speed": "speed_kmh", "long_acc": "longitudinal_acc", "lat_acc": "lateral_acc"}
+
+# Umbrales de densidad (veh/km/carril) de los niveles de servicio A–F (HCM, autopistas)
+UMBRALES_NIVEL = [7, 11, 16, 22, 28]
+NIVELES = np.array(list("ABCDEF"))
+
+
+class _Bucket:
+    """Estado fusionable de un intervalo de tiempo, con una fila por tramo."""
+
+    def __init__(self, n_tramos, p):
+        self.n = np.zeros(n_tramos, dtype=np.int64)
+        self.sumas = {m: np.zeros(n_tramos) for m in MEDIDAS}
+        self.cuadrados = np.zeros(n_tramos)
+        self.minimo = np.full(n_tramos, np.inf)
+        self.maximo = np.full(n_tramos, -np.inf)
+        self.registros = np.zeros((n_tramos, 1 << p), dtype=np.uint8)
+        self.cuantiles = {}
+
+    def crecer(self, n_tramos):
+        extra = n_tramos - len(self.n)
+        if extra <= 0:
+            return
+        self.n = np.append(self.n, np.zeros(extra, dtype=np.int64))
+        self.sumas = {m: np.append(v, np.zeros(extra)) for m, v in self.sumas.items()}
+        self.cuadrados = np.append(self.cuadrados, np.zeros(extra))
+        self.minimo = np.append(self.minimo, np.full(extra, np.inf))
+        self.maximo = np.append(self.maximo, np.full(extra, -np.inf))
+        self.registros = np.vstack([self.registros, np.zeros((extra, self.registros.shape[1]), dtype=np.uint8)])
+
+
+class TramoMetricsState:
+    """Métricas por osm_id mantenidas de forma incremental en buckets de 5 minutos.
+
+    Cada bucket guarda por tramo: número de mensajes, sumas y suma de
+    cuadrados, mínimo/máximo, un sketch KLL de velocidad y un HyperLogLog de
+    station_id. Un lote nuevo solo toca los buckets de sus filas. Para la
+    ventana móvil, los momentos se mantienen en un acumulado al que se restan
+    los buckets que caducan; mínimo, máximo, cuantiles y vehículos distintos
+    no admiten resta y se obtienen fusionando los buckets vivos (12 en una hora).
+    """
+
+    def __init__(self, ventana=VENTANA, ancho=ANCHO_BUCKET, error=ERROR_HLL, k=K_KLL):
+        self.ventana = ventana
+        self.ancho = ancho
+        self.k = k
+        self.p = precision_for_error(error)
+        self.tramos = pd.Index([], dtype=object, name="osm_id")
+        self.buckets = {}
+        self.acumulado = _Bucket(0, self.p)
+        self.ultimo = None
+        # El estado se comparte entre sesiones de Streamlit
+        self.lock = threading.Lock()
+
+    def _codigos(self, osm_ids):
+        """Código entero de cada osm_id; los tramos nuevos se añaden al final."""
+        osm_ids = pd.Series(osm_ids).astype(str).to_numpy()
+        nuevos = pd.Index(pd.unique(osm_ids)).difference(self.tramos)
+        if len(nuevos):
+            self.tramos = self.tramos.append(nuevos).rename("osm_id")
+            for bucket in [self.acumulado, *self.buckets.values()]:
+                bucket.crecer(len(self.tramos))
+        return self.tramos.get_indexer(osm_ids)
+
+    def update(self, df):
+        """Incorpora un lote de CAM (osm_id, station_id, speed_kmh, aceleraciones, received_at)."""
+        df = df[df["osm_id"].notna() & df["speed_kmh"].notna()]
+        if df.empty:
+            return self
+        codigos = self._codigos(df["osm_id"])
+        inicios = df["received_at"].dt.floor(self.ancho).to_numpy()
+        n_tramos = len(self.tramos)
+
+        for inicio in np.unique(inicios):
+            filas = inicios == inicio
+            cod = codigos[filas]
+            bucket = self.buckets.get(pd.Timestamp(inicio))
+            if bucket is None:
+                bucket = self.buckets[pd.Timestamp(inicio)] = _Bucket(n_tramos, self.p)
+            bucket.crecer(n_tramos)
+            velocidad = df["speed_kmh"].to_numpy(dtype=np.float64)[filas]
+            cuenta = np.bincount(cod, minlength=n_tramos)
+            sumas = {
+                m: np.bincount(cod, weights=np.nan_to_num(df[col].to_numpy(dtype=np.float64)[filas]), minlength=n_tramos)
+                for m, col in MEDIDAS.items()
+            }
+            cuadrados = np.bincount(cod, weights=velocidad ** 2, minlength=n_tramos)
+
+            for destino in (bucket, self.acumulado):
+                destino.n += cuenta
+                for m in MEDIDAS:
+                    destino.sumas[m] += sumas[m]
+                destino.cuadrados += cuadrados
+            np.minimum.at(bucket.minimo, cod, velocidad)
+            np.maximum.at(bucket.maximo, cod, velocidad)
+
+            estaciones = df["station_id"].to_numpy(dtype=np.float64)[filas]
+            validas = ~np.isnan(estaciones)
+            idx, rango = _registro_y_rango(estaciones[validas].astype(np.uint64), self.p)
+            np.maximum.at(bucket.registros, (cod[validas], idx), rango)
+
+            # Un sketch de cuantiles por tramo con datos en el lote
+            orden = np.argsort(cod, kind="stable")
+            tramos_lote, cortes = np.unique(cod[orden], return_index=True)
+            for codigo, grupo in zip(tramos_lote, np.split(velocidad[orden], cortes[1:])):
+                bucket.cuantiles.setdefault(codigo, KLLSketch(self.k)).update(grupo)
+
+        fin = df["received_at"].max()
+        self.ultimo = fin if self.ultimo is None else max(self.ultimo, fin)
+        self.expire()
+        return self
+
+    def expire(self, ahora=None):
+        """Descarta los buckets fuera de la ventana y los resta del acumulado."""
+        ahora = self.ultimo if ahora is None else ahora
+        if ahora is None:
+            return self
+        limite = ahora - self.ventana
+        for inicio in [i for i in self.buckets if i + self.ancho <= limite]:
+            bucket = self.buckets.pop(inicio)
+            self.acumulado.n -= bucket.n
+            for m in MEDIDAS:
+                self.acumulado.sumas[m] -= bucket.sumas[m]
+            self.acumulado.cuadrados -= bucket.cuadrados
+        return self
+
+    def window(self, ahora=None):
+        """Métricas por osm_id de la ventana móvil que termina en `ahora`.
+
+        Sin `ahora` la ventana se mide desde el último dato recibido; las
+        páginas pasan la hora actual para que un feed detenido no deje
+        métricas antiguas a la vista.
+        """
+        if ahora is not None:
+            self.expire(ahora)
+        columnas = ["osm_id", "n_mensajes", "conteo_vehiculos", "speed_mean", "speed_std", "speed_min",
+                    "speed_max", "speed_q25", "speed_q75", "long_acc_mean", "lat_acc_mean"]
+        if not self.buckets:
+            return pd.DataFrame(columns=columnas)
+        n_tramos = len(self.tramos)
+        vivos = list(self.buckets.values())
+        for bucket in vivos:
+            bucket.crecer(n_tramos)
+
+        a = self.acumulado
+        n = a.n.astype(np.float64)
+        con_datos = a.n > 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            media = a.sumas["speed"] / n
+            varianza = (a.cuadrados - n * media ** 2) / (n - 1)
+            metricas = pd.DataFrame({
+                "osm_id": self.tramos,
+                "n_mensajes": a.n,
+                "speed_mean": media,
+                "speed_std": np.sqrt(np.clip(varianza, 0, None)),
+                "speed_min": np.min([b.minimo for b in vivos], axis=0),
+                "speed_max": np.max([b.maximo for b in vivos], axis=0),
+                "long_acc_mean": a.sumas["long_acc"] / n,
+                "lat_acc_mean": a.sumas["lat_acc"] / n,
+            })
+        metricas["conteo_vehiculos"] = np.round(
+            _estimar(np.max([b.registros for b in vivos], axis=0), self.p)
+        ).astype(np.int64)
+
+        cuartiles = np.full((n_tramos, 2), np.nan)
+        for codigo in np.flatnonzero(con_datos):
+            fusion = KLLSketch(self.k)
+            for bucket in vivos:
+                if codigo in bucket.cuantiles:
+                    fusion.merge(bucket.cuantiles[codigo])
+            cuartiles[codigo] = fusion.quantiles([0.25, 0.75])
+        metricas["speed_q25"], metricas["speed_q75"] = cuartiles[:, 0], cuartiles[:, 1]
+
+        return metricas[con_datos][columnas].reset_index(drop=True)
+
+
+def level_of_service(metricas, m30):
+    """Une las métricas con m30 por código y clasifica el nivel de servicio (A–F).
+
+    La densidad es vehículos por km y carril, con la longitud en EPSG:25830
+    precompilada en el almacén de geometrías.
+    """
+    codigos = pd.Index(m30["osm_id"].astype(str)).get_indexer(metricas["osm_id"].astype(str))
+    metricas = metricas[codigos >= 0].reset_index(drop=True)
+    codigos = codigos[codigos >= 0]
+
+    tramos = m30.iloc[codigos].reset_index(drop=True)
+    carriles = pd.to_numeric(tramos["lanes"], errors="coerce").fillna(1).clip(lower=1).to_numpy()
+    metricas["longitud_km"] = segment_lengths_m(m30)[codigos] / 1000
+    metricas["densidad"] = metricas["conteo_vehiculos"] / metricas["longitud_km"] / carriles
+    metricas["nivel_servicio"] = NIVELES[np.searchsorted(UMBRALES_NIVEL, metricas["densidad"].to_numpy(), side="left")]
+    for columna in ["name", "maxspeed", "fclass", "ref", "lanes"]:
+        metricas[columna] = tramos[columna].to_numpy()
+    return gpd.GeoDataFrame(metricas, geometry=tramos.geometry.to_numpy(), crs=m30.crs)